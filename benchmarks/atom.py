@@ -0,0 +1,118 @@
+# Copyright (C) 2011 by Florian Mayer <florian.mayer@bitsrc.org>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+""" Measure the read throughput of threads sharing a map while other
+threads write to it, through an Atom and through a coarse lock held
+around every read and read-modify-write.
+
+Run as `python -m benchmarks.atom [readers [writers [seconds]]]`. """
+
+import os
+import random
+import sys
+import threading
+import time
+
+from burrahobbit import Atom
+from burrahobbit.treedict import PersistentTreeMap
+
+
+class Locked(object):
+    """ Map behind a lock that readers hold while they read and writers
+    while they compute the new version, for comparison with Atom. """
+    def __init__(self, value):
+        self.value = value
+        self.lock = threading.Lock()
+    
+    def read(self, fn):
+        self.lock.acquire()
+        try:
+            return fn(self.value)
+        finally:
+            self.lock.release()
+    
+    def swap(self, fn, *args):
+        self.lock.acquire()
+        try:
+            self.value = fn(self.value, *args)
+            return self.value
+        finally:
+            self.lock.release()
+
+
+def run(cell, keys, readers, writers, seconds):
+    """ Return (reads, writes) per second done by the threads. """
+    stop = []
+    reads = [0] * readers
+    writes = [0] * writers
+    
+    def read(idx):
+        rnd = random.Random(idx)
+        done = 0
+        def lookups(mp):
+            for _ in xrange(100):
+                mp.get(rnd.choice(keys))
+        while not stop:
+            if isinstance(cell, Locked):
+                cell.read(lookups)
+            else:
+                lookups(cell.deref())
+            done += 100
+        reads[idx] = done
+    
+    def write(idx):
+        rnd = random.Random(-idx)
+        done = 0
+        while not stop:
+            cell.swap(PersistentTreeMap.assoc, rnd.choice(keys), done)
+            done += 1
+        writes[idx] = done
+    
+    threads = [
+        threading.Thread(target=read, args=(idx, )) for idx in xrange(readers)
+    ] + [
+        threading.Thread(target=write, args=(idx, ))
+        for idx in xrange(writers)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.append(True)
+    for thread in threads:
+        thread.join()
+    return sum(reads) / seconds, sum(writes) / seconds
+
+
+def main(readers, writers, seconds):
+    keys = [os.urandom(20) for _ in xrange(100000)]
+    mp = PersistentTreeMap.from_itr((key, None) for key in keys)
+    print '%-8s %8s %8s %12s %12s %10s' % (
+        'cell', 'readers', 'writers', 'reads/s', 'writes/s', 'conflicts'
+    )
+    for name, cell in [('atom', Atom(mp)), ('lock', Locked(mp))]:
+        reads, writes = run(cell, keys, readers, writers, seconds)
+        print '%-8s %8d %8d %12.0f %12.0f %10s' % (
+            name, readers, writers, reads, writes,
+            getattr(cell, 'conflicts', '-')
+        )
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:] + ['4', '2', '2'][len(sys.argv) - 1:]
+    main(int(args[0]), int(args[1]), float(args[2]))
@@ -0,0 +1,73 @@
+# Copyright (C) 2011 by Florian Mayer <florian.mayer@bitsrc.org>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+""" Compare the bulk loader used by from_dict and from_set against
+inserting one key after the other into a transient.
+
+Run as `python -m benchmarks.bulk [size ...]`. """
+
+import os
+import sys
+import time
+
+from burrahobbit.treedict import PersistentTreeMap, TransientTreeMap
+from burrahobbit.treeset import PersistentTreeSet, TransientTreeSet
+
+
+def timed(fn, *args):
+    """ Return the seconds it took to call fn with args. """
+    start = time.time()
+    fn(*args)
+    return time.time() - start
+
+
+def incremental_dict(dct):
+    mp = TransientTreeMap()
+    for key, value in dct.iteritems():
+        mp = mp.assoc(key, value)
+    return mp.persistent()
+
+
+def incremental_set(set_):
+    st = TransientTreeSet()
+    for key in set_:
+        st = st.add(key)
+    return st.persistent()
+
+
+def main(sizes):
+    print '%-6s %10s %14s %12s %8s' % (
+        'type', 'size', 'incremental', 'bulk', 'speedup'
+    )
+    for size in sizes:
+        dct = dict((os.urandom(20), os.urandom(25)) for _ in xrange(size))
+        for name, data, incremental, bulk in [
+            ('dict', dct, incremental_dict, PersistentTreeMap.from_dict),
+            ('set', set(dct), incremental_set, PersistentTreeSet.from_set),
+        ]:
+            old = timed(incremental, data)
+            new = timed(bulk, data)
+            print '%-6s %10d %13.4fs %11.4fs %7.2fx' % (
+                name, size, old, new, old / max(new, 1e-9)
+            )
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000, 1000000])
@@ -0,0 +1,88 @@
+# Copyright (C) 2011 by Florian Mayer <florian.mayer@bitsrc.org>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+""" Measure lookups in maps whose keys all have the same hash, as keys
+chosen by an attacker would, against the builtin dict.
+
+Run as `python -m benchmarks.collisions [size ...]`. Integers are kept
+sorted once their HashCollisionNode grows large, so the time per lookup
+grows with the logarithm of the number of colliding keys. Keys that
+cannot be ordered are still searched linearly, which is shown as
+`opaque` for comparison. """
+
+import sys
+import time
+
+from burrahobbit.treedict import PersistentTreeMap
+
+
+class Opaque(object):
+    """ Key with a constant hash that cannot be ordered. """
+    __slots__ = ['item']
+    def __init__(self, item):
+        self.item = item
+    
+    def __hash__(self):
+        return 5
+    
+    def __eq__(self, other):
+        return isinstance(other, Opaque) and self.item == other.item
+
+
+def colliding_ints(size):
+    """ Return list of size distinct ints that all have the same hash. """
+    try:
+        modulus = sys.hash_info.modulus
+    except AttributeError:
+        modulus = 2 * sys.maxint + 1
+    return [5 + item * modulus for item in xrange(size)]
+
+
+def lookups(mapping, keys):
+    """ Return the microseconds per lookup of the keys in mapping. """
+    start = time.time()
+    for key in keys:
+        mapping[key]
+    return (time.time() - start) / len(keys) * 1e6
+
+
+def main(sizes):
+    print '%8s %12s %12s %12s %12s' % (
+        'size', 'build [s]', 'get [us]', 'dict [us]', 'opaque [us]'
+    )
+    for size in sizes:
+        keys = colliding_ints(size)
+        start = time.time()
+        mp = PersistentTreeMap.from_itr((key, key) for key in keys)
+        built = time.time() - start
+        
+        # Lookups in the builtin dict and of opaque keys take time linear
+        # in size, so only a sample of them is measured for large sizes.
+        sample = keys[::max(1, size // 1000)]
+        dct = dict((key, key) for key in keys)
+        opaque = [Opaque(key) for key in keys]
+        omp = PersistentTreeMap.from_itr((key, key) for key in opaque)
+        print '%8d %12.3f %12.2f %12.2f %12.2f' % (
+            size, built, lookups(mp, keys), lookups(dct, sample),
+            lookups(omp, opaque[::max(1, size // 1000)])
+        )
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [10, 100, 1000, 10000])
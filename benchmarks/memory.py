@@ -0,0 +1,92 @@
+# Copyright (C) 2011 by Florian Mayer <florian.mayer@bitsrc.org>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+""" Measure the memory used by the nodes of maps and sets, not counting
+the keys and values themselves, and compare it with the builtin dict and
+set.
+
+Run as `python -m benchmarks.memory [size ...]`. """
+
+import gc
+import os
+import sys
+
+from types import ModuleType
+
+import burrahobbit
+from burrahobbit._tree import NULLNODE, SENTINEL
+
+
+def deep_size(obj, exclude=()):
+    """ Return the bytes of all objects reachable from obj, counting
+    every object once and skipping types as well as the objects in
+    exclude. """
+    seen = set(id(elem) for elem in exclude)
+    seen.update([id(NULLNODE), id(SENTINEL)])
+    total = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, type):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        stack.extend(gc.get_referents(obj))
+    return total
+
+
+def reachable(objs):
+    """ Return list of all objects reachable from the objects in objs,
+    including them, skipping types and modules like :func:`deep_size`
+    skips types. """
+    seen = set()
+    found = []
+    stack = list(objs)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, (type, ModuleType)):
+            continue
+        seen.add(id(obj))
+        found.append(obj)
+        stack.extend(gc.get_referents(obj))
+    return found
+
+
+def main(sizes):
+    print '%-6s %10s %14s %12s %14s %12s' % (
+        'type', 'size', 'burrahobbit', 'per entry', 'builtin', 'per entry'
+    )
+    for size in sizes:
+        dct = dict((os.urandom(8), os.urandom(8)) for _ in xrange(size))
+        entries = dct.keys() + dct.values()
+        for name, ours, builtin in [
+            ('dict', burrahobbit.dict(dct), dct),
+            ('set', burrahobbit.set(dct), set(dct)),
+        ]:
+            mine = deep_size(ours, entries)
+            theirs = sys.getsizeof(builtin)
+            print '%-6s %10d %14d %12.1f %14d %12.1f' % (
+                name, size, mine, float(mine) / size,
+                theirs, float(theirs) / size
+            )
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000, 1000000])
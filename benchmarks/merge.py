@@ -0,0 +1,79 @@
+# Copyright (C) 2011 by Florian Mayer <florian.mayer@bitsrc.org>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+""" Measure merging partial counts with PersistentTreeMap.merge_with
+against adding the entries of every partial map one by one.
+
+Run as `python -m benchmarks.merge [maps [size]]`. The default merges 64
+maps of 100000 keys; `python -m benchmarks.merge 64 1000000` merges 64
+maps of a million keys each. Every map counts a random sample of size
+keys out of 2 * size, so about half of the keys of every map are
+already contained in the merged result. """
+
+import operator
+import random
+import sys
+import time
+
+from burrahobbit.treedict import PersistentTreeMap
+
+
+def partial(rnd, size):
+    """ Return PersistentTreeMap counting size random keys once. """
+    return PersistentTreeMap.from_itr(
+        (key, 1) for key in rnd.sample(xrange(2 * size), size)
+    )
+
+
+def by_hand(merged, mp):
+    """ Return merged with the counts of mp added entry by entry. """
+    tr = merged.transient()
+    get, assoc = tr.get, tr.assoc
+    for key, value in mp.iteritems():
+        assoc(key, get(key, 0) + value)
+    return tr.persistent()
+
+
+def main(maps, size):
+    print '%-10s %10s' % ('method', 'time [s]')
+    results = []
+    for name, merge in [
+        ('merge_with', lambda merged, mp: merged.merge_with(operator.add, mp)),
+        ('by hand', by_hand),
+    ]:
+        # The partial maps are created one at a time so that only two of
+        # them need to fit into memory; creating them is not measured.
+        rnd = random.Random(1)
+        merged = PersistentTreeMap()
+        elapsed = 0
+        for _ in xrange(maps):
+            mp = partial(rnd, size)
+            start = time.time()
+            merged = merge(merged, mp)
+            elapsed += time.time() - start
+        print '%-10s %10.2f' % (name, elapsed)
+        results.append(merged)
+    assert results[0] == results[1]
+    assert sum(results[0].itervalues()) == maps * size
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    main((args or [64])[0], (args[1:] or [100000])[0])
@@ -0,0 +1,81 @@
+# Copyright (C) 2011 by Florian Mayer <florian.mayer@bitsrc.org>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+""" Measure PersistentTreeMap.parallel_map_values with pools of several
+sizes against mapping the values in this process, and how long split
+and join take by themselves.
+
+Run as `python -m benchmarks.parallel [size [processes ...]]`. The
+speedup can only be linear in the number of processes up to the number
+of cores. """
+
+import hashlib
+import multiprocessing
+import os
+import sys
+import time
+
+from burrahobbit.treedict import PersistentTreeMap
+
+ROUNDS = 100
+
+
+def digest(value):
+    """ Return the value hashed ROUNDS times, which is CPU-bound. """
+    for _ in xrange(ROUNDS):
+        value = hashlib.sha1(value).digest()
+    return value
+
+
+def main(size, processes):
+    mp = PersistentTreeMap.from_itr(
+        (os.urandom(20), os.urandom(20)) for _ in xrange(size)
+    )
+    
+    start = time.time()
+    for _ in xrange(1000):
+        PersistentTreeMap.join(mp.split(32))
+    print 'split and join of %d entries: %.1fus' % (
+        size, (time.time() - start) * 1000
+    )
+    
+    start = time.time()
+    expected = PersistentTreeMap.from_itr(
+        (key, digest(value)) for key, value in mp.iteritems()
+    )
+    serial = time.time() - start
+    print '%-10s %10s %10s' % ('processes', 'time [s]', 'speedup')
+    print '%-10s %10.2f %10s' % ('serial', serial, '1.00x')
+    for number in processes:
+        pool = multiprocessing.Pool(number)
+        start = time.time()
+        result = mp.parallel_map_values(digest, pool)
+        elapsed = time.time() - start
+        pool.close()
+        pool.join()
+        assert result == expected
+        print '%-10d %10.2f %9.2fx' % (number, elapsed, serial / elapsed)
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(
+        (args or [100000])[0],
+        args[1:] or [1, 2, 4, multiprocessing.cpu_count()]
+    )
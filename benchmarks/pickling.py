@@ -0,0 +1,67 @@
+# Copyright (C) 2011 by Florian Mayer <florian.mayer@bitsrc.org>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+""" Compare the size of pickled maps and sets and the time it takes to
+dump and load them against the builtin dict and set.
+
+Run as `python -m benchmarks.pickling [size ...]`. """
+
+import os
+import sys
+import time
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from burrahobbit.treedict import PersistentTreeMap
+from burrahobbit.treeset import PersistentTreeSet
+
+
+def timed(fn, *args):
+    """ Return the result of calling fn with args and the seconds it
+    took. """
+    start = time.time()
+    result = fn(*args)
+    return result, time.time() - start
+
+
+def main(sizes):
+    print '%-10s %10s %12s %10s %10s' % (
+        'type', 'size', 'bytes', 'dump', 'load'
+    )
+    protocol = pickle.HIGHEST_PROTOCOL
+    for size in sizes:
+        dct = dict((os.urandom(8), os.urandom(8)) for _ in xrange(size))
+        for name, obj in [
+            ('dict', PersistentTreeMap.from_dict(dct)),
+            ('builtin', dct),
+            ('set', PersistentTreeSet.from_set(dct)),
+            ('builtin', set(dct)),
+        ]:
+            data, dump = timed(pickle.dumps, obj, protocol)
+            _, load = timed(pickle.loads, data)
+            print '%-10s %10d %12d %9.4fs %9.4fs' % (
+                name, size, len(data), dump, load
+            )
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000, 1000000])
@@ -0,0 +1,65 @@
+# Copyright (C) 2011 by Florian Mayer <florian.mayer@bitsrc.org>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+""" Compare the throughput of full scans over maps and sets against the
+builtin dict and set.
+
+Run as `python -m benchmarks.scan [size ...]`. """
+
+import os
+import sys
+import time
+
+from burrahobbit.treedict import PersistentTreeMap
+from burrahobbit.treeset import PersistentTreeSet
+
+
+def scan(itr):
+    """ Return the seconds it took to exhaust itr. """
+    start = time.time()
+    for _ in itr:
+        pass
+    return time.time() - start
+
+
+def main(sizes):
+    print '%-10s %10s %14s %14s %8s' % (
+        'scan', 'size', 'burrahobbit', 'builtin', 'ratio'
+    )
+    for size in sizes:
+        dct = dict((os.urandom(20), os.urandom(25)) for _ in xrange(size))
+        mp = PersistentTreeMap.from_dict(dct)
+        set_ = set(dct)
+        st = PersistentTreeSet.from_set(set_)
+        for name, ours, builtin in [
+            ('keys', mp.iterkeys, dct.iterkeys),
+            ('values', mp.itervalues, dct.itervalues),
+            ('items', mp.iteritems, dct.iteritems),
+            ('set', st.__iter__, set_.__iter__),
+        ]:
+            mine = scan(ours())
+            theirs = scan(builtin())
+            print '%-10s %10d %10.0fk/s %10.0fk/s %7.2fx' % (
+                name, size, size / max(mine, 1e-9) / 1000,
+                size / max(theirs, 1e-9) / 1000, mine / max(theirs, 1e-9)
+            )
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000, 1000000])
@@ -0,0 +1,92 @@
+# Copyright (C) 2011 by Florian Mayer <florian.mayer@bitsrc.org>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+""" Measure concurrent writes into one Atom holding a map against a
+ShardedTreeMap, and how long taking a snapshot of the latter takes.
+
+Run as `python -m benchmarks.sharded [writers [seconds]]`. """
+
+import os
+import sys
+import threading
+import time
+
+from burrahobbit import Atom
+from burrahobbit.sharded import ShardedTreeMap
+from burrahobbit.treedict import PersistentTreeMap
+
+
+def compute(mp, key, value):
+    """ Return mp with key associated with value after waiting for 0.1ms,
+    like a writer would that computes the value by I/O or other code that
+    lets other threads run in between. """
+    time.sleep(0.0001)
+    return mp.assoc(key, value)
+
+
+def run(assoc, keys, writers, seconds):
+    """ Return the writes per second done by the threads calling assoc. """
+    stop = []
+    writes = [0] * writers
+    
+    def write(idx):
+        done = 0
+        while not stop:
+            assoc(keys[(done * writers + idx) % len(keys)], done)
+            done += 1
+        writes[idx] = done
+    
+    threads = [
+        threading.Thread(target=write, args=(idx, )) for idx in xrange(writers)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.append(True)
+    for thread in threads:
+        thread.join()
+    return sum(writes) / seconds
+
+
+def main(writers, seconds):
+    keys = [os.urandom(20) for _ in xrange(100000)]
+    mp = PersistentTreeMap.from_itr((key, None) for key in keys)
+    
+    atom = Atom(mp)
+    sharded = ShardedTreeMap(mp)
+    print '%-8s %8s %12s %10s' % ('map', 'writers', 'writes/s', 'conflicts')
+    for name, assoc, cell in [
+        ('atom', lambda key, value: atom.swap(compute, key, value), atom),
+        ('sharded', lambda key, value: sharded.swap(
+            key, compute, key, value), sharded),
+    ]:
+        writes = run(assoc, keys, writers, seconds)
+        print '%-8s %8d %12.0f %10d' % (name, writers, writes, cell.conflicts)
+    
+    start = time.time()
+    for _ in xrange(1000):
+        sharded.snapshot()
+    print 'snapshot of %d entries: %.1fus' % (
+        len(sharded), (time.time() - start) * 1000
+    )
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:] + ['4', '2'][len(sys.argv) - 1:]
+    main(int(args[0]), float(args[1]))
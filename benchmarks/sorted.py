@@ -0,0 +1,82 @@
+# Copyright (C) 2011 by Florian Mayer <florian.mayer@bitsrc.org>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+""" Compare the ordered queries of PersistentSortedMap against answering
+them from a sorted snapshot of a builtin dict, taken for every query as
+the map may have changed in between.
+
+Run as `python -m benchmarks.sorted [size ...]`. """
+
+import random
+import sys
+import time
+
+from bisect import bisect_left
+
+from burrahobbit.sorteddict import PersistentSortedMap
+
+
+def timed(fn, repeat):
+    """ Return the milliseconds per call of fn, called repeat times. """
+    start = time.time()
+    for _ in xrange(repeat):
+        fn()
+    return (time.time() - start) / repeat * 1000
+
+
+def main(sizes):
+    rnd = random.Random(0)
+    print '%-10s %10s %14s %14s %8s' % (
+        'query', 'size', 'sorted [ms]', 'dict [ms]', 'speedup'
+    )
+    for size in sizes:
+        dct = dict((rnd.random(), rnd.random()) for _ in xrange(size))
+        mp = PersistentSortedMap.from_dict(dct)
+        lo = rnd.random()
+        hi = lo + 100.0 / size
+        
+        def dict_range():
+            keys = sorted(dct)
+            return [
+                (key, dct[key])
+                for key in keys[bisect_left(keys, lo):bisect_left(keys, hi)]
+            ]
+        
+        def dict_ceiling():
+            keys = sorted(dct)
+            key = keys[bisect_left(keys, lo)]
+            return key, dct[key]
+        
+        for name, ours, builtin in [
+            ('range', lambda: list(mp.range(lo, hi)), dict_range),
+            ('ceiling', lambda: mp.ceiling(lo), dict_ceiling),
+            ('ordered', mp.items, lambda: sorted(dct.iteritems())),
+            ('reversed', lambda: list(mp.range(reverse=True)),
+             lambda: sorted(dct.iteritems(), reverse=True)),
+        ]:
+            assert ours() == builtin()
+            mine = timed(ours, 5)
+            theirs = timed(builtin, 5)
+            print '%-10s %10d %14.3f %14.3f %7.1fx' % (
+                name, size, mine, theirs, theirs / max(mine, 1e-9)
+            )
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000, 1000000])
@@ -0,0 +1,295 @@
+# Copyright (C) 2011 by Florian Mayer <florian.mayer@bitsrc.org>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+""" Measure the time and peak memory of the operations of maps and sets
+next to the builtin dict and set.
+
+Run as `python -m benchmarks.suite [options]`, see --help. The results
+are printed as a table and, with --output, saved as JSON, so runs on
+different commits can be compared.
+
+Peak memory is measured with tracemalloc where it is available (Python
+3.4 and later). Otherwise, the memory column reports the bytes of the
+objects an operation returns that it does not share with its inputs,
+e.g. the nodes a new version of a map does not share with the old one,
+or the whole copy of a dict. Operations that return nothing report
+None. """
+
+import gc
+import random
+import sys
+import time
+
+from optparse import OptionParser
+
+try:
+    import json
+except ImportError:
+    json = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from benchmarks.memory import deep_size, reachable
+from burrahobbit.treedict import PersistentTreeMap
+from burrahobbit.treeset import PersistentTreeSet
+
+SIZES = [10, 100, 1000, 10000, 100000, 1000000]
+# Number of single-key operations timed per run at most.
+OPERATIONS = 10000
+
+
+def random_keys(rnd, number):
+    """ Return list of number distinct random string keys. """
+    keys = set()
+    while len(keys) < number:
+        keys.add('%016x' % rnd.getrandbits(64))
+    return list(keys)
+
+
+def inputs(fn):
+    """ Return list of the objects fn was passed through its closure and
+    default arguments. """
+    return [
+        cell.cell_contents for cell in fn.func_closure or ()
+    ] + list(fn.func_defaults or ())
+
+
+def measure(fn, repeat):
+    """ Return the shortest time in seconds of repeat calls to fn and the
+    peak memory in bytes allocated by one of them, or without tracemalloc
+    the bytes of its result not shared with its inputs. """
+    best = None
+    for _ in xrange(repeat):
+        gc.collect()
+        start = time.time()
+        fn()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    
+    peak = None
+    if tracemalloc is not None:
+        gc.collect()
+        tracemalloc.start()
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    else:
+        result = fn()
+        if result is not None:
+            peak = deep_size(result, reachable(inputs(fn)))
+    return best, peak
+
+
+def benchmarks(size, rnd):
+    """ Yield (name, number of operations, fn for burrahobbit, fn for
+    the builtin) for the size. """
+    keys = random_keys(rnd, 2 * size)
+    keys, missing = keys[:size], keys[size:]
+    dct = dict((key, key) for key in keys)
+    mp = PersistentTreeMap.from_dict(dct)
+    set_ = set(keys)
+    st = PersistentTreeSet.from_set(set_)
+    
+    ops = min(size, OPERATIONS)
+    sample = rnd.sample(keys, ops)
+    new = missing[:ops]
+    
+    # Functions that create a new version return the last one.
+    def assoc():
+        for key in new:
+            version = mp.assoc(key, key)
+        return version
+    
+    def builtin_assoc():
+        copy = dct.copy()
+        for key in new:
+            copy[key] = key
+        return copy
+    
+    yield 'assoc', ops, assoc, builtin_assoc
+    
+    def without():
+        for key in sample:
+            version = mp.without(key)
+        return version
+    
+    def builtin_without():
+        copy = dct.copy()
+        for key in sample:
+            del copy[key]
+        return copy
+    
+    yield 'without', ops, without, builtin_without
+    
+    def get_hit():
+        for key in sample:
+            mp[key]
+    
+    def builtin_get_hit():
+        for key in sample:
+            dct[key]
+    
+    yield 'get hit', ops, get_hit, builtin_get_hit
+    
+    def get_miss():
+        for key in new:
+            mp.get(key)
+    
+    def builtin_get_miss():
+        for key in new:
+            dct.get(key)
+    
+    yield 'get miss', ops, get_miss, builtin_get_miss
+    
+    def iterate():
+        for _ in mp.iteritems():
+            pass
+    
+    def builtin_iterate():
+        for _ in dct.iteritems():
+            pass
+    
+    yield 'iteration', size, iterate, builtin_iterate
+    
+    def transient():
+        tr = mp.transient()
+        for key in new:
+            tr = tr.assoc(key, key)
+        return tr.persistent()
+    
+    # The builtin counterpart of changing a copy is changing a copy.
+    yield 'transient', ops, transient, builtin_assoc
+    
+    def bulk_dict():
+        return PersistentTreeMap.from_dict(dct)
+    
+    def builtin_bulk_dict():
+        return dict(dct.iteritems())
+    
+    yield 'from_dict', size, bulk_dict, builtin_bulk_dict
+    
+    def bulk_set():
+        return PersistentTreeSet.from_set(keys)
+    
+    def builtin_bulk_set():
+        return set(keys)
+    
+    yield 'from_set', size, bulk_set, builtin_bulk_set
+    
+    # The other operand shares half of the keys.
+    half = size // 2
+    other = keys[half:] + missing[:half]
+    otherset = set(other)
+    otherst = PersistentTreeSet.from_set(other)
+    for name, operator in [
+        ('set |', lambda one, two: one | two),
+        ('set &', lambda one, two: one & two),
+        ('set ^', lambda one, two: one ^ two),
+    ]:
+        yield (
+            name, size,
+            lambda operator=operator: operator(st, otherst),
+            lambda operator=operator: operator(set_, otherset),
+        )
+
+
+def run(sizes, repeat, only=None, seed=0):
+    """ Return list of result dicts for the benchmarks, optionally only
+    those whose name is in only, at the sizes. """
+    rnd = random.Random(seed)
+    results = []
+    for size in sizes:
+        for name, ops, ours, builtin in benchmarks(size, rnd):
+            if only and name not in only:
+                continue
+            for impl, fn in [('burrahobbit', ours), ('builtin', builtin)]:
+                seconds, peak = measure(fn, repeat)
+                results.append({
+                    'benchmark': name,
+                    'size': size,
+                    'impl': impl,
+                    'operations': ops,
+                    'seconds': seconds,
+                    'ns_per_op': seconds / ops * 1e9,
+                    'peak_bytes': peak,
+                })
+    return results
+
+
+def report(results):
+    """ Print results as a table, pairing every benchmark with its
+    builtin counterpart. """
+    print '%-10s %9s %13s %13s %8s %14s %14s' % (
+        'benchmark', 'size', 'ns/op', 'builtin', 'ratio',
+        'memory', 'builtin memory'
+    )
+    for ours, builtin in zip(results[::2], results[1::2]):
+        print '%-10s %9d %13.0f %13.0f %7.2fx %14s %14s' % (
+            ours['benchmark'], ours['size'], ours['ns_per_op'],
+            builtin['ns_per_op'],
+            ours['seconds'] / max(builtin['seconds'], 1e-9),
+            ours['peak_bytes'], builtin['peak_bytes'],
+        )
+
+
+def main(argv):
+    parser = OptionParser(usage='python -m benchmarks.suite [options]')
+    parser.add_option(
+        '--sizes', default=','.join(map(str, SIZES)),
+        help='comma separated sizes, e.g. 10,1000,10000000'
+    )
+    parser.add_option(
+        '--only', default='',
+        help='comma separated names of the benchmarks to run'
+    )
+    parser.add_option(
+        '--repeat', type='int', default=3,
+        help='runs per benchmark, the fastest one counts'
+    )
+    parser.add_option('--seed', type='int', default=0)
+    parser.add_option('--output', help='file to save the results to as JSON')
+    options, args = parser.parse_args(argv)
+    
+    sizes = [int(size) for size in options.sizes.split(',')]
+    only = [name for name in options.only.split(',') if name]
+    results = run(sizes, options.repeat, only, options.seed)
+    report(results)
+    
+    if options.output:
+        if json is None:
+            parser.error('--output needs the json module (Python 2.6+).')
+        fileobj = open(options.output, 'w')
+        try:
+            json.dump({
+                'python': sys.version,
+                'platform': sys.platform,
+                'time': time.time(),
+                'memory': tracemalloc and 'tracemalloc' or 'retained',
+                'results': results,
+            }, fileobj, indent=1, sort_keys=True)
+        finally:
+            fileobj.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -18,10 +18,14 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+from burrahobbit._tree import MISSING
+from burrahobbit.atom import Atom
 from burrahobbit.treeset import PersistentTreeSet as set
 from burrahobbit.treedict import PersistentTreeMap as dict
+from burrahobbit.treevector import PersistentVector as vector
 
 # Shadowing the imported names spares us from either deleting the old
 # references or defining __all__.
 dict = dict.construct
-set = set.construct
\ No newline at end of file
+set = set.construct
+vector = vector.construct
\ No newline at end of file
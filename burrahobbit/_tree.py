@@ -18,12 +18,18 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
-from copy import copy, deepcopy
+import sys
+
+from copy import deepcopy
 from itertools import izip
+from operator import itemgetter
 
-from burrahobbit.util import all
+from burrahobbit.util import chain_from_iterable
 
 SENTINEL = object()
+# Yielded by diff in place of the value of an association that is missing
+# on one side.
+MISSING = object()
 
 SHIFT = 5
 BMAP = (1 << SHIFT) - 1
@@ -31,11 +37,28 @@ BRANCH = 2 ** SHIFT
 
 MAXBITMAPDISPATCH = 16
 
+# The content hash of a node is the sum of the hashes of its associations
+# masked with HASHMOD, i.e. taken modulo sys.maxint + 1, so it does not
+# depend on their order or on the shape of the tree.
+HASHMOD = sys.maxint
+
+# A HashCollisionNode with more entries than this keeps them sorted by key
+# if all keys are of the same type in ORDERED, which maps the types whose
+# order is consistent with equality to their family of mutually
+# comparable types.
+MAXCOLLISIONS = 8
+ORDERED = {str: str, unicode: unicode, int: int, long: int}
+
 def relevant(hsh, shift):
     """ Return the relevant part of the hsh on the level shift. """
     return hsh >> shift & BMAP
 
 
+def bitpos(hsh, shift):
+    """ Return the bit representing hsh on the level shift in a bitmap. """
+    return 1 << (hsh >> shift & BMAP)
+
+
 POPCOUNT_TBL = [0] * (2 ** 16)
 for idx in xrange(2 ** 16):
     POPCOUNT_TBL[idx] = (idx & 1) + POPCOUNT_TBL[idx >> 1]
@@ -55,104 +78,308 @@ def doc(docstring):
 
 
 ASSOC = "\n".join([
-    "Add AssocNode node whose key's hash is hsh to the node or its children.",
+    "Add association between key, whose hash is hsh, and value to the node",
+    "or its children.",
     "shift refers to the current level in the tree, which must be a multiple",
-    "of the global constant BRANCH. If a node with the same key already",
-    "exists, override it.",
+    "of the global constant BRANCH. If an association with the same key",
+    "already exists, override it.",
 ])
 
 IASSOC = "\n".join([
-    "Modify so that the AssocNode whose key's hash is hsh is added to it.",
-    "USE WITH CAUTION.",
+    "Modify so that the association between key, whose hash is hsh, and",
+    "value is added to it.",
+    "Nodes owned by edit are modified in place, all others are copied and",
+    "the copies are owned by edit. Return the resulting node.",
     "shift refers to the current level in the tree, which must be a multiple",
-    "of the global constant BRANCH. If a node with the same key already",
-    "exists, override it.",
+    "of the global constant BRANCH. If an association with the same key",
+    "already exists, override it.",
 ])
 
 GET = "\n".join([
-    "Get value of the AssocNode with key whose hash is hsh in the subtree.",
+    "Get value associated with key whose hash is hsh in the subtree.",
+    "shift refers to the current level in the tree, which must be a multiple",
+    "of the global constant BRANCH.",
+])
+
+FIND = "\n".join([
+    "Return value associated with key whose hash is hsh in the subtree, or",
+    "default if there is none.",
     "shift refers to the current level in the tree, which must be a multiple",
     "of the global constant BRANCH.",
 ])
 
 WITHOUT = "\n".join([
-    "Remove AssocNode with key whose hash is hsh from the subtree.",
+    "Remove association with key whose hash is hsh from the subtree.",
     "shift refers to the current level in the tree, which must be a multiple",
     "of the global constant BRANCH.",
 ])
 
 IWITHOUT = "\n".join([
-    "Modify so that the AssocNode whose key's hash is hsh is removed from it.",
-    "USE WITH CAUTION.",
+    "Modify so that the association with key whose hash is hsh is removed",
+    "from it.",
+    "Nodes owned by edit are modified in place, all others are copied and",
+    "the copies are owned by edit. Return the resulting node.",
+    "shift refers to the current level in the tree, which must be a multiple",
+    "of the global constant BRANCH.",
+])
+
+ENTRY = "\n".join([
+    "Return (key, value) pair of the association with key whose hash is hsh",
+    "in the subtree, or None if there is none. The key returned is the one",
+    "stored in the subtree.",
+    "shift refers to the current level in the tree, which must be a multiple",
+    "of the global constant BRANCH.",
+])
+
+UNION = "\n".join([
+    "Return node containing the entries of both the subtree and other.",
+    "If a key is contained in both, the entry of other is used. Subtrees that",
+    "are only contained in one of them are reused as they are.",
+    "shift refers to the current level in the tree, which must be a multiple",
+    "of the global constant BRANCH.",
+])
+
+INTERSECTION = "\n".join([
+    "Return node containing the entries of other whose key is also contained",
+    "in the subtree.",
+    "shift refers to the current level in the tree, which must be a multiple",
+    "of the global constant BRANCH.",
+])
+
+SYMMETRIC_DIFFERENCE = "\n".join([
+    "Return node containing the entries whose key is contained in exactly one",
+    "of the subtree and other. Subtrees that are only contained in one of",
+    "them are reused as they are.",
+    "shift refers to the current level in the tree, which must be a multiple",
+    "of the global constant BRANCH.",
+])
+
+DIFF = "\n".join([
+    "Yield (key, value, othervalue) for every key whose association differs",
+    "between the subtree and other. value or othervalue is MISSING if the",
+    "key is only contained in the other one.",
+    "shift refers to the current level in the tree, which must be a multiple",
+    "of the global constant BRANCH.",
+])
+
+MERGE_WITH = "\n".join([
+    "Return node containing the entries of both the subtree and other. If a",
+    "key is contained in both, it is associated with fn(value, othervalue).",
+    "Subtrees that are only contained in one of them are reused as they are.",
     "shift refers to the current level in the tree, which must be a multiple",
     "of the global constant BRANCH.",
 ])
 
+MAP_VALUES = "\n".join([
+    "Return node with the keys of the subtree associated with fn of their",
+    "values. Nodes none of whose values fn returned another object for are",
+    "reused as they are.",
+])
+
+FILTER = "\n".join([
+    "Return node containing the associations of the subtree for whose key",
+    "and value pred returns true, or NULLNODE if there are none. Nodes that",
+    "keep all their associations are reused as they are.",
+])
+
 
 class Node(object):
     __slots__ = []
-    def __and__(self, other):
-        new = NULLNODE
+    # The persistent operations are the in-place ones with a token that
+    # was just created. As no node is owned by it, every node on the
+    # path is copied.
+    
+    @doc(ASSOC)
+    def assoc(self, hsh, shift, key, value):
+        return self._iassoc(hsh, shift, key, value, object())
+    
+    @doc(WITHOUT)
+    def without(self, hsh, shift, key):
+        return self._iwithout(hsh, shift, key, object())
+    
+    def xor(self, hsh, shift, key, value):
+        """ Return copy of the subtree with the association between key
+        and value added if key is not contained in it, or the association
+        with key removed if it is. """
+        return self._ixor(hsh, shift, key, value, object())
+    
+    def _ixor(self, hsh, shift, key, value, edit):
+        if self._entry(hsh, shift, key) is None:
+            return self._iassoc(hsh, shift, key, value, edit)
+        return self._iwithout(hsh, shift, key, edit)
+    
+    # The following are the fallbacks used if at least one of self and
+    # other is a HashCollisionNode, i.e. contains only few entries, all of
+    # which have the same hash. Those entries are inserted into, looked up
+    # in or toggled in the other node, which keeps the cost proportional
+    # to the smaller side.
+    
+    @doc(UNION)
+    def union(self, other, shift):
+        if other is self or other is NULLNODE:
+            return self
         
-        for node in other:
-            try:
-                self.get(hash(node.key), 0, node.key)
-            except KeyError:
-                pass
-            else:
-                new = new._iassoc(hash(node.key), 0, node)
+        # The nodes created for the result are owned by a new token, so
+        # each of them is copied only once however many entries are added.
+        edit = object()
+        if isinstance(other, HashCollisionNode):
+            new = self
+            for key, value in other.iteritems():
+                new = new._iassoc(other.hsh, shift, key, value, edit)
+            return new
+        
+        # Only add our entries whose key is not present in other,
+        # because other's entries take precedence.
+        new = other
+        for key, value in self.iteritems():
+            if new._entry(self.hsh, shift, key) is None:
+                new = new._iassoc(self.hsh, shift, key, value, edit)
         return new
     
-    def __xor__(self, other):
-        new = self
-        for node in other:
-            new = new.xor(node.hsh, 0, node)
+    @doc(INTERSECTION)
+    def intersection(self, other, shift):
+        if other is self or other is NULLNODE:
+            return other
+        
+        # All keys contained in both have the hash of the HashCollisionNode.
+        if isinstance(other, HashCollisionNode):
+            hsh = other.hsh
+            array = []
+            for key, value in other.iteritems():
+                if self._entry(hsh, shift, key) is not None:
+                    array.extend([key, value])
+        else:
+            hsh = self.hsh
+            array = []
+            for key in self:
+                entry = other._entry(hsh, shift, key)
+                if entry is not None:
+                    array.extend(entry)
+        
+        if not array:
+            return NULLNODE
+        return HashCollisionNode(hsh, array)
+    
+    @doc(SYMMETRIC_DIFFERENCE)
+    def symmetric_difference(self, other, shift):
+        if other is self:
+            return NULLNODE
+        if other is NULLNODE:
+            return self
+        
+        if isinstance(other, HashCollisionNode):
+            new, collision = self, other
+        else:
+            new, collision = other, self
+        edit = object()
+        for key, value in collision.iteritems():
+            new = new._ixor(collision.hsh, shift, key, value, edit)
         return new
     
-    def __or__(self, other):
-        new = self
-        for node in other:
-            new = new.assoc(node.hsh, 0, node)
+    @doc(MERGE_WITH)
+    def merge_with(self, fn, other, shift):
+        if other is NULLNODE:
+            return self
+        
+        edit = object()
+        if isinstance(other, HashCollisionNode):
+            new = self
+            for key, value in other.iteritems():
+                entry = self._entry(other.hsh, shift, key)
+                if entry is not None:
+                    value = fn(entry[1], value)
+                new = new._iassoc(other.hsh, shift, key, value, edit)
+            return new
+        
+        new = other
+        for key, value in self.iteritems():
+            entry = other._entry(self.hsh, shift, key)
+            if entry is not None:
+                key, value = entry[0], fn(value, entry[1])
+            new = new._iassoc(self.hsh, shift, key, value, edit)
         return new
     
-    def __eq__(self, other):
-        return all(node == othernode for node, othernode in izip(self, other))
+    @doc(DIFF)
+    def diff(self, other, shift):
+        # Used if at least one of self and other is no DispatchNode.
+        # These are small except if the other one is NULLNODE, in which
+        # case there is no shared structure to skip either.
+        if other is self:
+            return
+        for key, value in self.iteritems():
+            entry = other._entry(hash(key), shift, key)
+            if entry is None:
+                yield key, value, MISSING
+            elif entry[1] is not value and not entry[1] == value:
+                yield key, value, entry[1]
+        for key, value in other.iteritems():
+            if self._entry(hash(key), shift, key) is None:
+                yield key, MISSING, value
+    
+    def __and__(self, other):
+        return self.intersection(other, 0)
+    
+    def __xor__(self, other):
+        return self.symmetric_difference(other, 0)
+    
+    def __or__(self, other):
+        return self.union(other, 0)
+    
+    # All mutations keep the tree in its canonical form (see
+    # DispatchNode), so trees with equal contents have the same shape and
+    # can be compared node by node.
     
-    def __neq__(self, other):
-        return any(node != othernode for node, othernode in izip(self, other))
+    def __ne__(self, other):
+        return not self == other
 
 
 class NullNode(Node):
-    """ Dummy node being the leaf of branches that have no entries. """
+    """ Dummy node being the root of trees that have no entries. """
     __slots__ = []
-    def xor(self, hsh, shift, node):
-        return node
+    count = 0
     
-    _ixor = xor
+    def _ixor(self, hsh, shift, key, value, edit):
+        return self._iassoc(hsh, shift, key, value, edit)
     
-    @doc(ASSOC)
-    def assoc(self, hsh, shift, node):
-        # Because there currently no node, the new node
-        # is the node to be added.
-        return node
+    @doc(UNION)
+    def union(self, other, shift):
+        return other
+    
+    @doc(INTERSECTION)
+    def intersection(self, other, shift):
+        return self
+    
+    symmetric_difference = union
     
-    # The NullNode does not need to be modified if a new association is
-    # created because it only returns the new node, hence _iassoc = assoc.
-    _iassoc = assoc
+    @doc(MERGE_WITH)
+    def merge_with(self, fn, other, shift):
+        return other
+    
+    @doc(IASSOC)
+    def _iassoc(self, hsh, shift, key, value, edit):
+        # Because there currently is no node, the new node only
+        # contains the new association.
+        return DispatchNode(bitpos(hsh, shift), 0, [key, value], 1, edit)
     
     def get(self, hsh, shift, key):
         # There is no entry with the searched key because the hash leads
         # to a branch ending in a NullNode.
         raise KeyError(key)
     
-    @doc(WITHOUT)
-    def without(self, hsh, shift, key):
+    @doc(FIND)
+    def find(self, hsh, shift, key, default):
+        return default
+    
+    @doc(ENTRY)
+    def _entry(self, hsh, shift, key):
+        return None
+    
+    @doc(IWITHOUT)
+    def _iwithout(self, hsh, shift, key, edit):
         # There is no entry with the key to be removed because the hash leads
         # to a branch ending in a NullNode.
         raise KeyError(key)
     
-    _iwithout = without
-    
     def __iter__(self):
         # There are no keys contained in a NullNode. Hence, an empty
         # iterator is returned.
@@ -161,6 +388,17 @@ class NullNode(Node):
     # Likewise, there are no values and items in a NullNode.
     iteritems = itervalues = __iter__
     
+    def __hash__(self):
+        return 0
+    
+    @doc(MAP_VALUES)
+    def map_values(self, fn):
+        return self
+    
+    @doc(FILTER)
+    def filter(self, pred):
+        return self
+    
     def __copy__(self):
         return self
     
@@ -175,82 +413,204 @@ NULLNODE = NullNode()
 
 class HashCollisionNode(Node):
     """ If hashes of two keys collide, store them in a list and when a key
-    is searched, iterate over that list and find the appropriate key. """
-    __slots__ = ['children', 'hsh']
-    def __init__(self, nodes):
-        self.children = nodes
-        self.hsh = hash(nodes[0].hsh)
-
-    def xor(self, hsh, shift, node):
-        if not any(node.key == child.key for child in self.children):
-            return HashCollisionNode(self.children + [node])
-        return self
+    is searched, iterate over that list and find the appropriate key.
     
-    def _ixor(self, hsh, shift, node):
-        if not any(node.key == child.key for child in self.children):
-            self.children.append(node)
-        return self
+    Like in DispatchNode, the keys and values are stored inline in array,
+    which is [key0, value0, key1, value1, ...]. edit is the token of the
+    transient that owns the node, if any.
+    
+    Keys chosen to collide, e.g. from user input, would make every lookup
+    scan the whole array. Thus, once there are more than MAXCOLLISIONS
+    entries and all keys are of one of the ORDERED types, the entries are
+    kept sorted by key and searched by bisection. family is the type of
+    the keys while they are sorted and None otherwise. """
+    __slots__ = ['hsh', 'array', 'edit', 'family']
+    def __init__(self, hsh, array, edit=None, family=None):
+        self.hsh = hsh
+        self.array = array
+        self.edit = edit
+        self.family = family
+        if family is None and len(array) > 2 * MAXCOLLISIONS:
+            self._order()
+    
+    def _editable(self, edit):
+        """ Return self if it is owned by edit, otherwise a copy of self
+        that is. """
+        if self.edit is edit:
+            return self
+        return HashCollisionNode(self.hsh, self.array[:], edit, self.family)
+    
+    def _order(self):
+        """ Sort the entries by key if all keys are of the same family of
+        ORDERED types. """
+        array = self.array
+        family = ORDERED.get(type(array[0]))
+        if family is None:
+            return
+        for idx in xrange(2, len(array), 2):
+            if ORDERED.get(type(array[idx])) is not family:
+                return
+        pairs = zip(array[::2], array[1::2])
+        pairs.sort(key=itemgetter(0))
+        array[:] = chain_from_iterable(pairs)
+        self.family = family
+    
+    @property
+    def count(self):
+        """ Number of entries contained in the node. """
+        return len(self.array) >> 1
+    
+    def _search(self, key):
+        """ Return (idx, found). If found, array[idx] is equal to key,
+        otherwise idx is where an association with key is to be
+        inserted. """
+        array = self.array
+        if self.family is not None and ORDERED.get(type(key)) is self.family:
+            lo = 0
+            hi = len(array) >> 1
+            while lo < hi:
+                mid = (lo + hi) >> 1
+                if array[2 * mid] < key:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            idx = 2 * lo
+            return idx, idx < len(array) and array[idx] == key
+        # Keys of other types may still be equal to one of ours, e.g.
+        # 1.0 == 1, so they are compared with all of them.
+        for idx in xrange(0, len(array), 2):
+            if key == array[idx]:
+                return idx, True
+        return len(array), False
+    
+    def _index(self, key):
+        """ Return index of key in array. If there is none,
+        raise KeyError. """
+        idx, found = self._search(key)
+        if not found:
+            raise KeyError(key)
+        return idx
     
     @doc(GET)
     def get(self, hsh, shift, key):
-        # To get the child we want we need to iterate over all possible ones.
-        # The contents of children are always AssocNodes,
-        # so we can safely access the key member.
-        for node in self.children:
-            if key == node.key:
-                return node
-        raise KeyError(key)
+        return self.array[self._index(key) + 1]
     
-    @doc(ASSOC)
-    def assoc(self, hsh, shift, node):
-        # If we have yet another key with a colliding key, return a new node
-        # with it added to the children, otherwise return a DispatchNode.
-        if hsh == self.hsh:
-            return HashCollisionNode(self.children + [node])
-        return DispatchNode.make(shift, [self, node])
+    @doc(FIND)
+    def find(self, hsh, shift, key, default):
+        idx, found = self._search(key)
+        if found:
+            return self.array[idx + 1]
+        return default
     
-    @doc(IASSOC)
-    def _iassoc(self, hsh, shift, node):
-        # If we have yet another key with a colliding key, add it to the
-        # children, otherwise return a DispatchNode.
-        if hsh == self.hsh:
-            self.children.append(node)
-            return self
-        return DispatchNode.make(shift, [self, node])
+    @doc(ENTRY)
+    def _entry(self, hsh, shift, key):
+        idx, found = self._search(key)
+        if found:
+            return self.array[idx], self.array[idx + 1]
+        return None
     
-    @doc(WITHOUT)
-    def without(self, hsh, shift, key):
-        # Remove the node whose key is key from the children. If it was the
-        # last child, return NULLNODE. If there was no member with a
-        # matching key, raise KeyError.
-        newchildren = [node for node in self.children if node.key != key]
-        if not newchildren:
-            return NULLNODE
+    @doc(IASSOC)
+    def _iassoc(self, hsh, shift, key, value, edit):
+        # If we have yet another key with a colliding hash, add it to the
+        # array (or replace the association with the same key). Otherwise,
+        # dispatch between self and the new association on this level.
+        if hsh != self.hsh:
+            return DispatchNode(
+                0, bitpos(self.hsh, shift), [self], self.count, edit
+            )._iassoc(hsh, shift, key, value, edit)
         
-        if newchildren == self.children:
-            raise KeyError(key)
+        idx, found = self._search(key)
+        if not found:
+            new = self._editable(edit)
+            if new.family is None:
+                new.array.extend([key, value])
+                if len(new.array) > 2 * MAXCOLLISIONS:
+                    new._order()
+            elif ORDERED.get(type(key)) is new.family:
+                new.array[idx:idx] = [key, value]
+            else:
+                new.array.extend([key, value])
+                new.family = None
+            return new
         
-        return HashCollisionNode(newchildren)
+        if self.array[idx] is key and self.array[idx + 1] is value:
+            return self
+        new = self._editable(edit)
+        new.array[idx] = key
+        new.array[idx + 1] = value
+        return new
     
     @doc(IWITHOUT)
-    def _iwithout(self, hsh, shift, key):
-        newchildren = [node for node in self.children if node.key != key]
-        if not newchildren:
+    def _iwithout(self, hsh, shift, key, edit):
+        # Remove the association with key from the array. If it was the
+        # last one, return NULLNODE. If there was no association with a
+        # matching key, raise KeyError. Removing keeps the array sorted.
+        idx = self._index(key)
+        if len(self.array) == 2:
             return NULLNODE
-        
-        if newchildren == self.children:
-            raise KeyError(key)
-        
-        self.children = newchildren
-        return self
+        new = self._editable(edit)
+        del new.array[idx:idx + 2]
+        return new
+    
+    def __eq__(self, other):
+        # Keys need not be orderable, so the order of the entries is not
+        # canonical and they are compared as unordered. There are only
+        # few of them.
+        if other is self:
+            return True
+        if not isinstance(other, HashCollisionNode):
+            return False
+        if self.hsh != other.hsh or len(self.array) != len(other.array):
+            return False
+        array = self.array
+        for idx in xrange(0, len(array), 2):
+            entry = other._entry(self.hsh, 0, array[idx])
+            if entry is None or not entry[1] == array[idx + 1]:
+                return False
+        return True
+    
+    def __hash__(self):
+        total = 0
+        for item in self.iteritems():
+            total += hash(item)
+        return total & HASHMOD
+    
+    @doc(MAP_VALUES)
+    def map_values(self, fn):
+        array = self.array
+        new = None
+        for idx in xrange(1, len(array), 2):
+            value = fn(array[idx])
+            if value is not array[idx]:
+                if new is None:
+                    new = array[:]
+                new[idx] = value
+        if new is None:
+            return self
+        return HashCollisionNode(self.hsh, new, None, self.family)
+    
+    @doc(FILTER)
+    def filter(self, pred):
+        array = self.array
+        new = []
+        for idx in xrange(0, len(array), 2):
+            if pred(array[idx], array[idx + 1]):
+                new.extend(array[idx:idx + 2])
+        if len(new) == len(array):
+            return self
+        if not new:
+            return NULLNODE
+        # Removing entries keeps them sorted.
+        return HashCollisionNode(self.hsh, new, None, self.family)
     
     def __iter__(self):
-        for node in self.children:
-            for elem in node:
-                yield elem
+        return iter(self.array[::2])
     
-    def __copy__(self):
-        return HashCollisionNode(map(copy, self.children))
+    def iteritems(self):
+        return izip(self.array[::2], self.array[1::2])
+    
+    def itervalues(self):
+        return iter(self.array[1::2])
     
     def cutoff(self, hsh):
         if self.hsh <= hsh:
@@ -361,11 +721,11 @@ class BitMapDispatch(Node):
         # If the item already existed in the list, we need to replace it.
         # Otherwise, it will be added to the list at the appropriate
         # position.
-        if len(self.items) >= MAXBITMAPDISPATCH:
+        notnew = bool(self.bitmap & 1 << key)
+        if not notnew and len(self.items) >= MAXBITMAPDISPATCH:
             new = self.to_listdispatch(BRANCH)
             return new._ireplace(key, item)
         
-        notnew = bool(self.bitmap & 1 << key)
         newmap = self.bitmap | 1 << key
         idx = bit_count(self.bitmap & ((1 << key) - 1))
         return BitMapDispatch(
@@ -380,11 +740,11 @@ class BitMapDispatch(Node):
         """ Replace keyth item with item.
         
         USE WITH CAUTION. """
-        if len(self.items) >= MAXBITMAPDISPATCH:
+        notnew = bool(self.bitmap & 1 << key)
+        if not notnew and len(self.items) >= MAXBITMAPDISPATCH:
             new = self.to_listdispatch(BRANCH)
             return new._ireplace(key, item)
         
-        notnew = bool(self.bitmap & 1 << key)
         self.bitmap |= 1 << key
         idx = bit_count(self.bitmap & ((1 << key) - 1))
         if idx == len(self.items):
@@ -453,119 +813,724 @@ class BitMapDispatch(Node):
         )
 
 
-class DispatchNode(Node):
-    """ Dispatch to children nodes depending of the hsh value at the
-    current level. """
-    __slots__ = ['children']
-    def __init__(self, children=None):
-        if children is None:
-            children = BitMapDispatch()
-        
-        self.children = children
-    
-    def xor(self, hsh, shift, node):
-        rlv = relevant(hsh, shift)
-        newchild = self.children.get(rlv, NULLNODE).xor(hsh, shift + SHIFT, node)
-        if newchild is NULLNODE:
-            # This makes sure no dead nodes remain in the tree after
-            # removing an item.
-            newchildren = self.children.remove(rlv)
-            if not newchildren:
-                return NULLNODE
-        else:
-            newchildren = self.children.replace(
-                rlv, 
-                newchild
-            )
-        
-        return DispatchNode(newchildren)
+def _pair(shift, hsh, key, value, otherhsh, otherkey, othervalue, edit=None):
+    """ Return node on the level shift containing the associations of key
+    and otherkey, whose hashes are hsh and otherhsh. """
+    if hsh == otherhsh:
+        return HashCollisionNode(hsh, [key, value, otherkey, othervalue], edit)
     
-    def _ixor(self, hsh, shift, node):
-        rlv = relevant(hsh, shift)
-        newchild = self.children[rlv].xor(hsh, shift + SHIFT, node)
-        if newchild is NULLNODE:
-            self.children = self.children._iremove(rlv)
-            if not self.children:
-                return NULLNODE
+    rlv = hsh >> shift & BMAP
+    otherrlv = otherhsh >> shift & BMAP
+    if rlv == otherrlv:
+        # The hashes only differ at a higher level, so we need another
+        # DispatchNode that only contains the one for that level.
+        return DispatchNode(
+            0, 1 << rlv,
+            [_pair(shift + SHIFT, hsh, key, value,
+                   otherhsh, otherkey, othervalue, edit)],
+            2, edit
+        )
+    
+    if rlv < otherrlv:
+        array = [key, value, otherkey, othervalue]
+    else:
+        array = [otherkey, othervalue, key, value]
+    return DispatchNode(1 << rlv | 1 << otherrlv, 0, array, 2, edit)
+
+
+def _same(slot, other):
+    """ Return whether the slots (see DispatchNode._slots) are the same
+    node or associations of the same key and value objects. """
+    if slot is other:
+        return True
+    return (
+        isinstance(slot, tuple) and isinstance(other, tuple) and
+        slot[0] is other[0] and slot[1] is other[1]
+    )
+
+
+def _compact(node):
+    """ Return what is stored in the parent of the non-empty node to keep
+    the tree canonical: the (key, value) pair if node only contains one
+    association, the HashCollisionNode if node only dispatches to it, or
+    node itself. """
+    if node.count == 1:
+        return node.iteritems().next()
+    if (isinstance(node, DispatchNode) and not node.datamap and
+        len(node.array) == 1 and
+        isinstance(node.array[0], HashCollisionNode)):
+        return node.array[0]
+    return node
+
+
+def _assemble(slots):
+    """ Return DispatchNode for slots, which is a list of (bit, slot) pairs
+    sorted by bit. slot is either a (key, value) pair, which is stored
+    inline, or a child node. If there are no entries, return NULLNODE. """
+    datamap = nodemap = count = 0
+    array = []
+    nodes = []
+    for bit, slot in slots:
+        if isinstance(slot, Node):
+            slot = _compact(slot)
+        if isinstance(slot, Node):
+            nodemap |= bit
+            nodes.append(slot)
+            count += slot.count
         else:
-            self.children = self.children._ireplace(rlv, newchild)
+            datamap |= bit
+            array.extend(slot)
+            count += 1
+    
+    if not count:
+        return NULLNODE
+    nodes.reverse()
+    array.extend(nodes)
+    return DispatchNode(datamap, nodemap, array, count)
+
+
+class DispatchNode(Node):
+    """ Dispatch to associations and children nodes depending on the hsh
+    value at the current level.
+    
+    Associations whose key is the only one with its relevant part of the
+    hash on this level are stored inline. Their bits are set in datamap
+    and array starts with key0, value0, key1, value1, ... in the order of
+    the bits. The bits of children nodes are set in nodemap and the nodes
+    are stored at the end of array in reverse order, so the index of
+    neither depends on how many of the other there are.
+    
+    The tree is kept canonical, i.e. its shape only depends on its
+    contents. Below the root, a node contains at least two associations,
+    and entries sharing a hash are stored in a HashCollisionNode directly
+    below the first level where they differ from all other entries of
+    the subtree.
+    
+    count is the number of entries contained in the subtree, edit is the
+    token of the transient that owns the node, if any. contenthash caches
+    the hash of the subtree; it is None until it is first needed and
+    whenever the node is changed in place. """
+    __slots__ = [
+        'datamap', 'nodemap', 'array', 'count', 'edit', 'contenthash'
+    ]
+    def __init__(self, datamap=0, nodemap=0, array=None, count=0, edit=None):
+        if array is None:
+            array = []
         
-        return self
+        self.datamap = datamap
+        self.nodemap = nodemap
+        self.array = array
+        self.count = count
+        self.edit = edit
+        self.contenthash = None
     
-    @doc(ASSOC)
-    def assoc(self, hsh, shift, node):
-        # We need not check whether the return value of
-        # self.children.get(...).assoc is NULLNODE, because assoc never
-        # returns NULLNODE.
-        rlv = relevant(hsh, shift)
+    def _editable(self, edit):
+        """ Return self if it is owned by edit, otherwise a copy of self
+        that is. Only the node itself is copied, its children are
+        shared. """
+        if self.edit is edit:
+            # The caller is about to change the node.
+            self.contenthash = None
+            return self
         return DispatchNode(
-            self.children.replace(
-                rlv,
-                self.children.get(rlv, NULLNODE).assoc(
-                    hsh, shift + SHIFT, node
-                )
-            )
-        )
-    
-    @doc(IASSOC)
-    def _iassoc(self, hsh, shift, node):
-        rlv = relevant(hsh, shift)
-        self.children = self.children._ireplace(
-            rlv, 
-            self.children.get(rlv, NULLNODE)._iassoc(hsh, shift + SHIFT, node)
+            self.datamap, self.nodemap, self.array[:], self.count, edit
         )
-        return self
-    
-    @classmethod
-    def make(cls, shift, many):
-        # Because the object we create in this function is not yet exposed
-        # to any other code, we may safely call _iassoc.
-        dsp = cls()
-        for elem in many:
-            dsp = dsp._iassoc(elem.hsh, shift, elem)
-        return dsp
     
     @doc(GET)
     def get(self, hsh, shift, key):
-        return self.children.get(relevant(hsh, shift), NULLNODE).get(
-            hsh, shift + SHIFT, key
-        )
+        bit = 1 << (hsh >> shift & BMAP)
+        if self.datamap & bit:
+            idx = 2 * bit_count(self.datamap & (bit - 1))
+            if key == self.array[idx]:
+                return self.array[idx + 1]
+        elif self.nodemap & bit:
+            array = self.array
+            return array[
+                len(array) - 1 - bit_count(self.nodemap & (bit - 1))
+            ].get(hsh, shift + SHIFT, key)
+        raise KeyError(key)
     
-    @doc(WITHOUT)
-    def without(self, hsh, shift, key):
-        rlv = relevant(hsh, shift)
-        newchild = self.children[rlv].without(hsh, shift + SHIFT, key)
-        if newchild is NULLNODE:
-            # This makes sure no dead nodes remain in the tree after
-            # removing an item.
-            newchildren = self.children.remove(rlv)
-            if not newchildren:
-                return NULLNODE
-        else:
-            newchildren = self.children.replace(
-                rlv, 
-                newchild
+    @doc(FIND)
+    def find(self, hsh, shift, key, default):
+        # Descend in a loop rather than by recursion as long as there are
+        # DispatchNodes.
+        node = self
+        while True:
+            bit = 1 << (hsh >> shift & BMAP)
+            if node.datamap & bit:
+                array = node.array
+                idx = 2 * bit_count(node.datamap & (bit - 1))
+                if array[idx] is key or key == array[idx]:
+                    return array[idx + 1]
+                return default
+            if not node.nodemap & bit:
+                return default
+            array = node.array
+            node = array[len(array) - 1 - bit_count(node.nodemap & (bit - 1))]
+            shift += SHIFT
+            if not isinstance(node, DispatchNode):
+                return node.find(hsh, shift, key, default)
+    
+    @doc(ENTRY)
+    def _entry(self, hsh, shift, key):
+        bit = 1 << (hsh >> shift & BMAP)
+        if self.datamap & bit:
+            idx = 2 * bit_count(self.datamap & (bit - 1))
+            if key == self.array[idx]:
+                return self.array[idx], self.array[idx + 1]
+        elif self.nodemap & bit:
+            array = self.array
+            return array[
+                len(array) - 1 - bit_count(self.nodemap & (bit - 1))
+            ]._entry(hsh, shift + SHIFT, key)
+        return None
+    
+    @doc(IASSOC)
+    def _iassoc(self, hsh, shift, key, value, edit):
+        bit = 1 << (hsh >> shift & BMAP)
+        if self.datamap & bit:
+            idx = 2 * bit_count(self.datamap & (bit - 1))
+            other = self.array[idx]
+            if key == other:
+                if other is key and self.array[idx + 1] is value:
+                    return self
+                new = self._editable(edit)
+                new.array[idx] = key
+                new.array[idx + 1] = value
+                return new
+            
+            # Another key with the same relevant part of the hash is stored
+            # inline, so both of them are moved to a new child node.
+            child = _pair(
+                shift + SHIFT, hash(other), other, self.array[idx + 1],
+                hsh, key, value, edit
+            )
+            new = self._editable(edit)
+            del new.array[idx:idx + 2]
+            new.datamap ^= bit
+            new.nodemap |= bit
+            new.array.insert(
+                len(new.array) - bit_count(new.nodemap & (bit - 1)), child
             )
+            new.count += 1
+            return new
         
-        return DispatchNode(newchildren)
+        if self.nodemap & bit:
+            nidx = len(self.array) - 1 - bit_count(self.nodemap & (bit - 1))
+            child = self.array[nidx]
+            # Read the count before the child is modified in place.
+            oldcount = child.count
+            newchild = child._iassoc(hsh, shift + SHIFT, key, value, edit)
+            if newchild is child and newchild.count == oldcount:
+                if self.edit is edit:
+                    # The child may have been changed in place.
+                    self.contenthash = None
+                return self
+            new = self._editable(edit)
+            new.array[nidx] = newchild
+            new.count += newchild.count - oldcount
+            return new
+        
+        new = self._editable(edit)
+        idx = 2 * bit_count(self.datamap & (bit - 1))
+        new.array[idx:idx] = [key, value]
+        new.datamap |= bit
+        new.count += 1
+        return new
     
     @doc(IWITHOUT)
-    def _iwithout(self, hsh, shift, key):
-        rlv = relevant(hsh, shift)
-        newchild = self.children[rlv]._iwithout(hsh, shift + SHIFT, key)
-        if newchild is NULLNODE:
-            self.children = self.children._iremove(rlv)
-            if not self.children:
+    def _iwithout(self, hsh, shift, key, edit):
+        bit = 1 << (hsh >> shift & BMAP)
+        if self.datamap & bit:
+            idx = 2 * bit_count(self.datamap & (bit - 1))
+            if not key == self.array[idx]:
+                raise KeyError(key)
+            if self.count == 1:
                 return NULLNODE
-        else:
-            self.children = self.children._ireplace(rlv, newchild)
+            new = self._editable(edit)
+            del new.array[idx:idx + 2]
+            new.datamap ^= bit
+            new.count -= 1
+            return new
         
-        return self
+        if self.nodemap & bit:
+            nidx = len(self.array) - 1 - bit_count(self.nodemap & (bit - 1))
+            slot = _compact(self.array[nidx]._iwithout(
+                hsh, shift + SHIFT, key, edit
+            ))
+            new = self._editable(edit)
+            if isinstance(slot, Node):
+                new.array[nidx] = slot
+            else:
+                # The child only has one association left, which is
+                # moved into this node.
+                del new.array[nidx]
+                new.nodemap ^= bit
+                new.datamap |= bit
+                idx = 2 * bit_count(new.datamap & (bit - 1))
+                new.array[idx:idx] = slot
+            new.count -= 1
+            return new
+        
+        raise KeyError(key)
+    
+    def __eq__(self, other):
+        if other is self:
+            return True
+        if not isinstance(other, DispatchNode):
+            return False
+        if (self.count != other.count or self.datamap != other.datamap or
+            self.nodemap != other.nodemap):
+            return False
+        # As both are canonical, equal associations and children are at
+        # the same positions. Shared children are skipped.
+        theirarray = other.array
+        for idx, mine in enumerate(self.array):
+            theirs = theirarray[idx]
+            if mine is not theirs and not mine == theirs:
+                return False
+        return True
+    
+    def __hash__(self):
+        # Only the nodes that were copied or changed since the last time
+        # need to be visited, the children reuse their cached hash.
+        if self.contenthash is None:
+            array = self.array
+            ndata = 2 * bit_count(self.datamap)
+            total = 0
+            for idx in xrange(0, ndata, 2):
+                total += hash((array[idx], array[idx + 1]))
+            for idx in xrange(ndata, len(array)):
+                total += hash(array[idx])
+            self.contenthash = total & HASHMOD
+        return self.contenthash
+    
+    def _slots(self, other):
+        """ Yield (bit, mine, theirs) for every bit that is set in self or
+        other. mine and theirs are None if the bit is not set, the (key,
+        value) pair if an association is stored inline or the child node.
+        """
+        myarray = self.array
+        theirarray = other.array
+        mydata = theirdata = 0
+        mynode = len(myarray) - 1
+        theirnode = len(theirarray) - 1
+        
+        bitmap = self.datamap | self.nodemap | other.datamap | other.nodemap
+        while bitmap:
+            bit = bitmap & -bitmap
+            bitmap ^= bit
+            
+            if self.datamap & bit:
+                mine = myarray[mydata], myarray[mydata + 1]
+                mydata += 2
+            elif self.nodemap & bit:
+                mine = myarray[mynode]
+                mynode -= 1
+            else:
+                mine = None
+            
+            if other.datamap & bit:
+                theirs = theirarray[theirdata], theirarray[theirdata + 1]
+                theirdata += 2
+            elif other.nodemap & bit:
+                theirs = theirarray[theirnode]
+                theirnode -= 1
+            else:
+                theirs = None
+            
+            yield bit, mine, theirs
+    
+    @doc(UNION)
+    def union(self, other, shift):
+        if not isinstance(other, DispatchNode):
+            return Node.union(self, other, shift)
+        if other is self:
+            return self
+        
+        # Only the slots present on both sides need to be merged, all
+        # others are reused. If all slots of the result are those of
+        # either self or other, that node is returned instead of
+        # allocating a new one.
+        shift += SHIFT
+        slots = []
+        mine = theirs = True
+        for bit, myslot, theirslot in self._slots(other):
+            if theirslot is None:
+                slot = myslot
+            elif myslot is None:
+                slot = theirslot
+            elif isinstance(myslot, Node):
+                if isinstance(theirslot, Node):
+                    slot = myslot.union(theirslot, shift)
+                else:
+                    key, value = theirslot
+                    slot = myslot.assoc(hash(key), shift, key, value)
+            elif isinstance(theirslot, Node):
+                key, value = myslot
+                hsh = hash(key)
+                slot = theirslot
+                if theirslot._entry(hsh, shift, key) is None:
+                    slot = theirslot.assoc(hsh, shift, key, value)
+            elif myslot[0] == theirslot[0]:
+                slot = theirslot
+            else:
+                slot = _pair(
+                    shift, hash(myslot[0]), myslot[0], myslot[1],
+                    hash(theirslot[0]), theirslot[0], theirslot[1]
+                )
+            mine = mine and _same(slot, myslot)
+            theirs = theirs and _same(slot, theirslot)
+            slots.append((bit, slot))
+        
+        if mine:
+            return self
+        if theirs:
+            return other
+        return _assemble(slots)
+    
+    @doc(INTERSECTION)
+    def intersection(self, other, shift):
+        if not isinstance(other, DispatchNode):
+            return Node.intersection(self, other, shift)
+        if other is self:
+            return self
+        
+        shift += SHIFT
+        slots = []
+        mine = theirs = True
+        for bit, myslot, theirslot in self._slots(other):
+            if myslot is None or theirslot is None:
+                mine = mine and myslot is None
+                theirs = theirs and theirslot is None
+                continue
+            
+            if isinstance(theirslot, Node):
+                if isinstance(myslot, Node):
+                    slot = myslot.intersection(theirslot, shift)
+                else:
+                    slot = theirslot._entry(hash(myslot[0]), shift, myslot[0])
+            elif isinstance(myslot, Node):
+                slot = None
+                key = theirslot[0]
+                if myslot._entry(hash(key), shift, key) is not None:
+                    slot = theirslot
+            elif myslot[0] == theirslot[0]:
+                slot = theirslot
+            else:
+                slot = None
+            
+            if slot is NULLNODE:
+                slot = None
+            mine = mine and _same(slot, myslot)
+            theirs = theirs and _same(slot, theirslot)
+            if slot is not None:
+                slots.append((bit, slot))
+        
+        if mine:
+            return self
+        if theirs:
+            return other
+        return _assemble(slots)
+    
+    @doc(MERGE_WITH)
+    def merge_with(self, fn, other, shift):
+        if not isinstance(other, DispatchNode):
+            return Node.merge_with(self, fn, other, shift)
+        
+        # Like union, but fn is called for the keys contained in both.
+        # Unlike there, subtrees shared by self and other are merged too,
+        # as fn has to be called for their keys.
+        shift += SHIFT
+        slots = []
+        mine = theirs = True
+        for bit, myslot, theirslot in self._slots(other):
+            if theirslot is None:
+                slot = myslot
+            elif myslot is None:
+                slot = theirslot
+            elif isinstance(myslot, Node):
+                if isinstance(theirslot, Node):
+                    slot = myslot.merge_with(fn, theirslot, shift)
+                else:
+                    key, value = theirslot
+                    hsh = hash(key)
+                    entry = myslot._entry(hsh, shift, key)
+                    if entry is not None:
+                        value = fn(entry[1], value)
+                    slot = myslot.assoc(hsh, shift, key, value)
+            elif isinstance(theirslot, Node):
+                key, value = myslot
+                hsh = hash(key)
+                entry = theirslot._entry(hsh, shift, key)
+                if entry is not None:
+                    key, value = entry[0], fn(value, entry[1])
+                slot = theirslot.assoc(hsh, shift, key, value)
+            elif myslot[0] == theirslot[0]:
+                slot = theirslot[0], fn(myslot[1], theirslot[1])
+            else:
+                slot = _pair(
+                    shift, hash(myslot[0]), myslot[0], myslot[1],
+                    hash(theirslot[0]), theirslot[0], theirslot[1]
+                )
+            mine = mine and _same(slot, myslot)
+            theirs = theirs and _same(slot, theirslot)
+            slots.append((bit, slot))
+        
+        if mine:
+            return self
+        if theirs:
+            return other
+        return _assemble(slots)
+    
+    @doc(SYMMETRIC_DIFFERENCE)
+    def symmetric_difference(self, other, shift):
+        if not isinstance(other, DispatchNode):
+            return Node.symmetric_difference(self, other, shift)
+        if other is self:
+            return NULLNODE
+        
+        shift += SHIFT
+        slots = []
+        mine = theirs = True
+        for bit, myslot, theirslot in self._slots(other):
+            if theirslot is None:
+                slot = myslot
+            elif myslot is None:
+                slot = theirslot
+            elif isinstance(myslot, Node):
+                if isinstance(theirslot, Node):
+                    slot = myslot.symmetric_difference(theirslot, shift)
+                else:
+                    key, value = theirslot
+                    slot = myslot.xor(hash(key), shift, key, value)
+            elif isinstance(theirslot, Node):
+                key, value = myslot
+                slot = theirslot.xor(hash(key), shift, key, value)
+            elif myslot[0] == theirslot[0]:
+                slot = None
+            else:
+                slot = _pair(
+                    shift, hash(myslot[0]), myslot[0], myslot[1],
+                    hash(theirslot[0]), theirslot[0], theirslot[1]
+                )
+            
+            if slot is NULLNODE:
+                slot = None
+            mine = mine and _same(slot, myslot)
+            theirs = theirs and _same(slot, theirslot)
+            if slot is not None:
+                slots.append((bit, slot))
+        
+        if mine:
+            return self
+        if theirs:
+            return other
+        return _assemble(slots)
+    
+    @doc(DIFF)
+    def diff(self, other, shift):
+        if not isinstance(other, DispatchNode):
+            for item in Node.diff(self, other, shift):
+                yield item
+            return
+        if other is self:
+            return
+        
+        # Children that are the same object, which they are if they were
+        # not touched by the changes between self and other, are skipped.
+        shift += SHIFT
+        for bit, myslot, theirslot in self._slots(other):
+            if _same(myslot, theirslot):
+                continue
+            
+            # Inline associations are compared as nodes of their own.
+            if myslot is None:
+                myslot = NULLNODE
+            elif not isinstance(myslot, Node):
+                myslot = HashCollisionNode(hash(myslot[0]), list(myslot))
+            if theirslot is None:
+                theirslot = NULLNODE
+            elif not isinstance(theirslot, Node):
+                theirslot = HashCollisionNode(
+                    hash(theirslot[0]), list(theirslot)
+                )
+            
+            for item in myslot.diff(theirslot, shift):
+                yield item
+    
+    @doc(MAP_VALUES)
+    def map_values(self, fn):
+        array = self.array
+        new = None
+        ndata = 2 * bit_count(self.datamap)
+        for idx in xrange(1, ndata, 2):
+            value = fn(array[idx])
+            if value is not array[idx]:
+                if new is None:
+                    new = array[:]
+                new[idx] = value
+        for idx in xrange(ndata, len(array)):
+            child = array[idx].map_values(fn)
+            if child is not array[idx]:
+                if new is None:
+                    new = array[:]
+                new[idx] = child
+        if new is None:
+            return self
+        return DispatchNode(self.datamap, self.nodemap, new, self.count)
+    
+    @doc(FILTER)
+    def filter(self, pred):
+        array = self.array
+        ndata = 2 * bit_count(self.datamap)
+        dropped = []
+        for idx in xrange(0, ndata, 2):
+            if not pred(array[idx], array[idx + 1]):
+                dropped.append(idx)
+        children = None
+        for idx in xrange(ndata, len(array)):
+            child = array[idx].filter(pred)
+            if child is not array[idx]:
+                if children is None:
+                    children = array[:]
+                children[idx] = child
+        if not dropped and children is None:
+            return self
+        if children is None:
+            children = array
+        
+        # The children that lost entries may have to be stored inline or
+        # replaced by a HashCollisionNode, which _assemble takes care of.
+        slots = []
+        data = 0
+        node = len(array) - 1
+        bitmap = self.datamap | self.nodemap
+        while bitmap:
+            bit = bitmap & -bitmap
+            bitmap ^= bit
+            if self.datamap & bit:
+                if data not in dropped:
+                    slots.append((bit, (array[data], array[data + 1])))
+                data += 2
+            else:
+                if children[node] is not NULLNODE:
+                    slots.append((bit, children[node]))
+                node -= 1
+        return _assemble(slots)
+    
+    # Iterating does not resume a generator per level and entry. Instead,
+    # _walk visits the nodes with an explicit stack, and the entries of
+    # every node are handed out by iterators implemented in C.
     
     def __iter__(self):
-        for child in self.children:
-            for elem in child:
-                yield elem
+        return chain_from_iterable(
+            array[0:end:2] for array, end in _walk(self)
+        )
     
-    def __copy__(self):
-        return DispatchNode(self.children.map(copy))
+    def iteritems(self):
+        return chain_from_iterable(
+            izip(array[0:end:2], array[1:end:2]) for array, end in _walk(self)
+        )
+    
+    def itervalues(self):
+        return chain_from_iterable(
+            array[1:end:2] for array, end in _walk(self)
+        )
+
+
+def _walk(node):
+    """ Yield (array, end) for every node in the subtree that contains
+    associations, where array[:end] are its keys and values. The nodes
+    are visited in the same order as their associations are iterated. """
+    stack = [node]
+    pop = stack.pop
+    push = stack.extend
+    while stack:
+        node = pop()
+        array = node.array
+        if isinstance(node, DispatchNode):
+            end = 2 * bit_count(node.datamap)
+            # The children are stored in reverse order, so the first one
+            # ends up on top of the stack.
+            push(array[end:])
+            if end:
+                yield array, end
+        else:
+            yield array, len(array)
+
+
+def build(shift, entries):
+    """ Return subtree on level shift containing the associations in the
+    list entries of (hsh, key, value) triples. If several of them have
+    equal keys, the last one wins, like they would if they were assoc'ed
+    one after the other.
+    
+    Instead of descending from the root for every association, they are
+    partitioned by the relevant part of their hash and every DispatchNode
+    is created with its final bitmaps and array at once. """
+    if not entries:
+        return NULLNODE
+    
+    buckets = {}
+    for entry in entries:
+        rlv = entry[0] >> shift & BMAP
+        bucket = buckets.get(rlv)
+        if bucket is None:
+            buckets[rlv] = [entry]
+        else:
+            bucket.append(entry)
+    
+    slots = []
+    for rlv in sorted(buckets):
+        bucket = buckets[rlv]
+        slot = None
+        if len(bucket) > 1:
+            hsh = bucket[0][0]
+            for entry in bucket:
+                if entry[0] != hsh:
+                    slot = build(shift + SHIFT, bucket)
+                    break
+            else:
+                # All hashes are equal, so there is nothing left to
+                # dispatch on. Equal keys are merged by assoc'ing them to
+                # a HashCollisionNode, which bisects if they are many.
+                edit = object()
+                node = HashCollisionNode(hsh, list(bucket[0][1:]), edit)
+                for hsh, key, value in bucket[1:]:
+                    node = node._iassoc(hsh, shift, key, value, edit)
+                if node.count > 1:
+                    slot = node
+                else:
+                    slot = tuple(node.array)
+        if slot is None:
+            slot = bucket[0][1:]
+        slots.append((1 << rlv, slot))
+    return _assemble(slots)
+
+
+# Passed to DispatchNode._slots to get the slots of only one node.
+EMPTYDISPATCH = DispatchNode()
+
+
+def root_slots(root):
+    """ Yield (bit, slot) for every slot of the root of a tree, in the
+    order of the bits. See DispatchNode._slots. """
+    if root is NULLNODE:
+        return
+    if not isinstance(root, DispatchNode):
+        # The root only holds entries sharing a hash.
+        yield 1 << (root.hsh & BMAP), root
+        return
+    for bit, slot, _ in root._slots(EMPTYDISPATCH):
+        yield bit, slot
+
+
+def flatten(node):
+    """ Return list [key0, value0, key1, value1, ...] of the associations
+    in the subtree. """
+    flat = []
+    if node is not NULLNODE:
+        for array, end in _walk(node):
+            flat.extend(array[:end])
+    return flat
@@ -0,0 +1,137 @@
+# Copyright (C) 2011 by Florian Mayer <florian.mayer@bitsrc.org>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+""" Reference cell that threads share a persistent map or set through.
+
+Readers call :meth:`Atom.deref` and work on the version they got, which
+never changes, so they never wait for writers. Writers compute a new
+version from the current one and publish it with
+:meth:`Atom.compare_and_set`, which fails if another writer published a
+version in between. """
+
+from threading import Lock
+
+from burrahobbit._tree import MISSING
+from burrahobbit.treeset import PersistentTreeSet
+
+
+def _replay(value, changes):
+    """ Return value, a PersistentTreeMap or PersistentTreeSet, with the
+    changes applied. changes is what diff of the respective type yielded
+    for the versions before and after them. """
+    new = value.transient()
+    if isinstance(value, PersistentTreeSet):
+        for key, added in changes:
+            if added:
+                new = new.add(key)
+            elif key in new:
+                new = new.without(key)
+    else:
+        for key, oldvalue, newvalue in changes:
+            if newvalue is not MISSING:
+                new = new.assoc(key, newvalue)
+            elif key in new:
+                new = new.without(key)
+    return new.persistent()
+
+
+class Atom(object):
+    """ Holds a value that can be replaced atomically. The value should be
+    persistent, as it is handed out to all threads.
+    
+    swaps is the number of values published by :meth:`swap` and
+    :meth:`commit`, conflicts the number of times they had to retry
+    because another thread published a value first. """
+    def __init__(self, value):
+        self.value = value
+        self.swaps = 0
+        self.conflicts = 0
+        # Only held to compare and replace the value; reading it does not
+        # need the lock, as getting an attribute is atomic.
+        self._lock = Lock()
+    
+    def deref(self):
+        """ Return the current value. """
+        return self.value
+    
+    def compare_and_set(self, old, new):
+        """ Replace the value by new if it is old, which is compared by
+        identity. Return whether it was replaced. """
+        self._lock.acquire()
+        try:
+            if self.value is not old:
+                return False
+            self.value = new
+            return True
+        finally:
+            self._lock.release()
+    
+    def reset(self, new):
+        """ Replace the value by new regardless of what it is. """
+        self._lock.acquire()
+        try:
+            self.value = new
+        finally:
+            self._lock.release()
+    
+    def _count(self, published):
+        """ Count one published value if published is True, otherwise one
+        conflict. """
+        self._lock.acquire()
+        try:
+            if published:
+                self.swaps += 1
+            else:
+                self.conflicts += 1
+        finally:
+            self._lock.release()
+    
+    def swap(self, fn, *args):
+        """ Replace the value by fn(value, *args) and return the new value.
+        If another thread replaced the value in the meantime, fn is
+        called again with its value, so fn should not have side
+        effects. """
+        while True:
+            old = self.value
+            new = fn(old, *args)
+            if self.compare_and_set(old, new):
+                self._count(True)
+                return new
+            self._count(False)
+    
+    def commit(self, base, new):
+        """ Publish new, a PersistentTreeMap or PersistentTreeSet derived
+        from base, and return the value published. If the value is no
+        longer base, the changes between base and new are applied to it
+        instead of recomputing them like :meth:`swap` does. Finding them
+        skips the subtrees shared by base and new, so rebasing costs time
+        proportional to the number of changes rather than the size. """
+        changes = None
+        while True:
+            old = self.value
+            if old is not base:
+                # Another thread published a value since base.
+                self._count(False)
+                if changes is None:
+                    changes = list(base.diff(new))
+                new = _replay(old, changes)
+                base = old
+            if self.compare_and_set(base, new):
+                self._count(True)
+                return new
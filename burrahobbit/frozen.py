@@ -0,0 +1,378 @@
+# Copyright (C) 2011 by Florian Mayer <florian.mayer@bitsrc.org>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+""" Read-only maps stored in a file that is memory-mapped for reading.
+
+:func:`dump` writes the associations of a map into a file.
+:class:`FrozenTreeMap` maps such a file into memory and decodes the nodes
+and entries it needs for every operation from there, so opening it is
+O(1) and all processes that open the same file share its pages.
+
+Keys and values are stored pickled. The trie in the file dispatches on
+the CRC32 of a canonical encoding of the keys rather than on hash(), which
+may differ between processes, and keys are compared with == once decoded.
+The encoding is the same for equal keys that are None, strings, unicode,
+numbers other than complex ones, or tuples of those; other keys have to
+pickle to the same bytes whenever they are equal. """
+
+import mmap
+
+from cStringIO import StringIO
+from struct import calcsize, pack, unpack_from
+from zlib import crc32
+from sys import version_info
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from burrahobbit._tree import BMAP, SHIFT, bit_count
+from burrahobbit.treedict import PersistentTreeMap
+
+PROTOCOL = 2
+
+# The file starts with HEADER, (MAGIC, VERSION), and ends with TRAILER,
+# (offset of the root node, number of entries). The offset of the root
+# node of an empty map is 0.
+MAGIC = 0x4d464842
+VERSION = 2
+HEADER = '<II'
+TRAILER = '<QQ'
+
+# Every node starts with NODE. For dispatch nodes, that is (DISPATCH,
+# datamap, nodemap), followed by the offsets of the entries and then of
+# the children, in the order of their bits. For collision nodes, it is
+# (COLLISION, number of entries, 0), followed by the offsets of the
+# entries. Every entry is ENTRY, (length of the key, length of the
+# value), followed by the pickled key and value.
+DISPATCH = 0
+COLLISION = 1
+NODE = '<BII'
+OFFSET = '<Q'
+ENTRY = '<II'
+
+NODESIZE = calcsize(NODE)
+OFFSETSIZE = calcsize(OFFSET)
+ENTRYSIZE = calcsize(ENTRY)
+
+
+def _hash(data):
+    """ Return the hash the trie in the file uses for the encoded key
+    data. """
+    return crc32(data) & 0xffffffff
+
+
+def _canonical(key):
+    """ Return key with equal numbers and strings of different types
+    replaced by one of them, e.g. 5 for 5L, 5.0 and u'5'. """
+    if isinstance(key, tuple):
+        return tuple([_canonical(item) for item in key])
+    if isinstance(key, unicode):
+        # A unicode string only equals a str if both are ASCII, in which
+        # case its UTF-8 encoding is that str.
+        return key.encode('utf-8')
+    if isinstance(key, (bool, long)):
+        return int(key)
+    if isinstance(key, float):
+        try:
+            if key == int(key):
+                return int(key)
+        except (OverflowError, ValueError):
+            # Infinity and NaN equal no int.
+            pass
+    return key
+
+
+def _encode(key):
+    """ Return the bytes the hash of key is computed from. They are pickled
+    without a memo, which would otherwise make e.g. a tuple of two equal
+    strings pickle differently depending on whether they are the same
+    object. """
+    buf = StringIO()
+    pickler = pickle.Pickler(buf, PROTOCOL)
+    pickler.fast = 1
+    pickler.dump(_canonical(key))
+    return buf.getvalue()
+
+
+class _Writer(object):
+    """ Write nodes to fileobj, keeping track of the offset. """
+    __slots__ = ['fileobj', 'offset']
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.offset = 0
+    
+    def write(self, data):
+        """ Write data and return the offset it was written at. """
+        offset = self.offset
+        self.fileobj.write(data)
+        self.offset += len(data)
+        return offset
+    
+    def entry(self, keydata, valuedata):
+        """ Write entry and return its offset. """
+        return self.write(
+            pack(ENTRY, len(keydata), len(valuedata)) + keydata + valuedata
+        )
+    
+    def node(self, shift, entries):
+        """ Write the subtree on level shift containing entries, a list of
+        (hsh, keydata, valuedata) triples, children first, and return the
+        offset of its root. Like build, this partitions the entries by the
+        relevant part of their hash. """
+        buckets = {}
+        for entry in entries:
+            bit = 1 << (entry[0] >> shift & BMAP)
+            bucket = buckets.get(bit)
+            if bucket is None:
+                buckets[bit] = [entry]
+            else:
+                bucket.append(entry)
+        
+        datamap = nodemap = 0
+        data = []
+        nodes = []
+        for bit in sorted(buckets):
+            bucket = buckets[bit]
+            if len(bucket) == 1:
+                datamap |= bit
+                data.append(self.entry(bucket[0][1], bucket[0][2]))
+                continue
+            
+            nodemap |= bit
+            hsh = bucket[0][0]
+            for entry in bucket:
+                if entry[0] != hsh:
+                    nodes.append(self.node(shift + SHIFT, bucket))
+                    break
+            else:
+                # All hashes are equal, so there is nothing left to
+                # dispatch on.
+                offsets = [
+                    self.entry(keydata, valuedata)
+                    for hsh, keydata, valuedata in bucket
+                ]
+                nodes.append(self.write(
+                    pack(NODE, COLLISION, len(offsets), 0) +
+                    pack('<%dQ' % len(offsets), *offsets)
+                ))
+        
+        offsets = data + nodes
+        return self.write(
+            pack(NODE, DISPATCH, datamap, nodemap) +
+            pack('<%dQ' % len(offsets), *offsets)
+        )
+
+
+def dump(mp, fileobj):
+    """ Write the associations of the map mp, or any other object with an
+    iteritems method, to fileobj, which has to be opened for writing in
+    binary mode. The file can be opened with :class:`FrozenTreeMap`. """
+    entries = []
+    for key, value in mp.iteritems():
+        entries.append((
+            _hash(_encode(key)), pickle.dumps(key, PROTOCOL),
+            pickle.dumps(value, PROTOCOL)
+        ))
+    
+    writer = _Writer(fileobj)
+    writer.write(pack(HEADER, MAGIC, VERSION))
+    root = 0
+    if entries:
+        root = writer.node(0, entries)
+    writer.write(pack(TRAILER, root, len(entries)))
+
+
+class FrozenTreeMap(object):
+    """ Read-only map backed by the file at path, which was written by
+    :func:`dump`. The file is memory-mapped and nothing is decoded until
+    it is needed. Call :meth:`close` when done with it, or use it as a
+    context manager, which closes it on exit.
+    
+    Supports lookups, membership tests and iteration. To change the
+    contents, create a transient with :meth:`transient`. """
+    __slots__ = ['file', 'mmap', 'root', 'count']
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        try:
+            self.mmap = mmap.mmap(
+                self.file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        except:
+            self.file.close()
+            raise
+        
+        if len(self.mmap) < calcsize(HEADER) + calcsize(TRAILER):
+            self.close()
+            raise ValueError("%r is no frozen map." % path)
+        magic, version = unpack_from(HEADER, self.mmap, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError("%r is no frozen map." % path)
+        if version != VERSION:
+            self.close()
+            raise ValueError(
+                "%r has unsupported version %d." % (path, version)
+            )
+        self.root, self.count = unpack_from(
+            TRAILER, self.mmap, len(self.mmap) - calcsize(TRAILER)
+        )
+    
+    def close(self):
+        """ Unmap and close the file. The map cannot be used afterwards. """
+        self.mmap.close()
+        self.file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def __len__(self):
+        return self.count
+    
+    def _offset(self, node, idx):
+        """ Return the idxth offset stored in the node at offset node. """
+        return unpack_from(
+            OFFSET, self.mmap, node + NODESIZE + OFFSETSIZE * idx
+        )[0]
+    
+    def _find(self, key):
+        """ Return offset of the entry of key, or None if there is none. """
+        hsh = _hash(_encode(key))
+        node = self.root
+        shift = 0
+        while node:
+            kind, datamap, nodemap = unpack_from(NODE, self.mmap, node)
+            if kind == COLLISION:
+                for idx in xrange(datamap):
+                    entry = self._offset(node, idx)
+                    if self._key(entry) == key:
+                        return entry
+                return None
+            
+            bit = 1 << (hsh >> shift & BMAP)
+            if datamap & bit:
+                entry = self._offset(node, bit_count(datamap & (bit - 1)))
+                if self._key(entry) == key:
+                    return entry
+                return None
+            if not nodemap & bit:
+                return None
+            node = self._offset(
+                node, bit_count(datamap) + bit_count(nodemap & (bit - 1))
+            )
+            shift += SHIFT
+        return None
+    
+    def _decode(self, entry):
+        """ Return (key, value) of the entry at offset entry. """
+        keylen, valuelen = unpack_from(ENTRY, self.mmap, entry)
+        start = entry + ENTRYSIZE
+        middle = start + keylen
+        return (
+            pickle.loads(self.mmap[start:middle]),
+            pickle.loads(self.mmap[middle:middle + valuelen])
+        )
+    
+    def _key(self, entry):
+        """ Return the key of the entry at offset entry. """
+        keylen = unpack_from(ENTRY, self.mmap, entry)[0]
+        start = entry + ENTRYSIZE
+        return pickle.loads(self.mmap[start:start + keylen])
+    
+    def _value(self, entry):
+        """ Return the value of the entry at offset entry. """
+        keylen, valuelen = unpack_from(ENTRY, self.mmap, entry)
+        start = entry + ENTRYSIZE + keylen
+        return pickle.loads(self.mmap[start:start + valuelen])
+    
+    def __getitem__(self, key):
+        entry = self._find(key)
+        if entry is None:
+            raise KeyError(key)
+        return self._value(entry)
+    
+    def get(self, key, default=None):
+        """ Return the value associated with key, or default if there is
+        none. """
+        entry = self._find(key)
+        if entry is None:
+            return default
+        return self._value(entry)
+    
+    def __contains__(self, key):
+        return self._find(key) is not None
+    
+    def _entries(self):
+        """ Yield offsets of all entries. """
+        if not self.root:
+            return
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            kind, datamap, nodemap = unpack_from(NODE, self.mmap, node)
+            if kind == COLLISION:
+                ndata, nnodes = datamap, 0
+            else:
+                ndata, nnodes = bit_count(datamap), bit_count(nodemap)
+            offsets = unpack_from(
+                '<%dQ' % (ndata + nnodes), self.mmap, node + NODESIZE
+            )
+            for entry in offsets[:ndata]:
+                yield entry
+            # Push the children in reverse so the first one is visited
+            # first.
+            children = list(offsets[ndata:])
+            children.reverse()
+            stack.extend(children)
+    
+    def __iter__(self):
+        """ Yield keys for all items. """
+        for entry in self._entries():
+            yield self._key(entry)
+    
+    iterkeys = __iter__
+    
+    def iteritems(self):
+        """ Yield key, value pairs for all items. """
+        for entry in self._entries():
+            yield self._decode(entry)
+    
+    def itervalues(self):
+        """ Yield values for all items. """
+        for entry in self._entries():
+            yield self._value(entry)
+    
+    if version_info >= (3,):
+        keys = iterkeys
+        items = iteritems
+        values = itervalues
+    else:
+        keys = lambda self: list(self)
+        items = lambda self: list(self.iteritems())
+        values = lambda self: list(self.itervalues())
+    
+    def transient(self):
+        """ Return :class:`TransientTreeMap` with the contents of self.
+        Unlike opening the file, this decodes all entries. """
+        return PersistentTreeMap.from_itr(self.iteritems()).transient()
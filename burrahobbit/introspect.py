@@ -0,0 +1,139 @@
+# Copyright (C) 2011 by Florian Mayer <florian.mayer@bitsrc.org>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+""" Inspect the shape and memory use of the trees of maps and sets. """
+
+import sys
+
+from burrahobbit._tree import BRANCH, NULLNODE, DispatchNode, bit_count
+
+# Owner of the nodes that are reachable from more than one tree.
+SHARED = -1
+
+
+def node_bytes(node):
+    """ Return the bytes used by node and its array, not counting the keys,
+    values and children. """
+    return sys.getsizeof(node) + sys.getsizeof(node.array)
+
+
+def _children(node):
+    """ Return list of the children of node. """
+    if isinstance(node, DispatchNode):
+        return node.array[2 * bit_count(node.datamap):]
+    return []
+
+
+def stats(*containers):
+    """ Return dict describing the trees of the maps and sets in
+    containers, e.g. several versions of one map. Nodes that are shared
+    between the trees are counted once.
+    
+    depth
+        {level: number of entries stored in nodes on that level}, the
+        root is on level 0.
+    nodes
+        {class name: number of nodes}.
+    collisions
+        {number of entries: number of HashCollisionNodes with as many}.
+    fill
+        {number of used slots: number of DispatchNodes with as many}.
+    mean_fill
+        Average fraction of the BRANCH slots of DispatchNodes used.
+    bytes
+        Estimated bytes used by all nodes, not counting keys and values.
+    shared_bytes
+        Bytes of the nodes reachable from more than one of the trees.
+    unique_bytes
+        List of the bytes of the nodes only reachable from the respective
+        tree. Dropping that tree frees them.
+    """
+    owners = {}
+    sizes = {}
+    depth = {}
+    nodes = {}
+    collisions = {}
+    fill = {}
+    
+    for idx, container in enumerate(containers):
+        if container.root is NULLNODE:
+            continue
+        stack = [(container.root, 0)]
+        while stack:
+            node, level = stack.pop()
+            owner = owners.get(id(node))
+            if owner is not None:
+                if owner != idx and owner != SHARED:
+                    _share(node, owners)
+                continue
+            
+            owners[id(node)] = idx
+            sizes[id(node)] = node_bytes(node)
+            name = node.__class__.__name__
+            nodes[name] = nodes.get(name, 0) + 1
+            if isinstance(node, DispatchNode):
+                entries = bit_count(node.datamap)
+                slots = bit_count(node.datamap | node.nodemap)
+                fill[slots] = fill.get(slots, 0) + 1
+            else:
+                entries = node.count
+                collisions[entries] = collisions.get(entries, 0) + 1
+            if entries:
+                depth[level] = depth.get(level, 0) + entries
+            for child in _children(node):
+                stack.append((child, level + 1))
+    
+    unique = [0] * len(containers)
+    shared = 0
+    for key, owner in owners.iteritems():
+        if owner == SHARED:
+            shared += sizes[key]
+        else:
+            unique[owner] += sizes[key]
+    
+    ndispatch = sum(fill.itervalues())
+    mean_fill = 0.0
+    if ndispatch:
+        mean_fill = (
+            sum([slots * number for slots, number in fill.iteritems()]) /
+            float(ndispatch * BRANCH)
+        )
+    return {
+        'depth': depth,
+        'nodes': nodes,
+        'collisions': collisions,
+        'fill': fill,
+        'mean_fill': mean_fill,
+        'bytes': sum(sizes.itervalues()),
+        'shared_bytes': shared,
+        'unique_bytes': unique,
+    }
+
+
+def _share(node, owners):
+    """ Mark node and all its descendants as shared. Subtrees that already
+    are, are skipped, so every node is only marked once. """
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if owners.get(id(node)) == SHARED:
+            continue
+        owners[id(node)] = SHARED
+        stack.extend(_children(node))
@@ -0,0 +1,117 @@
+# Copyright (C) 2011 by Florian Mayer <florian.mayer@bitsrc.org>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+""" Map shared between threads that is divided into BRANCH shards by the
+relevant part of the hashes of the keys on the first level of the tree.
+Every shard is an :class:`burrahobbit.Atom` of its own, so writers only
+conflict with writers of keys in the same shard. """
+
+from burrahobbit._tree import (
+    BMAP, BRANCH, NULLNODE, _assemble, bit_count, root_slots
+)
+from burrahobbit.atom import Atom
+from burrahobbit.treedict import PersistentTreeMap
+
+
+class ShardedTreeMap(object):
+    """ Map consisting of BRANCH PersistentTreeMaps, the i-th of which
+    contains the keys whose hash ends in i in base BRANCH, i.e. that are
+    stored in the i-th slot of the root of a PersistentTreeMap. The roots
+    of the shards are the root of the whole map with only that slot.
+    
+    Every method only uses the shard of the key it is given, except for
+    :meth:`snapshot` and len(), which take O(BRANCH) time. """
+    def __init__(self, mp=None):
+        roots = [NULLNODE] * BRANCH
+        if mp is not None:
+            for bit, slot in root_slots(mp._snapshot().root):
+                roots[bit_count(bit - 1)] = _assemble([(bit, slot)])
+        self.shards = [Atom(PersistentTreeMap(root)) for root in roots]
+    
+    def shard(self, key):
+        """ Return the Atom of the shard that key belongs to. """
+        return self.shards[hash(key) & BMAP]
+    
+    def __len__(self):
+        total = 0
+        for shard in self.shards:
+            total += len(shard.deref())
+        return total
+    
+    def __getitem__(self, key):
+        return self.shard(key).deref()[key]
+    
+    def __contains__(self, key):
+        return key in self.shard(key).deref()
+    
+    def get(self, key, default=None):
+        """ Return the value associated with key, or default if there is
+        none. """
+        return self.shard(key).deref().get(key, default)
+    
+    def assoc(self, key, value):
+        """ Add association between key and value. May override an
+        existing association. """
+        self.shard(key).swap(PersistentTreeMap.assoc, key, value)
+    
+    def without(self, key):
+        """ Remove key. Raise KeyError if it is not contained. """
+        self.shard(key).swap(PersistentTreeMap.without, key)
+    
+    def swap(self, key, fn, *args):
+        """ Replace the PersistentTreeMap of the shard of key by
+        fn(shard, *args), which must only change associations of keys in
+        that shard, e.g. of key itself. See :meth:`Atom.swap`. """
+        return self.shard(key).swap(fn, *args)
+    
+    @property
+    def swaps(self):
+        """ Number of changes made to all shards. """
+        total = 0
+        for shard in self.shards:
+            total += shard.swaps
+        return total
+    
+    @property
+    def conflicts(self):
+        """ Number of times changes had to be retried because another
+        thread changed the same shard first. """
+        total = 0
+        for shard in self.shards:
+            total += shard.conflicts
+        return total
+    
+    def snapshot(self):
+        """ Return PersistentTreeMap of the current contents, whose root is
+        assembled from the slots of the roots of the shards in O(BRANCH).
+        Every shard is read at one point in time, but the shards are read
+        one after the other. Changes made to different shards while
+        taking the snapshot may be missing from it. """
+        slots = []
+        for shard in self.shards:
+            for item in root_slots(shard.deref().root):
+                slots.append(item)
+        return PersistentTreeMap(_assemble(slots))
+    
+    def __iter__(self):
+        return iter(self.snapshot())
+    
+    def iteritems(self):
+        """ Yield key, value pairs of a snapshot of the map. """
+        return self.snapshot().iteritems()
@@ -0,0 +1,182 @@
+# Copyright (C) 2011 by Florian Mayer <florian.mayer@bitsrc.org>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+""" Snapshots of maps that only store what changed since a base version.
+
+:func:`dump` writes a full snapshot of a map, :func:`dump_delta` writes
+the changes between a base map and a newer version of it. Finding those
+uses :meth:`PersistentTreeMap.diff`, which skips the subtrees both share,
+so the cost is proportional to the number of changes if the new version
+was derived from the base by assoc, without and friends.
+
+:func:`load` reads a full snapshot and applies the deltas written after
+it, in order. :func:`compact` merges a chain of deltas into a single one,
+so loading does not have to read the changes to keys that were changed
+again later. """
+
+from itertools import izip
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from burrahobbit._tree import MISSING
+
+PROTOCOL = 2
+
+ADDED = 0
+CHANGED = 1
+REMOVED = 2
+
+# The kind of the change that two consecutive changes to the same key
+# amount to. Adding a key and removing it again amounts to no change.
+MERGED = {
+    (ADDED, CHANGED): ADDED,
+    (CHANGED, CHANGED): CHANGED,
+    (CHANGED, REMOVED): REMOVED,
+    (REMOVED, ADDED): CHANGED,
+}
+
+
+class Delta(object):
+    """ Changes between two versions of a map. changes maps every key that
+    was added, changed or removed to (ADDED, value), (CHANGED, value) or
+    (REMOVED, None). """
+    __slots__ = ['changes']
+    def __init__(self, changes=None):
+        if changes is None:
+            changes = {}
+        self.changes = changes
+    
+    @staticmethod
+    def between(base, new):
+        """ Return the Delta that turns the map base into the map new. """
+        changes = {}
+        for key, value, newvalue in base.diff(new):
+            if value is MISSING:
+                changes[key] = (ADDED, newvalue)
+            elif newvalue is MISSING:
+                changes[key] = (REMOVED, None)
+            else:
+                changes[key] = (CHANGED, newvalue)
+        return Delta(changes)
+    
+    def merge(self, other):
+        """ Return Delta with the changes of self followed by those of
+        other. """
+        changes = self.changes.copy()
+        for key, change in other.changes.iteritems():
+            mine = changes.get(key)
+            if mine is None:
+                changes[key] = change
+                continue
+            if mine[0] == ADDED and change[0] == REMOVED:
+                del changes[key]
+                continue
+            kind = MERGED.get((mine[0], change[0]))
+            if kind is None:
+                raise ValueError(
+                    "Deltas are not consecutive for key %r." % (key, )
+                )
+            changes[key] = (kind, change[1])
+        return Delta(changes)
+    
+    def apply(self, mp):
+        """ Return mp with the changes applied. """
+        removed = []
+        assoc = []
+        for key, (kind, value) in self.changes.iteritems():
+            if kind == REMOVED:
+                removed.append(key)
+            else:
+                assoc.append((key, value))
+        return mp.without_many(removed).assoc_many(assoc)
+    
+    def __reduce__(self):
+        # Pickled as flat lists rather than a dict of tuples.
+        flat = ([], [], [])
+        for key, (kind, value) in self.changes.iteritems():
+            flat[kind].extend([key, value])
+        return _load_delta, flat
+    
+    def __len__(self):
+        return len(self.changes)
+
+
+def _load_delta(*flat):
+    """ Return Delta for the flat lists [key0, value0, ...] of added,
+    changed and removed keys. Used to unpickle deltas. """
+    changes = {}
+    for kind, items in enumerate(flat):
+        itr = iter(items)
+        for key, value in izip(itr, itr):
+            changes[key] = (kind, value)
+    return Delta(changes)
+
+
+def dump(mp, fileobj):
+    """ Write full snapshot of the map mp to fileobj. """
+    pickle.dump(mp, fileobj, PROTOCOL)
+
+
+def dump_delta(new, base, fileobj):
+    """ Write the changes that turn the map base into the map new to
+    fileobj. """
+    pickle.dump(Delta.between(base, new), fileobj, PROTOCOL)
+
+
+def load_delta(fileobj):
+    """ Return :class:`Delta` read from fileobj. """
+    return pickle.load(fileobj)
+
+
+def load(fileobj, deltas=()):
+    """ Return the map whose full snapshot is read from fileobj, with the
+    deltas read from the file objects in deltas applied in order. All
+    deltas are merged first, and the result is applied at once. """
+    mp = pickle.load(fileobj)
+    delta = _merge_all(deltas)
+    if delta is not None:
+        mp = delta.apply(mp)
+    return mp
+
+
+def compact(deltas, fileobj):
+    """ Merge the deltas read from the file objects in deltas into one
+    and write it to fileobj. Loading a snapshot with it gives the same
+    map as with all of the deltas. """
+    delta = _merge_all(deltas)
+    if delta is None:
+        delta = Delta()
+    pickle.dump(delta, fileobj, PROTOCOL)
+
+
+def _merge_all(deltas):
+    """ Return the deltas read from the file objects in deltas merged, or
+    None if there are none. """
+    merged = None
+    for deltafile in deltas:
+        delta = load_delta(deltafile)
+        if merged is None:
+            merged = delta
+        else:
+            merged = merged.merge(delta)
+    return merged
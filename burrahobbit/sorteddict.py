@@ -0,0 +1,727 @@
+# Copyright (C) 2011 by Florian Mayer <florian.mayer@bitsrc.org>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from bisect import bisect_left, bisect_right
+from itertools import izip
+from operator import itemgetter
+from sys import version_info
+
+from burrahobbit._tree import SENTINEL, BRANCH, HASHMOD
+from burrahobbit.treedict import _pairs
+from burrahobbit.util import all, chain_from_iterable
+
+# Nodes have at most MAXKEYS entries or children. All but the root have
+# at least half as many.
+MAXKEYS = BRANCH
+MINKEYS = MAXKEYS // 2
+
+
+class Leaf(object):
+    """ Node holding the sorted list keys and the list values of the
+    associations of a range of keys. edit is the token of the transient
+    that owns the node, if any. Like in DispatchNode, contenthash caches
+    the hash of the node; it is None until it is first needed and
+    whenever the node may be changed in place. """
+    __slots__ = ['keys', 'values', 'edit', 'contenthash']
+    def __init__(self, keys, values, edit=None):
+        self.keys = keys
+        self.values = values
+        self.edit = edit
+        self.contenthash = None
+    
+    def _editable(self, edit):
+        """ Return self if it is owned by edit, otherwise a copy of self
+        that is. """
+        if self.edit is edit:
+            self.contenthash = None
+            return self
+        return Leaf(self.keys[:], self.values[:], edit)
+    
+    def __hash__(self):
+        if self.contenthash is None:
+            total = 0
+            for item in izip(self.keys, self.values):
+                total += hash(item)
+            self.contenthash = total & HASHMOD
+        return self.contenthash
+    
+    def __len__(self):
+        return len(self.keys)
+
+
+class Branch(object):
+    """ Node dispatching between the list children. The keys in children[i]
+    are at least keys[i - 1] and less than keys[i]. See :class:`Leaf`
+    for edit and contenthash. """
+    __slots__ = ['keys', 'children', 'edit', 'contenthash']
+    def __init__(self, keys, children, edit=None):
+        self.keys = keys
+        self.children = children
+        self.edit = edit
+        self.contenthash = None
+    
+    def _editable(self, edit):
+        """ Return self if it is owned by edit, otherwise a copy of self
+        that is. """
+        if self.edit is edit:
+            self.contenthash = None
+            return self
+        return Branch(self.keys[:], self.children[:], edit)
+    
+    def __hash__(self):
+        # The hash is the sum of the hashes of the associations, so it
+        # does not depend on how they are split between the children,
+        # which reuse their cached hash.
+        if self.contenthash is None:
+            total = 0
+            for child in self.children:
+                total += hash(child)
+            self.contenthash = total & HASHMOD
+        return self.contenthash
+    
+    def __len__(self):
+        return len(self.children)
+
+
+EMPTYLEAF = Leaf([], [])
+
+
+def _find(node, key, default):
+    """ Return value associated with key in the subtree, or default if
+    there is none. """
+    while isinstance(node, Branch):
+        node = node.children[bisect_right(node.keys, key)]
+    keys = node.keys
+    idx = bisect_left(keys, key)
+    if idx < len(keys) and keys[idx] == key:
+        return node.values[idx]
+    return default
+
+
+def _iassoc(node, key, value, edit):
+    """ Add association between key and value to the subtree. Nodes owned
+    by edit are modified in place, all others are copied. Return
+    (node, split, added), where split is None or (key, node) if the node
+    had to be split in two, and added tells whether key is new. """
+    if isinstance(node, Leaf):
+        keys = node.keys
+        idx = bisect_left(keys, key)
+        if idx < len(keys) and keys[idx] == key:
+            if keys[idx] is key and node.values[idx] is value:
+                return node, None, False
+            node = node._editable(edit)
+            node.keys[idx] = key
+            node.values[idx] = value
+            return node, None, False
+        node = node._editable(edit)
+        node.keys.insert(idx, key)
+        node.values.insert(idx, value)
+        if len(node.keys) <= MAXKEYS:
+            return node, None, True
+        half = len(node.keys) // 2
+        right = Leaf(node.keys[half:], node.values[half:], edit)
+        del node.keys[half:]
+        del node.values[half:]
+        return node, (right.keys[0], right), True
+    
+    idx = bisect_right(node.keys, key)
+    child, split, added = _iassoc(node.children[idx], key, value, edit)
+    if child is node.children[idx] and split is None:
+        if node.edit is edit:
+            # The child may have been changed in place.
+            node.contenthash = None
+        return node, None, added
+    node = node._editable(edit)
+    node.children[idx] = child
+    if split is None:
+        return node, None, added
+    node.keys.insert(idx, split[0])
+    node.children.insert(idx + 1, split[1])
+    if len(node.children) <= MAXKEYS:
+        return node, None, added
+    half = len(node.children) // 2
+    right = Branch(node.keys[half:], node.children[half:], edit)
+    sep = node.keys[half - 1]
+    del node.keys[half - 1:]
+    del node.children[half:]
+    return node, (sep, right), added
+
+
+def _iwithout(node, key, edit):
+    """ Remove association with key from the subtree and return the
+    resulting node, which may have less than MINKEYS entries or children.
+    Nodes owned by edit are modified in place, all others are copied.
+    Raise KeyError if there is no such association. """
+    if isinstance(node, Leaf):
+        keys = node.keys
+        idx = bisect_left(keys, key)
+        if idx == len(keys) or not keys[idx] == key:
+            raise KeyError(key)
+        node = node._editable(edit)
+        del node.keys[idx]
+        del node.values[idx]
+        return node
+    
+    idx = bisect_right(node.keys, key)
+    child = _iwithout(node.children[idx], key, edit)
+    node = node._editable(edit)
+    node.children[idx] = child
+    if len(child) < MINKEYS:
+        _rebalance(node, max(idx - 1, 0), edit)
+    return node
+
+
+def _rebalance(node, idx, edit):
+    """ Merge node.children[idx] and node.children[idx + 1], or move
+    entries between them if there are too many for one node. """
+    left = node.children[idx]
+    right = node.children[idx + 1]
+    if isinstance(left, Leaf):
+        keys = left.keys + right.keys
+        values = left.values + right.values
+        if len(keys) <= MAXKEYS:
+            node.children[idx] = Leaf(keys, values, edit)
+            del node.children[idx + 1]
+            del node.keys[idx]
+            return
+        half = len(keys) // 2
+        node.children[idx] = Leaf(keys[:half], values[:half], edit)
+        node.children[idx + 1] = Leaf(keys[half:], values[half:], edit)
+        node.keys[idx] = keys[half]
+        return
+    
+    keys = left.keys + [node.keys[idx]] + right.keys
+    children = left.children + right.children
+    if len(children) <= MAXKEYS:
+        node.children[idx] = Branch(keys, children, edit)
+        del node.children[idx + 1]
+        del node.keys[idx]
+        return
+    half = len(children) // 2
+    node.children[idx] = Branch(keys[:half - 1], children[:half], edit)
+    node.children[idx + 1] = Branch(keys[half:], children[half:], edit)
+    node.keys[idx] = keys[half - 1]
+
+
+def _spans(size):
+    """ Yield (start, end) of the parts that size items are divided into so
+    that all have at most MAXKEYS and, if there are several, at least
+    MINKEYS of them. """
+    parts = (size + MAXKEYS - 1) // MAXKEYS
+    for part in xrange(parts):
+        yield size * part // parts, size * (part + 1) // parts
+
+
+def build(keys, values):
+    """ Return tree containing the associations of the sorted list of
+    unique keys with the list of values. Every node is created with its
+    final entries or children at once. """
+    if not keys:
+        return EMPTYLEAF
+    nodes = []
+    lows = []
+    for start, end in _spans(len(keys)):
+        nodes.append(Leaf(keys[start:end], values[start:end]))
+        lows.append(keys[start])
+    while len(nodes) > 1:
+        parents = []
+        parentlows = []
+        for start, end in _spans(len(nodes)):
+            parents.append(Branch(lows[start + 1:end], nodes[start:end]))
+            parentlows.append(lows[start])
+        nodes = parents
+        lows = parentlows
+    return nodes[0]
+
+
+def _leaves(node, bound, reverse):
+    """ Yield the leaves of the subtree in ascending order of their keys,
+    or descending if reverse is True. If bound is not SENTINEL, start
+    at the leaf that bound would be in. """
+    stack = []
+    while True:
+        while isinstance(node, Branch):
+            if bound is SENTINEL:
+                if reverse:
+                    idx = len(node.children) - 1
+                else:
+                    idx = 0
+            elif reverse:
+                idx = bisect_left(node.keys, bound)
+            else:
+                idx = bisect_right(node.keys, bound)
+            stack.append((node, idx))
+            node = node.children[idx]
+        yield node
+        
+        # Go up to the first branch that has a next child and descend to
+        # its first (or last) leaf from there.
+        bound = SENTINEL
+        while stack:
+            node, idx = stack.pop()
+            if reverse:
+                idx -= 1
+            else:
+                idx += 1
+            if 0 <= idx < len(node.children):
+                stack.append((node, idx))
+                node = node.children[idx]
+                break
+        else:
+            return
+
+
+def _flatten(node):
+    """ Return (keys, values) lists of all associations in the subtree. """
+    keys = []
+    values = []
+    for leaf in _leaves(node, SENTINEL, False):
+        keys.extend(leaf.keys)
+        values.extend(leaf.values)
+    return keys, values
+
+
+def _load(cls, flat):
+    """ Return sorted map of type cls containing the associations in flat,
+    which is [key0, value0, key1, value1, ...] in ascending order of the
+    keys. Used to unpickle sorted maps. """
+    return cls(build(flat[::2], flat[1::2]), len(flat) // 2)
+
+
+def _merge(mp, other, left, both, right):
+    """ Return PersistentSortedMap of the associations of mp whose key is
+    not in other if left is True, of those of other whose key is also in
+    mp if both is True, and of those of other whose key is not in mp if
+    right is True. """
+    mykeys, myvalues = _flatten(mp.root)
+    theirkeys, theirvalues = _flatten(other.root)
+    keys = []
+    values = []
+    idx = 0
+    otheridx = 0
+    while idx < len(mykeys) and otheridx < len(theirkeys):
+        key = mykeys[idx]
+        otherkey = theirkeys[otheridx]
+        if key < otherkey:
+            if left:
+                keys.append(key)
+                values.append(myvalues[idx])
+            idx += 1
+        elif otherkey < key:
+            if right:
+                keys.append(otherkey)
+                values.append(theirvalues[otheridx])
+            otheridx += 1
+        else:
+            if both:
+                keys.append(otherkey)
+                values.append(theirvalues[otheridx])
+            idx += 1
+            otheridx += 1
+    if left:
+        keys.extend(mykeys[idx:])
+        values.extend(myvalues[idx:])
+    if right:
+        keys.extend(theirkeys[otheridx:])
+        values.extend(theirvalues[otheridx:])
+    return PersistentSortedMap(build(keys, values), len(keys))
+
+
+# The following implement the binary operators on PersistentSortedMaps.
+# If one of the maps is much smaller than the other, its associations are
+# looked up in or added to the larger one instead of merging all of them.
+
+def _union(mp, other):
+    """ Return PersistentSortedMap of the associations of mp and other.
+    If a key is contained in both, the one of other is used. """
+    if len(mp) > MAXKEYS * len(other):
+        return mp.assoc_many(other.iteritems())
+    if len(other) > MAXKEYS * len(mp):
+        new = other.transient()
+        for key, value in mp.iteritems():
+            if key not in new:
+                new = new.assoc(key, value)
+        return new.persistent()
+    return _merge(mp, other, True, True, True)
+
+
+def _intersection(mp, other, original):
+    """ Return sorted map of the type of original, which other is a
+    snapshot of, with the associations of other whose key is also
+    contained in mp. """
+    if len(mp) > MAXKEYS * len(other) or len(other) > MAXKEYS * len(mp):
+        keys = []
+        values = []
+        if len(mp) > len(other):
+            for key, value in other.iteritems():
+                if key in mp:
+                    keys.append(key)
+                    values.append(value)
+        else:
+            for key in mp:
+                value = other.get(key, SENTINEL)
+                if value is not SENTINEL:
+                    keys.append(key)
+                    values.append(value)
+        return original.__class__(build(keys, values), len(keys))
+    new = _merge(mp, other, False, True, False)
+    return original.__class__(new.root, new.length)
+
+
+def _symmetric_difference(mp, other):
+    """ Return PersistentSortedMap of the associations whose key is
+    contained in exactly one of mp and other. """
+    if len(mp) < len(other):
+        small, large = mp, other
+    else:
+        small, large = other, mp
+    if len(large) > MAXKEYS * len(small):
+        new = large.transient()
+        for key, value in small.iteritems():
+            if key in new:
+                new = new.without(key)
+            else:
+                new = new.assoc(key, value)
+        return new.persistent()
+    return _merge(mp, other, True, False, True)
+
+
+class PersistentSortedMap(object):
+    """ Map whose associations are kept in ascending order of their keys in
+    a B+ tree, whose leaves hold up to MAXKEYS associations. Unlike
+    PersistentTreeMap, the keys need not be hashable, but they have to
+    be orderable, and it can be iterated in order and queried for ranges
+    of keys. """
+    __slots__ = ['root', 'length']
+    def __init__(self, root=EMPTYLEAF, length=0):
+        self.root = root
+        self.length = length
+    
+    def __len__(self):
+        return self.length
+    
+    def __getitem__(self, key):
+        value = _find(self.root, key, SENTINEL)
+        if value is SENTINEL:
+            raise KeyError(key)
+        return value
+    
+    def __contains__(self, key):
+        return _find(self.root, key, SENTINEL) is not SENTINEL
+    
+    def get(self, key, default=None):
+        """ Return the value associated with key, or default if there is
+        none. """
+        return _find(self.root, key, default)
+    
+    def __and__(self, other):
+        return _intersection(self._snapshot(), other._snapshot(), other)
+    
+    def __xor__(self, other):
+        return _symmetric_difference(self._snapshot(), other._snapshot())
+    
+    def __or__(self, other):
+        return _union(self._snapshot(), other._snapshot())
+    
+    def __eq__(self, other):
+        if not isinstance(other, PersistentSortedMap):
+            return False
+        if self.root is other.root:
+            return True
+        return len(self) == len(other) and all(
+            item == otheritem
+            for item, otheritem in izip(self.iteritems(), other.iteritems())
+        )
+    
+    def __ne__(self, other):
+        return not self == other
+    
+    def __hash__(self):
+        # Only the nodes copied since the last time are hashed again.
+        return hash(self.root)
+    
+    def assoc(self, key, value):
+        """ Return copy of self with an association between key and value.
+        May override an existing association. """
+        new = PersistentSortedMap(self.root, self.length)
+        new._iassoc(key, value, object())
+        return new
+    
+    def without(self, key):
+        """ Return copy of self with key removed. """
+        new = PersistentSortedMap(self.root, self.length)
+        new._iwithout(key, object())
+        return new
+    
+    def _iassoc(self, key, value, edit):
+        """ Add association between key and value to self. """
+        root, split, added = _iassoc(self.root, key, value, edit)
+        if split is not None:
+            root = Branch([split[0]], [root, split[1]], edit)
+        self.root = root
+        if added:
+            self.length += 1
+    
+    def _iwithout(self, key, edit):
+        """ Remove association with key from self. """
+        root = _iwithout(self.root, key, edit)
+        if isinstance(root, Branch) and len(root.children) == 1:
+            root = root.children[0]
+        self.root = root
+        self.length -= 1
+    
+    def assoc_many(self, pairs):
+        """ Return copy of self with associations between the keys and
+        values of the iterable of (key, value) pairs added. May override
+        existing associations. This copies every node at most once. """
+        return self.transient().assoc_many(pairs).persistent()
+    
+    def without_many(self, keys):
+        """ Return copy of self with the keys of the iterable keys removed.
+        See :meth:`assoc_many`. """
+        return self.transient().without_many(keys).persistent()
+    
+    def update(self, other):
+        """ Return copy of self updated with the associations of other,
+        which is either a mapping or an iterable of (key, value) pairs,
+        like dict.update does. If other is a PersistentSortedMap, this is
+        self | other. """
+        if isinstance(other, PersistentSortedMap):
+            return self | other
+        return self.assoc_many(_pairs(other))
+    
+    def _chunks(self, lo, hi, reverse):
+        """ Yield iterators over the (key, value) pairs of the leaves whose
+        key is at least lo and less than hi, in ascending order, or in
+        descending order if reverse is True. lo and hi may be SENTINEL
+        if there is no such bound. """
+        if reverse:
+            bound = hi
+        else:
+            bound = lo
+        for leaf in _leaves(self.root, bound, reverse):
+            keys = leaf.keys
+            start = 0
+            end = len(keys)
+            if lo is not SENTINEL:
+                start = bisect_left(keys, lo)
+            if hi is not SENTINEL:
+                end = bisect_left(keys, hi)
+            if start < end:
+                keys = keys[start:end]
+                values = leaf.values[start:end]
+                if reverse:
+                    keys.reverse()
+                    values.reverse()
+                yield izip(keys, values)
+            # The leaf contains keys beyond the bound, so all further
+            # leaves do as well.
+            if reverse and start > 0 or not reverse and end < len(leaf.keys):
+                return
+    
+    def range(self, lo=None, hi=None, reverse=False):
+        """ Yield (key, value) pairs of the associations whose key is at
+        least lo and less than hi in ascending order of the keys, or in
+        descending order if reverse is True. If lo or hi is None, there is
+        no such bound. """
+        if lo is None:
+            lo = SENTINEL
+        if hi is None:
+            hi = SENTINEL
+        return chain_from_iterable(self._chunks(lo, hi, reverse))
+    
+    def floor(self, key):
+        """ Return (key, value) pair of the association with the greatest
+        key that is at most key. Raise KeyError if there is none. """
+        node = self.root
+        while isinstance(node, Branch):
+            node = node.children[bisect_right(node.keys, key)]
+        idx = bisect_right(node.keys, key)
+        if idx:
+            return node.keys[idx - 1], node.values[idx - 1]
+        # All keys of the leaf are greater than key, so the entry is the
+        # last one of the previous leaf, if any.
+        for item in self.range(None, key, True):
+            return item
+        raise KeyError(key)
+    
+    def ceiling(self, key):
+        """ Return (key, value) pair of the association with the least key
+        that is at least key. Raise KeyError if there is none. """
+        for item in self.range(key):
+            return item
+        raise KeyError(key)
+    
+    def __iter__(self):
+        """ Yield keys for all items in ascending order. """
+        return (key for key, value in self.iteritems())
+    
+    iterkeys = __iter__
+    
+    def __reversed__(self):
+        """ Yield keys for all items in descending order. """
+        return (key for key, value in self.range(reverse=True))
+    
+    def iteritems(self):
+        """ Yield key, value pairs for all items in ascending order of the
+        keys. """
+        return self.range()
+    
+    def itervalues(self):
+        """ Yield values for all items in ascending order of the keys. """
+        return (value for key, value in self.iteritems())
+    
+    if version_info >= (3,):
+        keys = iterkeys
+        items = iteritems
+        values = itervalues
+    else:
+        keys = lambda self: list(self)
+        items = lambda self: list(self.iteritems())
+        values = lambda self: list(self.itervalues())
+    
+    def _snapshot(self):
+        """ Return a PersistentSortedMap of the current contents. """
+        return self
+    
+    def __reduce__(self):
+        keys, values = _flatten(self.root)
+        flat = [None] * (2 * len(keys))
+        flat[::2] = keys
+        flat[1::2] = values
+        return _load, (self.__class__, flat)
+    
+    @staticmethod
+    def from_itr(itr):
+        """ Create PersistentSortedMap from iterable yielding (key, value)
+        pairs. If a key occurs more than once, the last value wins. """
+        # The sort is stable, so the last of several associations with
+        # equal keys is the last one among them.
+        pairs = list(itr)
+        pairs.sort(key=itemgetter(0))
+        keys = []
+        values = []
+        for key, value in pairs:
+            if keys and keys[-1] == key:
+                values[-1] = value
+            else:
+                keys.append(key)
+                values.append(value)
+        return PersistentSortedMap(build(keys, values), len(keys))
+    
+    @staticmethod
+    def from_dict(dct):
+        """ Create PersistentSortedMap from existing dictionary. """
+        return PersistentSortedMap.from_itr(dct.iteritems())
+    
+    def transient(self):
+        """ Return transient (mutable) copy of self. Changing the copy will not
+        affect the original object's immutability.
+        
+        See :class:`TransientSortedMap`. """
+        return TransientSortedMap(self.root, self.length)
+    
+    @staticmethod
+    def construct(argument=SENTINEL, **kwargs):
+        if kwargs:
+            if argument is not SENTINEL:
+                kwargs['argument'] = argument
+            return PersistentSortedMap.from_dict(kwargs)
+        
+        if argument is SENTINEL:
+            return PersistentSortedMap()
+        
+        if isinstance(argument, dict):
+            return PersistentSortedMap.from_dict(argument)
+        
+        if isinstance(argument, PersistentSortedMap):
+            return argument._snapshot()
+        
+        return PersistentSortedMap.from_itr(argument)
+
+
+class TransientSortedMap(PersistentSortedMap):
+    """ Nodes created or copied by a TransientSortedMap are owned by its
+    edit token and modified in place by later changes, all other nodes
+    are copied on their first change. """
+    __slots__ = ['edit']
+    # Transients change, so they cannot be used as dictionary keys.
+    __hash__ = None
+    
+    def __init__(self, root=EMPTYLEAF, length=0):
+        PersistentSortedMap.__init__(self, root, length)
+        self.edit = object()
+    
+    def _ensure_editable(self):
+        if self.edit is None:
+            raise RuntimeError("Transient used after persistent() call.")
+        return self.edit
+    
+    def assoc(self, key, value):
+        """ Add association between key and value and return self. """
+        self._iassoc(key, value, self._ensure_editable())
+        return self
+    
+    def without(self, key):
+        """ Remove key and return self. """
+        self._iwithout(key, self._ensure_editable())
+        return self
+    
+    def assoc_many(self, pairs):
+        """ Add associations between the keys and values of the iterable
+        of (key, value) pairs and return self. """
+        edit = self._ensure_editable()
+        for key, value in pairs:
+            self._iassoc(key, value, edit)
+        return self
+    
+    def without_many(self, keys):
+        """ Remove the keys of the iterable keys and return self. """
+        edit = self._ensure_editable()
+        for key in keys:
+            self._iwithout(key, edit)
+        return self
+    
+    def update(self, other):
+        """ Update self with the associations of other, which is either a
+        mapping or an iterable of (key, value) pairs, and return self. """
+        if isinstance(other, PersistentSortedMap):
+            other = other._snapshot().iteritems()
+        return self.assoc_many(_pairs(other))
+    
+    def _snapshot(self):
+        """ Return a PersistentSortedMap of the current contents. The nodes
+        are no longer owned by self, so it may still be changed
+        afterwards. """
+        if self.edit is not None:
+            self.edit = object()
+        return PersistentSortedMap(self.root, self.length)
+    
+    def transient(self):
+        return self._snapshot().transient()
+    
+    def persistent(self):
+        """ Return a persistent version of self.
+        
+        CAUTION: The :class:`TransientSortedMap` MAY NOT BE USED
+        after calling this method.
+        """
+        self.edit = None
+        return PersistentSortedMap(self.root, self.length)
@@ -0,0 +1,96 @@
+# Copyright (C) 2011 by Florian Mayer <florian.mayer@bitsrc.org>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import threading
+
+from burrahobbit import Atom, dict as bdict, set as bset
+
+
+def test_compare_and_set():
+    mp = bdict(a=1)
+    atom = Atom(mp)
+    assert atom.deref() is mp
+    new = mp.assoc('b', 2)
+    assert not atom.compare_and_set(bdict(a=1), new)
+    assert atom.compare_and_set(mp, new)
+    assert atom.deref() is new
+    atom.reset(mp)
+    assert atom.deref() is mp
+
+
+def test_swap():
+    atom = Atom(bdict())
+    assert atom.swap(lambda mp, key: mp.assoc(key, 1), 'a') == bdict(a=1)
+    assert atom.swaps == 1
+    assert atom.conflicts == 0
+    
+    # Every call of fn publishes a new value in between, so the first one
+    # conflicts.
+    calls = []
+    def fn(mp):
+        calls.append(mp)
+        if len(calls) == 1:
+            atom.reset(mp.assoc('b', 2))
+        return mp.assoc('c', 3)
+    assert atom.swap(fn) == bdict(a=1, b=2, c=3)
+    assert len(calls) == 2
+    assert atom.conflicts == 1
+
+
+def test_swap_threads():
+    atom = Atom(bdict(count=0))
+    def work(offset):
+        for idx in xrange(200):
+            atom.swap(
+                lambda mp: mp.assoc('count', mp['count'] + 1)
+                .assoc(offset + idx, idx)
+            )
+    threads = [
+        threading.Thread(target=work, args=(offset * 1000, ))
+        for offset in xrange(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert atom.deref()['count'] == 800
+    assert len(atom.deref()) == 801
+    assert atom.swaps == 800
+
+
+def test_commit():
+    base = bdict((key, key) for key in xrange(1000))
+    atom = Atom(base)
+    other = atom.swap(lambda mp: mp.assoc(0, 'other').without(1))
+    new = base.assoc(2, 'new').assoc(1000, 'new').without(1).without(3)
+    result = atom.commit(base, new)
+    assert result is atom.deref()
+    expected = dict((key, key) for key in xrange(1000))
+    expected.update({0: 'other', 2: 'new', 1000: 'new'})
+    del expected[1]
+    del expected[3]
+    assert result == bdict(expected)
+    assert atom.conflicts == 1
+    assert atom.commit(result, result.assoc(5, 5)) == result.assoc(5, 5)
+    
+    atom = Atom(bset([1, 2, 3]))
+    base = atom.deref()
+    atom.swap(lambda st: st.add(4))
+    assert atom.commit(base, base.add(5).without(1)) == bset([2, 3, 4, 5])
@@ -18,13 +18,16 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+import operator
 import os
+import pickle
 import pytest
 
 from copy import copy
 
 from burrahobbit import dict as bdict
-from burrahobbit.treedict import PersistentTreeMap
+from burrahobbit._tree import MISSING, SHIFT, DispatchNode, bit_count, bitpos
+from burrahobbit.treedict import PersistentTreeMap, TransientTreeMap
 
 
 class HashCollision(object):
@@ -84,6 +87,51 @@ def test_and():
             assert df[key] == other[key]
 
 
+def test_setops_sharing():
+    mp = PersistentTreeMap.from_dict(random_dict(1000))
+    empty = PersistentTreeMap()
+    assert (mp | mp).root is mp.root
+    assert (mp | empty).root is mp.root
+    assert (empty | mp).root is mp.root
+    assert (mp & mp).root is mp.root
+    assert (mp ^ mp).root is empty.root
+    assert (mp ^ empty).root is mp.root
+    
+    other = mp.assoc('a', 'foo')
+    assert (mp | other).root is other.root
+    assert (mp & other).root is mp.root
+    assert set((mp ^ other).iteritems()) == set([('a', 'foo')])
+    assert set((other ^ mp).iteritems()) == set([('a', 'foo')])
+    assert set((other | mp).iteritems()) == set(other.iteritems())
+
+
+def test_setops_collision():
+    HASH = 13465345
+    some = {
+        HashCollision("hello", HASH): 1,
+        HashCollision("answer", HASH): 2,
+        'a': 3,
+    }
+    other = {
+        HashCollision("answer", HASH): 4,
+        HashCollision("spam", HASH): 5,
+        'b': 6,
+    }
+    mp = PersistentTreeMap.from_dict(some)
+    mp2 = PersistentTreeMap.from_dict(other)
+    
+    union = dict(some)
+    union.update(other)
+    assert set((mp | mp2).iteritems()) == set(union.iteritems())
+    assert set((mp & mp2).iteritems()) == set(
+        [(HashCollision("answer", HASH), 4)]
+    )
+    assert set((mp ^ mp2).iteritems()) == set(
+        [(HashCollision("hello", HASH), 1), ('a', 3),
+         (HashCollision("spam", HASH), 5), ('b', 6)]
+    )
+
+
 def test_fromdict():
     dct = random_dict(1000)
     mp = PersistentTreeMap.from_dict(dct)
@@ -91,6 +139,30 @@ def test_fromdict():
         assert mp[key] == value
 
 
+def test_fromitr_incremental():
+    dct = random_dict(5000)
+    mp = PersistentTreeMap()
+    for key, value in dct.iteritems():
+        mp = mp.assoc(key, value)
+    bulk = PersistentTreeMap.from_dict(dct)
+    assert len(bulk) == len(mp) == len(dct)
+    assert set(bulk.iteritems()) == set(mp.iteritems())
+
+
+def test_fromitr_duplicates():
+    HASH = 13465345
+    mp = PersistentTreeMap.from_itr([
+        ('a', 1), (HashCollision("hello", HASH), 2), ('b', 3), ('a', 4),
+        (HashCollision("answer", HASH), 5), (HashCollision("hello", HASH), 6),
+    ])
+    assert len(mp) == 4
+    assert mp['a'] == 4
+    assert mp['b'] == 3
+    assert mp[HashCollision("hello", HASH)] == 6
+    assert mp[HashCollision("answer", HASH)] == 5
+    assert len(PersistentTreeMap.from_itr([('a', 1), ('a', 2)])) == 1
+
+
 def test_persistence():
     mp = PersistentTreeMap()
     mp1 = mp.assoc('a', 'hello')
@@ -138,6 +210,31 @@ def test_transient():
     assert mp5['foo'] == 'spam'
 
 
+def test_transient_ownership():
+    dct = random_dict(1000)
+    mp = PersistentTreeMap.from_dict(dct)
+    tr = mp.transient()
+    assert tr.root is mp.root
+    
+    tr = tr.assoc('a', 1)
+    root = tr.root
+    assert root is not mp.root
+    for key in dct.keys()[:100]:
+        tr = tr.without(key)
+    tr = tr.assoc('b', 2)
+    assert tr.root is root
+    assert set(mp.iteritems()) == set(dct.iteritems())
+    
+    snapshot = bdict(tr)
+    tr = tr.assoc('c', 3)
+    pytest.raises(KeyError, lambda: snapshot['c'])
+    assert len(snapshot) == len(tr) - 1
+    
+    mp2 = tr.persistent()
+    pytest.raises(RuntimeError, tr.assoc, 'd', 4)
+    assert mp2['c'] == 3
+
+
 def test_collision():
     HASH = 13465345
     mp = PersistentTreeMap()
@@ -147,6 +244,40 @@ def test_collision():
     assert mp[HashCollision("answer", HASH)] == 42
 
 
+def test_len():
+    dct = random_dict(1000)
+    mp = PersistentTreeMap.from_dict(dct)
+    assert len(mp) == len(dct)
+    assert len(mp.assoc(dct.keys()[0], 'foo')) == len(dct)
+    assert len(mp.assoc('foo', 'bar')) == len(dct) + 1
+    assert len(mp.without(dct.keys()[0])) == len(dct) - 1
+    assert len(mp ^ PersistentTreeMap.from_dict({'a': 1})) == len(dct) + 1
+    assert not PersistentTreeMap()
+    assert mp
+    
+    other = random_dict(500)
+    other.update(dct.items()[:500])
+    union = dict(dct)
+    union.update(other)
+    mp2 = PersistentTreeMap.from_dict(other)
+    assert len(mp | mp2) == len(union)
+    assert len(mp & mp2) == 500
+    assert len(mp ^ mp2) == len(union) - 500
+    
+    tr = mp.transient()
+    for key in dct.keys()[:100]:
+        tr = tr.without(key)
+    assert len(tr) == len(dct) - 100
+    
+    HASH = 13465345
+    mp = PersistentTreeMap()
+    mp = mp.assoc(HashCollision("hello", HASH), "world")
+    mp = mp.assoc(HashCollision("answer", HASH), 42)
+    mp = mp.assoc(HashCollision("answer", HASH), 43)
+    assert len(mp) == 2
+    assert len(mp.without(HashCollision("answer", HASH))) == 1
+
+
 def test_neq():
     some = random_dict(1000)
     some.update({'a': 'foo', 'b': 'bar', 'c': 'blub'})
@@ -168,6 +299,196 @@ def test_eq():
     )
 
 
+def test_eq_structure():
+    some = random_dict(1000)
+    mp = PersistentTreeMap.from_dict(some)
+    key = some.keys()[0]
+    # One is a prefix of the other when iterating.
+    assert mp != mp.without(key)
+    assert mp.without(key) != mp
+    assert mp.without(key).assoc(key, some[key]) == mp
+    
+    tr = mp.transient()
+    for key in some.keys()[:900]:
+        tr = tr.without(key)
+    assert tr.persistent() == PersistentTreeMap.from_itr(
+        some.items()[900:]
+    )
+    
+    one = HashCollision('one', 1)
+    two = HashCollision('two', 1)
+    assert (
+        PersistentTreeMap().assoc(one, 1).assoc(two, 2) ==
+        PersistentTreeMap().assoc(two, 2).assoc(one, 1)
+    )
+    assert (
+        PersistentTreeMap().assoc(one, 1).assoc(two, 2) !=
+        PersistentTreeMap().assoc(two, 1).assoc(one, 2)
+    )
+
+
+def unhashed_nodes(node):
+    """ Return the number of DispatchNodes in the subtree whose hash is
+    not cached. """
+    if not isinstance(node, DispatchNode):
+        return 0
+    total = int(node.contenthash is None)
+    for child in node.array[2 * bit_count(node.datamap):]:
+        total += unhashed_nodes(child)
+    return total
+
+
+def path_length(node, hsh):
+    """ Return the number of DispatchNodes on the path to hsh. """
+    length = 0
+    shift = 0
+    while isinstance(node, DispatchNode):
+        length += 1
+        bit = bitpos(hsh, shift)
+        if not node.nodemap & bit:
+            break
+        node = node.array[
+            len(node.array) - 1 - bit_count(node.nodemap & (bit - 1))
+        ]
+        shift += SHIFT
+    return length
+
+
+def test_hash():
+    some = random_dict(1000)
+    mp = PersistentTreeMap.from_dict(some)
+    key = some.keys()[0]
+    assert hash(mp) == hash(PersistentTreeMap.from_itr(some.items()[::-1]))
+    assert hash(mp.without(key).assoc(key, some[key])) == hash(mp)
+    assert hash(mp.assoc(key, 'foo')) != hash(mp)
+    assert hash(PersistentTreeMap()) == hash(PersistentTreeMap())
+    assert {mp: 1}[PersistentTreeMap.from_dict(some)] == 1
+    pytest.raises(TypeError, hash, mp.transient())
+    
+    # Only the nodes on the path to the changed key are hashed again.
+    assert unhashed_nodes(mp.root) == 0
+    new = mp.assoc(key, 'foo')
+    assert unhashed_nodes(new.root) == path_length(new.root, hash(key))
+    
+    tr = mp.transient().assoc(key, 'foo')
+    hash(tr.root)
+    tr = tr.assoc(key, 'bar')
+    assert hash(tr.persistent()) == hash(mp.assoc(key, 'bar'))
+
+
+def test_diff():
+    some = random_dict(1000)
+    some.update({'a': 'foo', 'b': 'bar'})
+    other = dict(some)
+    del other['a']
+    other['b'] = 'spam'
+    other['c'] = 'eggs'
+    mp = PersistentTreeMap.from_dict(some)
+    new = mp.without('a').assoc('b', 'spam').assoc('c', 'eggs')
+    
+    expected = set([
+        ('a', 'foo', MISSING), ('b', 'bar', 'spam'), ('c', MISSING, 'eggs')
+    ])
+    assert set(mp.diff(new)) == expected
+    # Independently built maps share no nodes, which gives the same result.
+    assert set(mp.diff(PersistentTreeMap.from_dict(other))) == expected
+    assert set(PersistentTreeMap().diff(mp)) == set(
+        (key, MISSING, value) for key, value in some.iteritems()
+    )
+    assert not list(mp.diff(mp))
+    assert not list(mp.diff(mp.assoc('a', 'foo')))
+    
+    one = HashCollision('one', 1)
+    two = HashCollision('two', 1)
+    mp = PersistentTreeMap().assoc(one, 1).assoc(two, 2)
+    assert list(mp.diff(mp.assoc(two, 3))) == [(two, 2, 3)]
+    assert list(mp.diff(mp.without(one))) == [(one, 1, MISSING)]
+
+
+def test_get():
+    some = random_dict(1000)
+    mp = PersistentTreeMap.from_dict(some)
+    missing = random_dict(100).keys()
+    for key, value in some.iteritems():
+        assert mp.get(key) == value
+        assert key in mp
+    for key in missing:
+        assert mp.get(key) is None
+        assert mp.get(key, 'default') == 'default'
+        assert key not in mp
+    
+    keys = some.keys()[:100] + missing
+    assert mp.get_many(keys, 'default') == [
+        some.get(key, 'default') for key in keys
+    ]
+    assert mp.contains_many(keys) == [key in some for key in keys]
+    assert PersistentTreeMap().get_many(keys) == [None] * len(keys)
+    
+    one = HashCollision('one', 1)
+    two = HashCollision('two', 1)
+    mp = PersistentTreeMap().assoc(one, 1)
+    assert mp.get_many([one, two], 0) == [1, 0]
+    assert mp.assoc(two, 2).get_many([one, two]) == [1, 2]
+
+
+def test_assoc_many():
+    some = random_dict(1000)
+    mp = PersistentTreeMap.from_dict(some)
+    delta = random_dict(100)
+    delta[some.keys()[0]] = 'foo'
+    expected = dict(some)
+    expected.update(delta)
+    
+    new = mp.assoc_many(delta.iteritems())
+    assert new == PersistentTreeMap.from_dict(expected)
+    assert mp == PersistentTreeMap.from_dict(some)
+    for result in [
+        mp.update(delta), mp.update(delta.items()),
+        mp.update(PersistentTreeMap.from_dict(delta)),
+        mp.transient().update(delta).persistent(),
+    ]:
+        assert result == new
+    
+    keys = some.keys()[:100]
+    new = mp.without_many(keys)
+    assert new == PersistentTreeMap.from_itr(some.items()[100:])
+    pytest.raises(KeyError, mp.without_many, keys + ['missing'])
+    assert mp == PersistentTreeMap.from_dict(some)
+    
+    # Subtrees none of the keys lead to are shared with the original.
+    key = some.keys()[0]
+    new = mp.assoc_many([(key, 'foo'), (key, 'bar')])
+    assert new[key] == 'bar'
+    ndata = 2 * bit_count(mp.root.datamap)
+    children = set(id(child) for child in mp.root.array[ndata:])
+    shared = [
+        child for child in new.root.array[ndata:] if id(child) in children
+    ]
+    assert len(shared) == len(children) - 1
+
+
+def test_transient_setops():
+    tr = PersistentTreeMap().transient().assoc('a', 1)
+    for result in [tr | PersistentTreeMap(), tr ^ PersistentTreeMap()]:
+        tr = tr.assoc('a', 2)
+        assert result['a'] == 1
+        assert tr['a'] == 2
+
+
+def test_pickle():
+    some = random_dict(1000)
+    mp = PersistentTreeMap.from_dict(some)
+    for protocol in xrange(pickle.HIGHEST_PROTOCOL + 1):
+        for obj in [mp, PersistentTreeMap()]:
+            loaded = pickle.loads(pickle.dumps(obj, protocol))
+            assert type(loaded) is PersistentTreeMap
+            assert loaded == obj
+        
+        loaded = pickle.loads(pickle.dumps(mp.transient(), protocol))
+        assert type(loaded) is TransientTreeMap
+        assert loaded.assoc('a', 1).persistent() == mp.assoc('a', 1)
+
+
 def test_construct():
     assert (
         bdict(foo=1, bar=2) ==
@@ -178,6 +499,182 @@ def test_construct():
     )
 
 
+def shared_nodes(node, other):
+    """ Return the number of DispatchNodes in the subtree of node that are
+    also in the subtree of other. """
+    def nodes(node):
+        found = set()
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, DispatchNode):
+                found.add(id(node))
+                stack.extend(node.array[2 * bit_count(node.datamap):])
+        return found
+    return len(nodes(node) & nodes(other))
+
+
+def test_map_values():
+    some = random_dict(1000)
+    mp = PersistentTreeMap.from_dict(some)
+    assert mp.map_values(lambda value: value).root is mp.root
+    
+    key = iter(mp).next()
+    new = mp.map_values(lambda value: value is mp[key] and 'new' or value)
+    assert new[key] == 'new'
+    assert mp[key] == some[key]
+    some[key] = 'new'
+    assert new == PersistentTreeMap.from_dict(some)
+    # Only the nodes on the path to key are new.
+    assert shared_nodes(new.root, mp.root) == (
+        shared_nodes(mp.root, mp.root) - path_length(mp.root, hash(key))
+    )
+    
+    assert mp.map_values(len) == PersistentTreeMap.from_itr(
+        (key, len(value)) for key, value in mp.iteritems()
+    )
+    assert PersistentTreeMap().map_values(len) == PersistentTreeMap()
+
+
+def test_filter():
+    some = random_dict(1000)
+    some[HashCollision(1, 7)] = 1
+    some[HashCollision(2, 7)] = 2
+    mp = PersistentTreeMap.from_dict(some)
+    assert mp.filter(lambda key, value: True).root is mp.root
+    assert mp.filter(lambda key, value: False) == PersistentTreeMap()
+    
+    for pred in [
+        lambda key, value: value != 2 and hash(key) % 3,
+        lambda key, value: value == 1,
+        lambda key, value: isinstance(key, str),
+    ]:
+        new = mp.filter(pred)
+        # The result has the shape from_dict creates, so == holds.
+        assert new == PersistentTreeMap.from_dict(dict(
+            (key, value) for key, value in some.iteritems()
+            if pred(key, value)
+        ))
+    
+    tr = mp.transient()
+    assert tr.filter(lambda key, value: value == 1) == bdict(
+        {HashCollision(1, 7): 1}
+    )
+
+
+def test_split_join():
+    some = random_dict(1000)
+    some[HashCollision(1, 7)] = 1
+    some[HashCollision(2, 7)] = 2
+    mp = PersistentTreeMap.from_dict(some)
+    for k in [1, 2, 3, 7, 32]:
+        parts = mp.split(k)
+        assert len(parts) == k
+        assert sum([len(part) for part in parts]) == len(mp)
+        # The parts share the subtrees below the root with mp.
+        children = set(map(id, mp.root.array))
+        for part in parts:
+            if len(part):
+                assert set(map(id, part.root.array)) <= children
+        if k < 32:
+            assert max([len(part) for part in parts]) < 2 * len(mp) / k
+        assert PersistentTreeMap.join(parts) == mp
+    
+    parts = mp.split(4)
+    parts[1] = parts[1].without(iter(parts[1]).next())
+    assert len(PersistentTreeMap.join(parts)) == len(mp) - 1
+    assert PersistentTreeMap.join([]) == PersistentTreeMap()
+    assert PersistentTreeMap().split(3) == [PersistentTreeMap()] * 3
+    pytest.raises(ValueError, mp.split, 0)
+    pytest.raises(ValueError, mp.split, 33)
+    
+    # Overlapping maps are joined by their union.
+    other = PersistentTreeMap.from_dict({'a': 1, 'b': 2})
+    joined = PersistentTreeMap.join([mp, other, other.assoc('a', 3)])
+    assert len(joined) == len(mp) + 2
+    assert joined['a'] == 3
+
+
+class PicklingPool(object):
+    """ Pool that maps in this process, but pickles the jobs and results
+    like multiprocessing.Pool does. """
+    def map(self, fn, jobs):
+        return [
+            pickle.loads(pickle.dumps(fn(pickle.loads(pickle.dumps(job)))))
+            for job in jobs
+        ]
+
+
+def test_parallel_map_values():
+    some = random_dict(1000)
+    mp = PersistentTreeMap.from_dict(some)
+    for k in [1, 4, 32]:
+        new = mp.parallel_map_values(len, PicklingPool(), k)
+        assert new == PersistentTreeMap.from_itr(
+            (key, len(value)) for key, value in some.iteritems()
+        )
+
+
+def test_merge_with():
+    mp = PersistentTreeMap.from_itr((str(n), n) for n in xrange(1000))
+    other = PersistentTreeMap.from_itr(
+        (str(n), 2 * n) for n in xrange(500, 1500)
+    )
+    expected = dict(mp.iteritems())
+    for key, value in other.iteritems():
+        expected[key] = expected.get(key, 0) + value
+    assert mp.merge_with(operator.add, other) == bdict(expected)
+    assert expected['700'] == 2100
+    # The resolver gets the value of self first.
+    assert mp.merge_with(lambda value, other: value, other)['700'] == 700
+    
+    # The resolver is only called for the keys contained in both.
+    calls = []
+    def resolve(value, othervalue):
+        calls.append(value)
+        return value
+    mp.merge_with(resolve, other)
+    assert sorted(calls) == range(500, 1000)
+    
+    # Sides without common keys are reused as they are.
+    assert mp.merge_with(operator.add, PersistentTreeMap()).root is mp.root
+    assert PersistentTreeMap().merge_with(operator.add, mp).root is mp.root
+    new = mp.assoc('a', 1)
+    merged = new.merge_with(operator.add, mp)
+    assert merged['a'] == 1 and merged['7'] == 14
+    
+    assert mp.merge_with(operator.add, {'1': 5, 'b': 2}) == mp.assoc(
+        '1', 6
+    ).assoc('b', 2)
+
+
+def test_merge_with_sharing():
+    mp = PersistentTreeMap.from_dict(random_dict(1000))
+    other = PersistentTreeMap.from_dict(random_dict(10))
+    merged = mp.merge_with(operator.add, other)
+    assert len(merged) == len(mp) + len(other)
+    # Only the paths to the keys of other were copied.
+    total = shared_nodes(mp.root, mp.root)
+    assert shared_nodes(merged.root, mp.root) >= total - 4 * len(other)
+    for key, value in other.iteritems():
+        assert merged[key] == value
+
+
+def test_merge_with_collision():
+    one = PersistentTreeMap.from_dict({
+        HashCollision(1, 7): 1, HashCollision(2, 7): 2, 'a': 3,
+    })
+    other = PersistentTreeMap.from_dict({
+        HashCollision(2, 7): 20, HashCollision(3, 7): 30, 7: 40,
+    })
+    expected = bdict({
+        HashCollision(1, 7): 1, HashCollision(2, 7): 22,
+        HashCollision(3, 7): 30, 7: 40, 'a': 3,
+    })
+    assert one.merge_with(operator.add, other) == expected
+    assert other.merge_with(operator.add, one) == expected
+
+
 def main():
     import os
     import time
@@ -0,0 +1,137 @@
+# Copyright (C) 2011 by Florian Mayer <florian.mayer@bitsrc.org>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import os
+import pytest
+
+from burrahobbit import frozen
+from burrahobbit.frozen import FrozenTreeMap, dump
+from burrahobbit.treedict import PersistentTreeMap, TransientTreeMap
+
+
+def random_dict(size):
+    return dict((os.urandom(20), os.urandom(25)) for _ in xrange(size))
+
+
+def frozen_map(tmpdir, mp):
+    path = str(tmpdir.join('map'))
+    fileobj = open(path, 'wb')
+    try:
+        dump(mp, fileobj)
+    finally:
+        fileobj.close()
+    return FrozenTreeMap(path)
+
+
+def test_frozen(tmpdir):
+    some = random_dict(1000)
+    some.update({1: ('spam', 2), ('eggs', 3): None})
+    fm = frozen_map(tmpdir, PersistentTreeMap.from_dict(some))
+    try:
+        assert len(fm) == len(some)
+        for key, value in some.iteritems():
+            assert fm[key] == value
+            assert fm.get(key) == value
+            assert key in fm
+        assert 'missing' not in fm
+        assert fm.get('missing', 'default') == 'default'
+        pytest.raises(KeyError, lambda: fm['missing'])
+        
+        assert sorted(fm) == sorted(some)
+        assert sorted(fm.iteritems()) == sorted(some.iteritems())
+        assert sorted(fm.itervalues()) == sorted(some.itervalues())
+        
+        tr = fm.transient()
+        assert isinstance(tr, TransientTreeMap)
+        assert tr.assoc('a', 1).persistent() == PersistentTreeMap.from_dict(
+            some
+        ).assoc('a', 1)
+    finally:
+        fm.close()
+
+
+def test_frozen_empty(tmpdir):
+    fm = frozen_map(tmpdir, PersistentTreeMap())
+    try:
+        assert len(fm) == 0
+        assert 'a' not in fm
+        assert list(fm) == []
+    finally:
+        fm.close()
+
+
+def test_frozen_collision(tmpdir, monkeypatch):
+    # With few different hashes, there are long chains of nodes and nodes
+    # with colliding entries.
+    monkeypatch.setattr(frozen, '_hash', lambda data: len(data) % 3 << 30)
+    some = dict((str(idx), idx) for idx in xrange(200))
+    fm = frozen_map(tmpdir, PersistentTreeMap.from_dict(some))
+    try:
+        for key, value in some.iteritems():
+            assert fm[key] == value
+        assert 'missing' not in fm
+        assert sorted(fm.iteritems()) == sorted(some.iteritems())
+    finally:
+        fm.close()
+
+
+def test_frozen_equal_keys(tmpdir):
+    # Equal keys are found even if they pickle to different bytes.
+    one, other = 'spam' * 10, ''.join(['spam'] * 10)
+    assert one == other and one is not other
+    mp = PersistentTreeMap.from_dict({
+        (one, one): 1, 'k': 2, 5: 3, 6L: 4, (u'a', 7.0): 5, 1.5: 6,
+        float('inf'): 7,
+    })
+    fm = frozen_map(tmpdir, mp)
+    try:
+        for key, value in [
+            ((one, other), 1), ((other, other), 1), (u'k', 2), (5L, 3),
+            (5.0, 3), (6, 4), (True, None), (('a', 7), 5), (1.5, 6),
+            (u'k\xe9', None), (float('inf'), 7), (-float('inf'), None),
+        ]:
+            assert mp.get(key) == value
+            assert fm.get(key) == value
+    finally:
+        fm.close()
+    
+    # The keys are decoded with the types they were stored with.
+    fm = frozen_map(tmpdir, PersistentTreeMap.from_dict({u'k': 1, 5L: 2}))
+    try:
+        assert sorted(map(type, fm)) == sorted([unicode, long])
+        assert fm['k'] == 1 and fm[5] == 2
+    finally:
+        fm.close()
+
+
+def test_frozen_context_manager(tmpdir):
+    # Written without the with statement, which Python 2.4 lacks.
+    fm = frozen_map(tmpdir, PersistentTreeMap.from_dict({'a': 1}))
+    assert fm.__enter__() is fm
+    assert fm['a'] == 1
+    fm.__exit__(None, None, None)
+    assert fm.file.closed
+    pytest.raises(ValueError, lambda: fm['a'])
+
+
+def test_frozen_invalid(tmpdir):
+    path = tmpdir.join('invalid')
+    path.write('no frozen map, but long enough')
+    pytest.raises(ValueError, FrozenTreeMap, str(path))
@@ -0,0 +1,79 @@
+# Copyright (C) 2011 by Florian Mayer <florian.mayer@bitsrc.org>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import os
+
+from burrahobbit.introspect import stats
+from burrahobbit.treedict import PersistentTreeMap
+from burrahobbit.treeset import PersistentTreeSet
+
+
+class HashCollision(object):
+    def __init__(self, item, hsh):
+        self.item = item
+        self.hsh = hsh
+    
+    def __hash__(self):
+        return self.hsh
+    
+    def __eq__(self, other):
+        return isinstance(other, HashCollision) and self.item == other.item
+
+
+def test_stats():
+    mp = PersistentTreeMap.from_dict(
+        dict((os.urandom(20), None) for _ in xrange(1000))
+    )
+    result = mp.stats()
+    assert sum(result['depth'].itervalues()) == 1000
+    assert result['nodes']['DispatchNode'] == sum(result['fill'].itervalues())
+    assert result['collisions'] == {}
+    assert 0 < result['mean_fill'] <= 1
+    assert result['bytes'] == result['unique_bytes'][0] > 0
+    assert result['shared_bytes'] == 0
+    
+    st = PersistentTreeSet().add(HashCollision('a', 1)).add(
+        HashCollision('b', 1)
+    ).add(HashCollision('c', 1)).add(HashCollision('d', 2))
+    result = st.stats()
+    assert result['nodes'] == {'DispatchNode': 1, 'HashCollisionNode': 1}
+    assert result['collisions'] == {3: 1}
+    assert result['depth'] == {0: 1, 1: 3}
+    assert result['fill'] == {2: 1}
+
+
+def test_stats_shared():
+    mp = PersistentTreeMap.from_dict(
+        dict((os.urandom(20), None) for _ in xrange(1000))
+    )
+    new = mp.assoc('a', 1)
+    result = stats(mp, new)
+    alone = mp.stats()['bytes']
+    # Only the nodes on the path to 'a' were copied.
+    assert 0 < result['unique_bytes'][0] < alone / 10
+    assert 0 < result['unique_bytes'][1] < alone / 10
+    assert result['shared_bytes'] + result['unique_bytes'][0] == alone
+    assert result['bytes'] == (
+        result['shared_bytes'] + sum(result['unique_bytes'])
+    )
+    
+    result = stats(mp, PersistentTreeMap.from_dict(dict(mp.iteritems())))
+    assert result['shared_bytes'] == 0
+    assert stats(PersistentTreeMap())['bytes'] == 0
@@ -19,6 +19,7 @@
 # THE SOFTWARE.
 
 import os
+import pickle
 import pytest
 
 from burrahobbit import set as bset
@@ -74,6 +75,20 @@ def test_and():
     assert set(df) == some & other
 
 
+def test_setops_sharing():
+    st = PersistentTreeSet.from_set(random_set(1000))
+    empty = PersistentTreeSet()
+    assert (st | st).root is st.root
+    assert (st | empty).root is st.root
+    assert (st & st).root is st.root
+    assert (st ^ empty).root is st.root
+    
+    other = st.add('a')
+    assert (st | other).root is other.root
+    assert (st & other).root is st.root
+    assert list(st ^ other) == ['a']
+
+
 def test_fromset():
     st = random_set(1000)
     mp = PersistentTreeSet.from_set(st)
@@ -119,6 +134,30 @@ def test_transient():
     assert mp5 is not mp4
 
 
+def test_transient_ownership():
+    some = random_set(1000)
+    st = PersistentTreeSet.from_set(some)
+    tr = st.transient()
+    assert tr.root is st.root
+    
+    tr = tr.add('a')
+    root = tr.root
+    assert root is not st.root
+    for key in list(some)[:100]:
+        tr = tr.without(key)
+    tr = tr.add('b')
+    assert tr.root is root
+    assert set(st) == some
+    
+    snapshot = bset(tr)
+    tr = tr.add('c')
+    assert 'c' not in snapshot
+    assert 'c' in tr
+    
+    tr.persistent()
+    pytest.raises(RuntimeError, tr.add, 'd')
+
+
 def test_collision():
     HASH = 13465345
     mp = PersistentTreeSet()
@@ -128,10 +167,87 @@ def test_collision():
     assert HashCollision("answer", HASH) in mp
 
 
+def test_len():
+    some = random_set(1000)
+    st = PersistentTreeSet.from_set(some)
+    assert len(st) == 1000
+    assert len(st.add(iter(some).next())) == 1000
+    assert len(st.add('a')) == 1001
+    assert len(st.without(iter(some).next())) == 999
+    assert not PersistentTreeSet()
+    
+    tr = st.transient()
+    for key in list(some)[:100]:
+        tr = tr.without(key)
+    assert len(tr) == 900
+    assert len(tr.persistent()) == 900
+
+
 def test_eq():
     assert bset(['foo', 'bar']) == bset(['bar', 'foo'])
 
 
+def test_hash():
+    some = random_set(1000)
+    st = PersistentTreeSet.from_set(some)
+    assert hash(st) == hash(PersistentTreeSet.from_set(list(some)[::-1]))
+    assert hash(st.add('a').without('a')) == hash(st)
+    assert hash(st.add('a')) != hash(st)
+    assert set([st]) == set([PersistentTreeSet.from_set(some)])
+    pytest.raises(TypeError, hash, st.transient())
+
+
+def test_diff():
+    some = random_set(1000)
+    st = PersistentTreeSet.from_set(some)
+    key = iter(some).next()
+    new = st.without(key).add('a')
+    assert set(st.diff(new)) == set([(key, False), ('a', True)])
+    assert set(new.diff(st)) == set([(key, True), ('a', False)])
+    assert not list(st.diff(PersistentTreeSet.from_set(some)))
+
+
+def test_contains_many():
+    some = random_set(1000)
+    st = PersistentTreeSet.from_set(some)
+    keys = list(some)[:100] + list(random_set(100))
+    assert st.contains_many(keys) == [key in some for key in keys]
+    assert st.contains_many([]) == []
+
+
+def test_add_many():
+    some = random_set(1000)
+    st = PersistentTreeSet.from_set(some)
+    delta = random_set(100)
+    new = st.add_many(delta)
+    assert new == PersistentTreeSet.from_set(some | delta)
+    assert st == PersistentTreeSet.from_set(some)
+    assert st.update(delta) == st.update(PersistentTreeSet.from_set(delta))
+    assert st.update(delta) == new
+    assert st.transient().update(delta).persistent() == new
+    assert new.without_many(delta) == st
+    pytest.raises(KeyError, st.without_many, delta)
+
+
+def test_pickle():
+    st = PersistentTreeSet.from_set(random_set(1000))
+    for protocol in xrange(pickle.HIGHEST_PROTOCOL + 1):
+        for obj in [st, PersistentTreeSet(), st.transient()]:
+            loaded = pickle.loads(pickle.dumps(obj, protocol))
+            assert type(loaded) is type(obj)
+            assert loaded.root == obj.root
+
+
+def test_filter():
+    some = random_set(1000)
+    st = PersistentTreeSet.from_set(some)
+    assert st.filter(lambda key: True).root is st.root
+    new = st.filter(lambda key: ord(key[0]) < 100)
+    assert new == PersistentTreeSet.from_set(
+        set(key for key in some if ord(key[0]) < 100)
+    )
+
+
 def test_construct():
     assert (
         bset(set(['foo', 'bar'])) ==
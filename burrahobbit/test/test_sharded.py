@@ -0,0 +1,92 @@
+# Copyright (C) 2011 by Florian Mayer <florian.mayer@bitsrc.org>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import os
+import threading
+
+import pytest
+
+from burrahobbit._tree import BMAP
+from burrahobbit.sharded import ShardedTreeMap
+from burrahobbit.treedict import PersistentTreeMap
+
+
+class HashCollision(object):
+    def __init__(self, item, hsh):
+        self.item = item
+        self.hsh = hsh
+    
+    def __hash__(self):
+        return self.hsh
+    
+    def __eq__(self, other):
+        return isinstance(other, HashCollision) and self.item == other.item
+
+
+def test_snapshot():
+    dct = dict((os.urandom(20), os.urandom(5)) for _ in xrange(1000))
+    dct[HashCollision(1, 3)] = 1
+    dct[HashCollision(2, 3)] = 2
+    mp = PersistentTreeMap.from_dict(dct)
+    sharded = ShardedTreeMap(mp)
+    assert len(sharded) == 1000 + 2
+    for idx, shard in enumerate(sharded.shards):
+        for key in shard.deref():
+            assert hash(key) & BMAP == idx
+    assert sharded.snapshot() == mp
+    
+    for key in [key for key in dct if isinstance(key, str)][:100]:
+        sharded.without(key)
+        del dct[key]
+    sharded.assoc('spam', 'eggs')
+    dct['spam'] = 'eggs'
+    pytest.raises(KeyError, sharded.without, 'missing')
+    
+    snapshot = sharded.snapshot()
+    assert snapshot == PersistentTreeMap.from_dict(dct)
+    assert len(snapshot) == len(sharded) == len(dct)
+    assert sharded['spam'] == 'eggs'
+    assert sharded.get('missing') is None
+    assert HashCollision(2, 3) in sharded
+    assert set(sharded) == set(dct)
+    
+    assert ShardedTreeMap().snapshot() == PersistentTreeMap()
+
+
+def test_threads():
+    sharded = ShardedTreeMap()
+    def work(offset):
+        for idx in xrange(500):
+            sharded.assoc(offset + idx, idx)
+            sharded.swap(
+                'count', lambda mp: mp.assoc('count', mp.get('count', 0) + 1)
+            )
+    threads = [
+        threading.Thread(target=work, args=(offset * 1000, ))
+        for offset in xrange(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    snapshot = sharded.snapshot()
+    assert len(snapshot) == 2001
+    assert snapshot['count'] == 2000
+    assert sharded.swaps == 4000
@@ -0,0 +1,87 @@
+# Copyright (C) 2011 by Florian Mayer <florian.mayer@bitsrc.org>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import os
+import random
+import pytest
+
+from StringIO import StringIO
+
+from burrahobbit.snapshot import (
+    ADDED, CHANGED, REMOVED, Delta, compact, dump, dump_delta, load
+)
+from burrahobbit.treedict import PersistentTreeMap
+
+
+def random_dict(size):
+    return dict((os.urandom(20), os.urandom(25)) for _ in xrange(size))
+
+
+def dumped(fn, *args):
+    fileobj = StringIO()
+    fn(*(args + (fileobj, )))
+    fileobj.seek(0)
+    return fileobj
+
+
+def test_delta():
+    rnd = random.Random(1)
+    base = PersistentTreeMap.from_dict(random_dict(1000))
+    versions = [base]
+    for _ in xrange(10):
+        mp = versions[-1]
+        keys = list(mp)
+        mp = mp.without_many(rnd.sample(keys, 10))
+        mp = mp.assoc_many(
+            [(key, 'changed') for key in rnd.sample(keys, 10) if key in mp]
+        )
+        mp = mp.update(random_dict(10))
+        versions.append(mp)
+    
+    delta = Delta.between(base, versions[1])
+    assert len(delta) == 30
+    
+    deltas = [
+        dumped(dump_delta, new, old)
+        for old, new in zip(versions, versions[1:])
+    ]
+    assert load(dumped(dump, base), deltas) == versions[-1]
+    
+    for delta in deltas:
+        delta.seek(0)
+    compacted = dumped(compact, deltas)
+    assert load(dumped(dump, base), [compacted]) == versions[-1]
+    assert load(dumped(dump, base)) == base
+
+
+def test_merge():
+    first = Delta({
+        'a': (ADDED, 1), 'b': (ADDED, 2), 'c': (CHANGED, 3),
+        'd': (CHANGED, 4), 'e': (REMOVED, None),
+    })
+    second = Delta({
+        'a': (CHANGED, 5), 'b': (REMOVED, None), 'c': (CHANGED, 6),
+        'd': (REMOVED, None), 'e': (ADDED, 7), 'f': (ADDED, 8),
+    })
+    assert first.merge(second).changes == {
+        'a': (ADDED, 5), 'c': (CHANGED, 6), 'd': (REMOVED, None),
+        'e': (CHANGED, 7), 'f': (ADDED, 8),
+    }
+    pytest.raises(ValueError, second.merge, first)
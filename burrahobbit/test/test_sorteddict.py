@@ -0,0 +1,242 @@
+# Copyright (C) 2011 by Florian Mayer <florian.mayer@bitsrc.org>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import pickle
+import random
+
+from bisect import bisect_left, bisect_right
+
+import pytest
+
+from burrahobbit.sorteddict import (
+    MAXKEYS, MINKEYS, Branch, PersistentSortedMap, TransientSortedMap
+)
+
+
+def check_shape(node, lo=None, hi=None, root=True):
+    """ Assert that the subtree is balanced, its nodes are neither too full
+    nor too empty and its keys are sorted and between lo and hi. Return
+    its depth. """
+    assert len(node) <= MAXKEYS
+    if not root:
+        assert len(node) >= MINKEYS
+    if not isinstance(node, Branch):
+        assert node.keys == sorted(node.keys)
+        for key in node.keys:
+            assert (lo is None or lo <= key) and (hi is None or key < hi)
+        return 1
+    assert len(node.keys) == len(node.children) - 1
+    bounds = [lo] + node.keys + [hi]
+    depths = set(
+        check_shape(child, bounds[idx], bounds[idx + 1], False)
+        for idx, child in enumerate(node.children)
+    )
+    assert len(depths) == 1
+    return depths.pop() + 1
+
+
+def test_random_operations():
+    rnd = random.Random(6)
+    mp = PersistentSortedMap()
+    tr = PersistentSortedMap().transient()
+    dct = {}
+    for _ in xrange(6000):
+        key = rnd.randrange(3000)
+        if rnd.random() < 0.6:
+            value = rnd.random()
+            mp = mp.assoc(key, value)
+            tr = tr.assoc(key, value)
+            dct[key] = value
+        elif key in dct:
+            mp = mp.without(key)
+            tr = tr.without(key)
+            del dct[key]
+        else:
+            pytest.raises(KeyError, mp.without, key)
+            pytest.raises(KeyError, tr.without, key)
+        assert len(mp) == len(tr) == len(dct)
+        assert mp.get(key) == tr.get(key) == dct.get(key)
+    check_shape(mp.root)
+    check_shape(tr.root)
+    assert mp.items() == tr.items() == sorted(dct.items())
+    assert mp == tr == PersistentSortedMap.from_dict(dct)
+    for key, value in dct.iteritems():
+        assert mp[key] == value
+    
+    # Removing all keys leaves a valid tree at every step.
+    for key in dct:
+        mp = mp.without(key)
+    assert len(mp) == 0
+    assert list(mp) == []
+
+
+def test_from_itr():
+    for size in [0, 1, MAXKEYS, MAXKEYS + 1, MAXKEYS ** 2 + 1, 10000]:
+        mp = PersistentSortedMap.from_itr(
+            (key * 7 % size, key) for key in xrange(size)
+        )
+        check_shape(mp.root)
+        assert list(mp) == range(size)
+    mp = PersistentSortedMap.from_itr([(1, 'a'), (0, 'b'), (1, 'c')])
+    assert mp.items() == [(0, 'b'), (1, 'c')]
+
+
+def test_persistence():
+    mp = PersistentSortedMap.from_itr((key, key) for key in xrange(1000))
+    new = mp.assoc(1000, 1000).without(0).assoc(500, None)
+    assert mp.items() == [(key, key) for key in xrange(1000)]
+    assert len(new) == 1000
+    assert new[500] is None
+    assert 0 not in new
+
+
+def test_range():
+    keys = range(0, 3000, 3)
+    mp = PersistentSortedMap.from_itr((key, -key) for key in keys)
+    for lo, hi in [
+        (None, None), (10, 20), (9, 21), (-5, 5), (2990, 4000), (100, 100),
+        (200, 100), (None, 500), (1500, None), (4000, None),
+    ]:
+        start = 0
+        end = len(keys)
+        if lo is not None:
+            start = bisect_left(keys, lo)
+        if hi is not None:
+            end = bisect_left(keys, hi)
+        expected = [(key, -key) for key in keys[start:end]]
+        assert list(mp.range(lo, hi)) == expected
+        expected.reverse()
+        assert list(mp.range(lo, hi, reverse=True)) == expected
+    assert list(reversed(mp)) == keys[::-1]
+    assert list(mp.itervalues()) == [-key for key in keys]
+
+
+def test_floor_ceiling():
+    keys = range(0, 3000, 3)
+    mp = PersistentSortedMap.from_itr((key, -key) for key in keys)
+    for key in xrange(-1, 3001):
+        idx = bisect_right(keys, key)
+        if idx:
+            assert mp.floor(key) == (keys[idx - 1], -keys[idx - 1])
+        else:
+            pytest.raises(KeyError, mp.floor, key)
+        idx = bisect_left(keys, key)
+        if idx < len(keys):
+            assert mp.ceiling(key) == (keys[idx], -keys[idx])
+        else:
+            pytest.raises(KeyError, mp.ceiling, key)
+
+
+def test_setops():
+    rnd = random.Random(7)
+    for size, othersize in [(0, 10), (500, 500), (2000, 10), (10, 2000)]:
+        one = dict((rnd.randrange(3000), rnd.random()) for _ in xrange(size))
+        other = dict(
+            (rnd.randrange(3000), rnd.random()) for _ in xrange(othersize)
+        )
+        mp = PersistentSortedMap.from_dict(one)
+        mp2 = PersistentSortedMap.from_dict(other)
+        
+        union = dict(one)
+        union.update(other)
+        intersection = dict(
+            (key, value) for key, value in other.iteritems() if key in one
+        )
+        symdiff = dict(
+            (key, value) for key, value in union.iteritems()
+            if (key in one) != (key in other)
+        )
+        for result, expected in [
+            (mp | mp2, union),
+            (mp & mp2, intersection),
+            (mp ^ mp2, symdiff),
+            (mp.transient() | mp2.transient(), union),
+        ]:
+            check_shape(result.root)
+            assert result.items() == sorted(expected.items())
+    
+    tr = mp.transient()
+    assert isinstance(mp & tr, TransientSortedMap)
+
+
+def test_transient():
+    mp = PersistentSortedMap.from_itr((key, key) for key in xrange(1000))
+    tr = mp.transient()
+    tr = tr.without_many(xrange(0, 1000, 2)).assoc_many(
+        (key, None) for key in xrange(1000, 1100)
+    )
+    new = tr.persistent()
+    pytest.raises(RuntimeError, tr.assoc, 0, 0)
+    assert list(mp) == range(1000)
+    assert list(new) == range(1, 1000, 2) + range(1000, 1100)
+    check_shape(new.root)
+
+
+def test_eq_hash():
+    one = PersistentSortedMap.from_itr([(1, 'a'), (2, 'b')])
+    other = PersistentSortedMap().assoc(2, 'b').assoc(1, 'a')
+    assert one == other
+    assert hash(one) == hash(other)
+    assert one != other.assoc(2, 'c')
+    assert one != other.without(2)
+
+
+def unhashed_nodes(node):
+    """ Return the number of nodes in the subtree whose hash is not
+    cached. """
+    total = node.contenthash is None and 1 or 0
+    if isinstance(node, Branch):
+        for child in node.children:
+            total += unhashed_nodes(child)
+    return total
+
+
+def test_hash_cached():
+    items = [(key, str(key)) for key in xrange(5000)]
+    mp = PersistentSortedMap.from_itr(items)
+    expected = hash(PersistentSortedMap().assoc_many(items))
+    assert hash(mp) == expected
+    assert unhashed_nodes(mp.root) == 0
+    
+    # Only the nodes on the path to the changed key are hashed again.
+    new = mp.assoc(2500, 'foo')
+    assert unhashed_nodes(new.root) == check_shape(new.root)
+    assert hash(new) != hash(mp)
+    assert hash(new.assoc(2500, '2500')) == hash(mp)
+    
+    # Changes in place through a transient drop the cached hashes.
+    tr = new.transient()
+    for key in xrange(0, 5000, 7):
+        tr.without(key)
+    hash(tr.root)
+    tr.assoc(2500, '2500')
+    assert hash(tr.persistent()) == hash(PersistentSortedMap.from_itr(
+        item for item in items if item[0] % 7
+    ))
+
+
+def test_pickle():
+    mp = PersistentSortedMap.from_itr((key, -key) for key in xrange(1000))
+    for protocol in xrange(pickle.HIGHEST_PROTOCOL + 1):
+        for obj in [mp, PersistentSortedMap(), mp.transient()]:
+            loaded = pickle.loads(pickle.dumps(obj, protocol))
+            assert type(loaded) is type(obj)
+            assert loaded == obj
+            check_shape(loaded.root)
@@ -18,7 +18,14 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
-from burrahobbit._tree import BitMapDispatch, ListDispatch
+import random
+import sys
+
+import pytest
+
+from burrahobbit._tree import BitMapDispatch, ListDispatch, MISSING
+from burrahobbit._tree import DispatchNode, HashCollisionNode, bit_count
+from burrahobbit.treedict import PersistentTreeMap
 
 def test_dispatch():
     nd = BitMapDispatch()
@@ -27,3 +34,220 @@ def test_dispatch():
     assert isinstance(nd, BitMapDispatch)
     nd = nd.replace(17, None)
     assert isinstance(nd, ListDispatch)
+
+
+class Key(object):
+    """ Key whose hash is chosen so that collisions and long common hash
+    prefixes are frequent. """
+    def __init__(self, item, hsh):
+        self.item = item
+        self.hsh = hsh
+    
+    def __hash__(self):
+        return self.hsh
+    
+    def __eq__(self, other):
+        return isinstance(other, Key) and self.item == other.item
+    
+    def __ne__(self, other):
+        return not self == other
+    
+    def __repr__(self):
+        return 'Key(%r, %r)' % (self.item, self.hsh)
+
+
+def random_key(rnd):
+    # Hashes that only differ in few, high bits produce deep trees. The
+    # hash is derived from the item so that equal keys have equal hashes.
+    item = rnd.randint(0, 200)
+    hsh = [0, 1, 1 << 30, -1 << 40, 7 << 55][item % 5] + item // 5 % 4
+    return Key(item, hsh)
+
+
+def test_random_operations():
+    rnd = random.Random(4)
+    for _ in xrange(20):
+        mp = PersistentTreeMap()
+        tr = PersistentTreeMap().transient()
+        dct = {}
+        for _ in xrange(300):
+            key = random_key(rnd)
+            if rnd.random() < 0.6:
+                value = rnd.random()
+                mp = mp.assoc(key, value)
+                tr = tr.assoc(key, value)
+                dct[key] = value
+            elif key in dct:
+                mp = mp.without(key)
+                tr = tr.without(key)
+                del dct[key]
+            else:
+                pytest.raises(KeyError, mp.without, key)
+                pytest.raises(KeyError, tr.without, key)
+            assert len(mp) == len(tr) == len(dct)
+            assert mp.get(key, MISSING) == tr.get(key, MISSING) == dct.get(
+                key, MISSING
+            )
+            # The cached hashes of nodes changed in place are updated.
+            assert hash(tr.root) == hash(mp.root)
+        assert set(mp.iteritems()) == set(dct.iteritems())
+        assert set(tr.iteritems()) == set(dct.iteritems())
+        for key, value in dct.iteritems():
+            assert mp[key] == value
+        # Equality compares the trees node by node, so this checks that
+        # they have the same shape regardless of how they were created.
+        assert mp == tr == PersistentTreeMap.from_dict(dct)
+
+
+def depth(node):
+    """ Return the number of levels of the subtree. """
+    if not isinstance(node, DispatchNode):
+        return 1
+    return 1 + max([0] + [
+        depth(child) for child in node.array[2 * bit_count(node.datamap):]
+    ])
+
+
+def test_shape_after_without():
+    # The hashes of one and other only differ on the seventh level.
+    one = Key('one', 0)
+    two = Key('two', 0)
+    other = Key('other', 1 << 30)
+    mp = PersistentTreeMap().assoc(one, 1).assoc(other, 2)
+    assert depth(mp.root) == 7
+    for new in [mp.without(other), mp.transient().without(other)]:
+        assert depth(new.root) == 1
+        assert new.root.array == [one, 1]
+    
+    # The collision node of one and two moves up to the root.
+    mp = mp.assoc(two, 3)
+    assert depth(mp.root) == 8
+    for new in [mp.without(other), mp.transient().without(other)]:
+        assert depth(new.root) == 2
+        assert isinstance(new.root.array[0], HashCollisionNode)
+    
+    # After deleting most keys, the remaining two, whose hashes differ on
+    # the first level, are stored inline in the root.
+    keys = [Key(item, item << 25 | item & 1) for item in xrange(1000)]
+    mp = PersistentTreeMap.from_itr((key, None) for key in keys)
+    assert depth(mp.root) == 7
+    tr = mp.transient()
+    for key in keys[2:]:
+        mp = mp.without(key)
+        tr = tr.without(key)
+    assert depth(mp.root) == depth(tr.root) == 1
+
+
+def colliding_ints(size):
+    """ Return list of size distinct ints that all have the same hash. """
+    try:
+        modulus = sys.hash_info.modulus
+    except AttributeError:
+        modulus = 2 * sys.maxint + 1
+    return [5 + item * modulus for item in xrange(size)]
+
+
+def test_collision_ordered():
+    keys = colliding_ints(40)
+    shuffled = keys[:]
+    random.Random(3).shuffle(shuffled)
+    mp = PersistentTreeMap()
+    for key in shuffled:
+        mp = mp.assoc(key, -key)
+    node = mp.root.array[0]
+    assert isinstance(node, HashCollisionNode)
+    assert node.family is int
+    assert node.array[::2] == keys
+    assert mp == PersistentTreeMap.from_itr((key, -key) for key in shuffled)
+    for key in keys:
+        assert mp[key] == -key
+    assert 6 not in mp
+    
+    # Keys of other types are compared with all entries, so 5.0 replaces
+    # the association with 5.
+    new = mp.assoc(5.0, 'float')
+    assert len(new) == len(mp)
+    assert new[5] == 'float'
+    
+    # A key that is not orderable with the others turns off the ordering.
+    odd = Key('odd', hash(keys[0]))
+    new = mp.assoc(odd, 'odd')
+    assert new.root.array[0].family is None
+    assert new[odd] == 'odd'
+    for key in keys:
+        assert new[key] == -key
+    assert new.without(odd) == mp
+    
+    for key in keys[::2]:
+        mp = mp.without(key)
+    assert mp.root.array[0].array[::2] == keys[1::2]
+    assert list(mp.root.array[0]) == sorted(mp)
+    assert set(mp) == set(keys[1::2])
+
+
+def test_random_setops():
+    rnd = random.Random(2)
+    for _ in xrange(50):
+        one = dict((random_key(rnd), rnd.random()) for _ in xrange(60))
+        other = dict((random_key(rnd), rnd.random()) for _ in xrange(60))
+        mp = PersistentTreeMap.from_dict(one)
+        mp2 = PersistentTreeMap.from_dict(other)
+        
+        union = dict(one)
+        union.update(other)
+        intersection = dict(
+            (key, value) for key, value in other.iteritems() if key in one
+        )
+        symdiff = dict(
+            (key, value) for key, value in union.iteritems()
+            if (key in one) != (key in other)
+        )
+        for result, expected in [
+            (mp | mp2, union),
+            (mp & mp2, intersection),
+            (mp ^ mp2, symdiff),
+        ]:
+            assert len(result) == len(expected)
+            assert set(result.iteritems()) == set(expected.iteritems())
+            assert result == PersistentTreeMap.from_dict(expected)
+        
+        diff = set()
+        for key in union:
+            value = one.get(key, MISSING)
+            othervalue = other.get(key, MISSING)
+            if value != othervalue:
+                diff.add((key, value, othervalue))
+        assert set(mp.diff(mp2)) == diff
+
+
+def test_random_filter():
+    rnd = random.Random(8)
+    for _ in xrange(50):
+        dct = dict((random_key(rnd), rnd.random()) for _ in xrange(80))
+        mp = PersistentTreeMap.from_dict(dct)
+        threshold = rnd.random()
+        pred = lambda key, value: value < threshold
+        assert mp.filter(pred) == PersistentTreeMap.from_dict(dict(
+            (key, value) for key, value in dct.iteritems() if pred(key, value)
+        ))
+        new = mp.map_values(lambda value: value < threshold and -1 or value)
+        assert new == PersistentTreeMap.from_dict(dict(
+            (key, value < threshold and -1 or value)
+            for key, value in dct.iteritems()
+        ))
+
+
+def test_random_merge_with():
+    rnd = random.Random(9)
+    for _ in xrange(50):
+        keys = [random_key(rnd) for _ in xrange(120)]
+        one = dict((key, rnd.randrange(100)) for key in keys[:80])
+        other = dict((key, rnd.randrange(100)) for key in keys[40:])
+        expected = dict(one)
+        for key, value in other.iteritems():
+            expected[key] = expected.get(key, 0) * 1000 + value
+        merged = PersistentTreeMap.from_dict(one).merge_with(
+            lambda value, othervalue: value * 1000 + othervalue,
+            PersistentTreeMap.from_dict(other)
+        )
+        assert merged == PersistentTreeMap.from_dict(expected)
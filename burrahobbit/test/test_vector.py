@@ -0,0 +1,155 @@
+# Copyright (C) 2011 by Florian Mayer <florian.mayer@bitsrc.org>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import pickle
+import random
+
+import pytest
+
+from burrahobbit import vector
+from burrahobbit._tree import BRANCH
+from burrahobbit.treevector import PersistentVector, TransientVector
+
+# Sizes around those at which the tree gets another leaf or level.
+SIZES = [
+    0, 1, BRANCH - 1, BRANCH, BRANCH + 1, 2 * BRANCH + 1, BRANCH ** 2,
+    BRANCH ** 2 + BRANCH, BRANCH ** 2 + BRANCH + 1, 3 * BRANCH ** 2 + 7,
+]
+
+
+def test_append():
+    vec = PersistentVector()
+    versions = [vec]
+    for item in xrange(BRANCH ** 2 + BRANCH + 2):
+        vec = vec.append(item)
+        versions.append(vec)
+    for size, vec in enumerate(versions):
+        assert len(vec) == size
+        assert list(vec) == range(size)
+        for idx in xrange(size):
+            assert vec[idx] == idx
+
+
+def test_getitem():
+    vec = vector(xrange(100))
+    assert vec[-1] == 99
+    assert vec[-100] == 0
+    pytest.raises(IndexError, vec.__getitem__, 100)
+    pytest.raises(IndexError, vec.__getitem__, -101)
+    pytest.raises(IndexError, vector().__getitem__, 0)
+
+
+def test_assoc():
+    for size in SIZES[1:]:
+        original = vec = vector(xrange(size))
+        lst = range(size)
+        for idx in set([0, size // 2, size - 1, -1]):
+            vec = vec.assoc(idx, 'new')
+            lst[idx] = 'new'
+            assert list(vec) == lst
+        assert list(original) == range(size)
+        assert list(vec.assoc(size, 'end')) == lst + ['end']
+        pytest.raises(IndexError, vec.assoc, size + 1, None)
+
+
+def test_pop():
+    for size in SIZES[1:]:
+        vec = vector(xrange(size))
+        tr = vec.transient()
+        for length in xrange(size - 1, max(size - 2 * BRANCH, 0) - 1, -1):
+            new = vec.pop()
+            tr = tr.pop()
+            assert list(new) == list(tr) == range(length)
+            assert list(vec) == range(length + 1)
+            vec = new
+        assert new == vector(xrange(length))
+    
+    vec = vector(xrange(BRANCH ** 2 + BRANCH + 1))
+    while vec:
+        vec = vec.pop()
+    assert vec.shift == vector().shift
+    pytest.raises(IndexError, vec.pop)
+
+
+def test_slice():
+    lst = range(3 * BRANCH ** 2 + 7)
+    vec = vector(lst)
+    for slc in [
+        slice(None), slice(5, 40), slice(-40, None), slice(BRANCH, 3 * BRANCH),
+        slice(10, 5), slice(None, None, -1), slice(3, 2000, 7),
+    ]:
+        assert list(vec[slc]) == lst[slc]
+        assert isinstance(vec[slc], PersistentVector)
+
+
+def test_transient():
+    vec = vector(xrange(1000))
+    tr = vec.transient()
+    for idx in xrange(0, 1000, 3):
+        tr = tr.assoc(idx, -idx)
+    tr = tr.extend(xrange(1000, 1100))
+    new = tr.persistent()
+    pytest.raises(RuntimeError, tr.append, None)
+    assert list(vec) == range(1000)
+    lst = range(1100)
+    lst[:1000:3] = [-idx for idx in xrange(0, 1000, 3)]
+    assert list(new) == lst
+
+
+def test_random_operations():
+    rnd = random.Random(5)
+    vec = vector()
+    tr = vector().transient()
+    lst = []
+    for _ in xrange(5000):
+        choice = rnd.random()
+        if choice < 0.6 or not lst:
+            value = rnd.random()
+            vec = vec.append(value)
+            tr = tr.append(value)
+            lst.append(value)
+        elif choice < 0.8:
+            idx = rnd.randrange(len(lst))
+            vec = vec.assoc(idx, -1)
+            tr = tr.assoc(idx, -1)
+            lst[idx] = -1
+        else:
+            vec = vec.pop()
+            tr = tr.pop()
+            lst.pop()
+        assert len(vec) == len(tr) == len(lst)
+    assert list(vec) == list(tr) == lst
+
+
+def test_eq():
+    assert vector([1, 2]) == vector([1, 2])
+    assert vector([1, 2]) != vector([1, 3])
+    assert vector([1, 2]) != vector([1])
+    assert hash(vector([1, 2])) == hash(vector([1]).append(2))
+    assert vector([1, 2]) != [1, 2]
+
+
+def test_pickle():
+    vec = vector(xrange(BRANCH ** 2 + 3))
+    for protocol in xrange(pickle.HIGHEST_PROTOCOL + 1):
+        assert pickle.loads(pickle.dumps(vec, protocol)) == vec
+    new = pickle.loads(pickle.dumps(vec.transient()))
+    assert isinstance(new, TransientVector)
+    assert list(new.append(None)) == range(BRANCH ** 2 + 3) + [None]
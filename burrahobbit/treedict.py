@@ -18,30 +18,41 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
-from copy import copy
+from itertools import izip
+from operator import itemgetter
 from sys import version_info
 
-from burrahobbit._tree import NULLNODE, SENTINEL
-from burrahobbit.treeset import SetNode
+from burrahobbit import introspect
+from burrahobbit._tree import (
+    NULLNODE, SENTINEL, BRANCH, Node, _assemble, build, flatten, root_slots
+)
 
-class AssocNode(SetNode):
-    """ A AssocNode contains the actual key-value mapping. """
-    __slots__ = ['value']
-    def __init__(self, key, value):
-        SetNode.__init__(self, key)
-        self.value = value
-    
-    def __repr__(self):
-        return '<AssocNode(%r, %r)>' % (self.key, self.value)
-    
-    def __copy__(self):
-        return AssocNode(self.key, self.value)
-    
-    def __eq__(self, other):
-        return self.key == other.key and self.value == other.value
-    
-    def __neq__(self, other):
-        return self.key != other.key or self.value != other.value
+
+def _pairs(other):
+    """ Return iterable of the (key, value) pairs of other, which is either
+    a mapping or already an iterable of pairs. """
+    if hasattr(other, 'iteritems'):
+        return other.iteritems()
+    if hasattr(other, 'keys'):
+        return ((key, other[key]) for key in other.keys())
+    return other
+
+
+def _load(cls, flat):
+    """ Return map of type cls containing the associations in flat, which
+    is [key0, value0, key1, value1, ...]. Used to unpickle maps. """
+    itr = iter(flat)
+    return cls(build(
+        0, [(hash(key), key, value) for key, value in izip(itr, itr)]
+    ))
+
+
+def _map_values(job):
+    """ Return PersistentTreeMap with the keys of the map in the (fn, map)
+    pair job associated with fn of their values. Run by the processes of
+    the pool in PersistentTreeMap.parallel_map_values. """
+    fn, mp = job
+    return mp.map_values(fn)
 
 
 class PersistentTreeMap(object):
@@ -49,29 +60,80 @@ class PersistentTreeMap(object):
     def __init__(self, root=NULLNODE):
         self.root = root
     
+    def __len__(self):
+        return self.root.count
+    
     def __getitem__(self, key):
-        return self.root.get(hash(key), 0, key).value
+        value = self.root.find(hash(key), 0, key, SENTINEL)
+        if value is SENTINEL:
+            raise KeyError(key)
+        return value
+    
+    def __contains__(self, key):
+        return self.root.find(hash(key), 0, key, SENTINEL) is not SENTINEL
+    
+    def get(self, key, default=None):
+        """ Return the value associated with key, or default if there is
+        none. """
+        return self.root.find(hash(key), 0, key, default)
+    
+    def get_many(self, keys, default=None):
+        """ Return list of the values associated with the keys in the
+        iterable keys, with default for those that are not contained. """
+        find = self.root.find
+        return [find(hash(key), 0, key, default) for key in keys]
+    
+    def contains_many(self, keys):
+        """ Return list of bools telling for each key in the iterable keys
+        whether it is contained. """
+        find = self.root.find
+        return [
+            find(hash(key), 0, key, SENTINEL) is not SENTINEL for key in keys
+        ]
     
     def __and__(self, other):
-        return other.__class__(self.root & other.root)
+        return other.__class__(self._snapshot().root & other._snapshot().root)
     
     def __xor__(self, other):
-        return PersistentTreeMap(self.root ^ other.root)
+        return PersistentTreeMap(
+            self._snapshot().root ^ other._snapshot().root
+        )
     
     def __or__(self, other):
-        return PersistentTreeMap(self.root | other.root)
+        return PersistentTreeMap(
+            self._snapshot().root | other._snapshot().root
+        )
+    
+    def merge_with(self, fn, other):
+        """ Return PersistentTreeMap of the associations of self and other,
+        which is either a PersistentTreeMap or anything :meth:`construct`
+        accepts. If a key is contained in both, it is associated with
+        fn(value, othervalue), e.g. the sum of the values if fn is
+        operator.add.
+        
+        Both trees are walked together. Subtrees only contained in one of
+        them are reused as they are, and fn is only called for the keys
+        contained in both. """
+        if not isinstance(other, PersistentTreeMap):
+            other = PersistentTreeMap.construct(other)
+        return PersistentTreeMap(
+            self._snapshot().root.merge_with(fn, other._snapshot().root, 0)
+        )
     
     def __eq__(self, other):
         return self.root == other.root
     
-    def __neq__(self, other):
-        return self.root != other.root
+    def __ne__(self, other):
+        return not self == other
+    
+    def __hash__(self):
+        return hash(self.root)
     
     def assoc(self, key, value):
         """ Return copy of self with an association between key and value.
         May override an existing association. """
         return PersistentTreeMap(
-            self.root.assoc(hash(key), 0, AssocNode(key, value))
+            self.root.assoc(hash(key), 0, key, value)
         )
     
     def without(self, key):
@@ -80,22 +142,55 @@ class PersistentTreeMap(object):
             self.root.without(hash(key), 0, key)
         )
     
+    def assoc_many(self, pairs):
+        """ Return copy of self with associations between the keys and
+        values of the iterable of (key, value) pairs added. May override
+        existing associations.
+        
+        Unlike calling :meth:`assoc` for every pair, this copies every
+        node at most once, however many of the keys are below it. """
+        return self.transient().assoc_many(pairs).persistent()
+    
+    def without_many(self, keys):
+        """ Return copy of self with the keys of the iterable keys removed.
+        See :meth:`assoc_many`. """
+        return self.transient().without_many(keys).persistent()
+    
+    def update(self, other):
+        """ Return copy of self updated with the associations of other,
+        which is either a mapping or an iterable of (key, value) pairs,
+        like dict.update does. If other is a PersistentTreeMap, this is
+        self | other. """
+        if isinstance(other, PersistentTreeMap):
+            return self | other
+        return self.assoc_many(_pairs(other))
+    
+    def diff(self, other):
+        """ Yield (key, value, othervalue) for every key whose association
+        differs between self and other, i.e. that was added, removed or
+        changed on the way from self to other. value is
+        :data:`burrahobbit.MISSING` if key is only contained in other,
+        and othervalue is MISSING if it is only contained in self.
+        
+        Subtrees that other shares with self, as it does if it was
+        derived from self by assoc or without, are skipped, so the cost
+        is proportional to the number of changes rather than the size of
+        the maps. """
+        return self.root.diff(other.root, 0)
+    
     def __iter__(self):
         """ Yield keys for all items. """
-        for node in self.root:
-            yield node.key
+        return iter(self.root)
     
     iterkeys = __iter__
     
     def iteritems(self):
         """ Yield key, value pairs for all items. """
-        for node in self.root:
-            yield node.key, node.value
+        return self.root.iteritems()
     
     def itervalues(self):
         """ Yield values for all items. """
-        for node in self.root:
-            yield node.value
+        return self.root.itervalues()
     
     if version_info >= (3,):
         keys = iterkeys
@@ -106,27 +201,110 @@ class PersistentTreeMap(object):
         items = lambda self: list(self.iteritems())
         values = lambda self: list(self.itervalues())
     
+    def stats(self):
+        """ Return dict describing the shape and memory use of the tree.
+        See :func:`burrahobbit.introspect.stats`. """
+        return introspect.stats(self)
+    
+    def map_values(self, fn):
+        """ Return PersistentTreeMap with the keys of self associated with
+        fn of their values. Subtrees none of whose values fn returned
+        another object for are shared with self, so a transformation that
+        changes few values needs little new memory. """
+        return PersistentTreeMap(self._snapshot().root.map_values(fn))
+    
+    def filter(self, pred):
+        """ Return PersistentTreeMap of the associations of self for whose
+        key and value pred(key, value) returns true. Subtrees that keep
+        all their associations are shared with self. """
+        return PersistentTreeMap(self._snapshot().root.filter(pred))
+    
+    def split(self, k):
+        """ Return list of k PersistentTreeMaps that partition the
+        associations of self. Every one of them gets a contiguous range of
+        the slots of the root, chosen so that they contain about as many
+        associations as possible, and shares the subtrees below them with
+        self, so this takes O(BRANCH) time. Some may be empty, e.g. if k
+        is greater than the number of slots used. k must be between 1 and
+        BRANCH. See :meth:`join`. """
+        if not 1 <= k <= BRANCH:
+            raise ValueError("k must be between 1 and %d." % BRANCH)
+        root = self._snapshot().root
+        groups = [[]]
+        done = 0
+        for bit, slot in root_slots(root):
+            groups[-1].append((bit, slot))
+            if isinstance(slot, Node):
+                done += slot.count
+            else:
+                done += 1
+            # Close the group once the groups so far have their share.
+            if len(groups) < k and done * k >= root.count * len(groups):
+                groups.append([])
+        groups.extend([] for _ in xrange(k - len(groups)))
+        return [PersistentTreeMap(_assemble(group)) for group in groups]
+    
+    @staticmethod
+    def join(parts):
+        """ Return PersistentTreeMap of the associations of all maps in
+        the iterable parts. If they do not use the same slots of the root,
+        as the maps returned by :meth:`split` and maps derived from them
+        do not if all keys stay in their part, the root is assembled from
+        their slots in O(BRANCH). Otherwise, this is the union of parts,
+        and the last association with a key wins. """
+        parts = [part._snapshot() for part in parts]
+        slots = []
+        used = 0
+        for part in parts:
+            for bit, slot in root_slots(part.root):
+                if used & bit:
+                    new = PersistentTreeMap()
+                    for other in parts:
+                        new = new | other
+                    return new
+                used |= bit
+                slots.append((bit, slot))
+        slots.sort(key=itemgetter(0))
+        return PersistentTreeMap(_assemble(slots))
+    
+    def parallel_map_values(self, fn, pool, k=BRANCH):
+        """ Return PersistentTreeMap with the keys of self associated with
+        fn of their values. self is split into k parts (see :meth:`split`)
+        that are mapped by the processes of pool, e.g. a
+        multiprocessing.Pool, and joined again. fn has to be picklable,
+        i.e. defined at the top level of a module. """
+        jobs = [(fn, part) for part in self.split(k) if len(part)]
+        return PersistentTreeMap.join(pool.map(_map_values, jobs))
+    
+    def _snapshot(self):
+        """ Return a PersistentTreeMap of the current contents. """
+        return self
+    
+    def __reduce__(self):
+        # The associations are pickled as one flat list rather than the
+        # nodes. The tree is built anew when loading, because the hashes,
+        # and with them its shape, may differ in the loading process.
+        return _load, (self.__class__, flatten(self.root))
+    
     @staticmethod
     def from_itr(itr):
-        mp = TransientTreeMap()
-        for key, value in itr:
-            mp = mp.assoc(key, value)
-        return mp.persistent()        
+        """ Create PersistentTreeMap from iterable yielding (key, value)
+        pairs. If a key occurs more than once, the last value wins. """
+        return PersistentTreeMap(
+            build(0, [(hash(key), key, value) for key, value in itr])
+        )
     
     @staticmethod
     def from_dict(dct):
         """ Create PersistentTreeMap from existing dictionary. """
-        mp = TransientTreeMap()
-        for key, value in dct.iteritems():
-            mp = mp.assoc(key, value)
-        return mp.persistent()
+        return PersistentTreeMap.from_itr(dct.iteritems())
     
     def transient(self):
         """ Return transient (mutable) copy of self. Changing the copy will not
         affect the original object's immutability.
         
         See :class:`TransientTreeMap`. """
-        return TransientTreeMap(copy(self.root))
+        return TransientTreeMap(self.root)
     
     @staticmethod
     def construct(argument=SENTINEL, **kwargs):
@@ -141,11 +319,8 @@ class PersistentTreeMap(object):
         if isinstance(argument, dict):
             return PersistentTreeMap.from_dict(argument)
         
-        if isinstance(argument, TransientTreeMap):
-            return PersistentTreeMap(copy(argument.root))
-        
         if isinstance(argument, PersistentTreeMap):
-            return argument
+            return argument._snapshot()
                 
         return PersistentTreeMap.from_itr(argument)
 
@@ -156,7 +331,24 @@ class TransientTreeMap(PersistentTreeMap):
     changes to a PersistentTreeMap the immutability would prove inefficient.
     
     The function has to return transienttreemap.persistent() in order to ensure
-    that the treemap cannot be changed afterwards. """
+    that the treemap cannot be changed afterwards.
+    
+    Nodes created or copied by a TransientTreeMap are owned by its edit
+    token and modified in place by later changes, all other nodes are
+    copied on their first change. Hence, creating a transient is O(1). """
+    __slots__ = ['edit']
+    # Transients change, so they cannot be used as dictionary keys.
+    __hash__ = None
+    
+    def __init__(self, root=NULLNODE):
+        PersistentTreeMap.__init__(self, root)
+        self.edit = object()
+    
+    def _ensure_editable(self):
+        if self.edit is None:
+            raise RuntimeError("Transient used after persistent() call.")
+        return self.edit
+    
     def assoc(self, key, value):
         """ Update this TransientTreeMap to contain an association between
         key and value and return self. You should never assume that the
@@ -164,18 +356,58 @@ class TransientTreeMap(PersistentTreeMap):
         should always bind the return value of this function to the 
         respective name, e.g., `mymap.assoc("spam", "eggs")` should be avoided
         and written as `mymap = mymap.assoc("spam", "eggs")` instead. """
-        self.root = self.root._iassoc(hash(key), 0, AssocNode(key, value))
+        self.root = self.root._iassoc(
+            hash(key), 0, key, value, self._ensure_editable()
+        )
         return self
     
     def without(self, key):
         """ Remove key. """
-        self.root = self.root._iwithout(hash(key), 0, key)
+        self.root = self.root._iwithout(
+            hash(key), 0, key, self._ensure_editable()
+        )
+        return self
+    
+    def assoc_many(self, pairs):
+        """ Add associations between the keys and values of the iterable
+        of (key, value) pairs and return self. """
+        edit = self._ensure_editable()
+        for key, value in pairs:
+            self.root = self.root._iassoc(hash(key), 0, key, value, edit)
         return self
     
+    def without_many(self, keys):
+        """ Remove the keys of the iterable keys and return self. """
+        edit = self._ensure_editable()
+        for key in keys:
+            self.root = self.root._iwithout(hash(key), 0, key, edit)
+        return self
+    
+    def update(self, other):
+        """ Update self with the associations of other, which is either a
+        mapping or an iterable of (key, value) pairs, and return self. """
+        if isinstance(other, PersistentTreeMap):
+            self._ensure_editable()
+            self.root = self.root | other._snapshot().root
+            return self
+        return self.assoc_many(_pairs(other))
+    
+    def _snapshot(self):
+        """ Return a PersistentTreeMap of the current contents. The nodes
+        are no longer owned by self, so it may still be changed
+        afterwards. """
+        if self.edit is not None:
+            self.edit = object()
+        return PersistentTreeMap(self.root)
+    
+    def transient(self):
+        return self._snapshot().transient()
+    
     def persistent(self):
         """ Return a persistent version of self.
         
         CAUTION: The :class:`TransientTreeMap` MAY NOT BE USED
         after calling this method.
         """
+        self.edit = None
         return PersistentTreeMap(self.root)
@@ -18,82 +18,13 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
-from copy import copy
+from burrahobbit import introspect
+from burrahobbit._tree import NULLNODE, SENTINEL, MISSING, build, flatten
 
-from burrahobbit._tree import (
-    NULLNODE, GET, ASSOC, IASSOC, WITHOUT, doc, DispatchNode, HashCollisionNode
-)
 
-class SetNode(object):
-    """ A AssocNode contains the actual key-value mapping. """
-    __slots__ = ['key', 'hsh']
-    def __init__(self, key):
-        self.key = key
-        self.hsh = hash(key)
-    
-    def xor(self, hsh, shift, node):
-        if node.key == self.key:
-            return NULLNODE
-        else:
-            return self.assoc(hsh, shift, node)
-    
-    @doc(GET)
-    def get(self, hsh, shift, key):
-        # If the key does not match the key of the AssocNode, thus the hash
-        # matches to the current level, but it is not the correct node,
-        # raise a KeyError, otherwise return the value.
-        if key != self.key:
-            raise KeyError(key)
-        return self
-    
-    @doc(ASSOC)
-    def assoc(self, hsh, shift, node):
-        # If there is a hash-collision, return a HashCollisionNode,
-        # otherwise return a DispatchNode dispatching depending on the
-        # current level (if the two hashes only differ at a higher-level,
-        # DispatchNode.make will return a DispatchNode that contains a
-        # DispatchNode etc. up until the necessary depth.
-        if node.key == self.key:
-            return node
-        
-        if hsh == self.hsh:
-            return HashCollisionNode(
-                [self, node]
-            )
-        return DispatchNode.make(shift, [self, node])
-    
-    @doc(IASSOC)
-    def _iassoc(self, hsh, shift, node):
-        if node.key == self.key:
-            return node
-        
-        if hsh == self.hsh:
-            return HashCollisionNode(
-                [self, node]
-            )
-        return DispatchNode.make(shift, [self, node])        
-    
-    @doc(WITHOUT)
-    def without(self, hsh, shift, key):
-        # If the key matches the key of this AssocNode, returning NULLNODE
-        # will remove the Node from the map. Otherwise raise a KeyError.
-        if key != self.key:
-            raise KeyError(key)
-        return NULLNODE
-    
-    _iwithout = without
-    
-    def __iter__(self):
-        yield self
-    
-    def __copy__(self):
-        return SetNode(self.key)
-    
-    def __eq__(self, other):
-        return self.key == other.key
-    
-    def __neq__(self, other):
-        return self.key != other.key
+def _load(cls, keys):
+    """ Return set of type cls containing keys. Used to unpickle sets. """
+    return cls(build(0, [(hash(key), key, None) for key in keys]))
 
 
 class PersistentTreeSet(object):
@@ -101,33 +32,46 @@ class PersistentTreeSet(object):
     def __init__(self, root=NULLNODE):
         self.root = root
     
+    def __len__(self):
+        return self.root.count
+    
     def __contains__(self, key):
-        try:
-            self.root.get(hash(key), 0, key)
-            return True
-        except KeyError:
-            return False
+        return self.root.find(hash(key), 0, key, SENTINEL) is not SENTINEL
+    
+    def contains_many(self, keys):
+        """ Return list of bools telling for each key in the iterable keys
+        whether it is contained. """
+        find = self.root.find
+        return [
+            find(hash(key), 0, key, SENTINEL) is not SENTINEL for key in keys
+        ]
     
     def __and__(self, other):
-        return other.__class__(self.root & other.root)
+        return other.__class__(self._snapshot().root & other._snapshot().root)
     
     def __xor__(self, other):
-        return PersistentTreeSet(self.root ^ other.root)
+        return PersistentTreeSet(
+            self._snapshot().root ^ other._snapshot().root
+        )
     
     def __or__(self, other):
-        return PersistentTreeSet(self.root | other.root)
+        return PersistentTreeSet(
+            self._snapshot().root | other._snapshot().root
+        )
     
     def __eq__(self, other):
         return self.root == other.root
     
-    def __neq__(self, other):
-        return self.root != other.root
+    def __ne__(self, other):
+        return not self == other
+    
+    def __hash__(self):
+        return hash(self.root)
     
     def add(self, key):
-        """ Return copy of self with an association between key and value.
-        May override an existing association. """
+        """ Return copy of self with key added. """
         return PersistentTreeSet(
-            self.root.assoc(hash(key), 0, SetNode(key))
+            self.root.assoc(hash(key), 0, key, None)
         )
     
     def without(self, key):
@@ -136,22 +80,69 @@ class PersistentTreeSet(object):
             self.root.without(hash(key), 0, key)
         )
     
+    def add_many(self, keys):
+        """ Return copy of self with the keys of the iterable keys added.
+        
+        Unlike calling :meth:`add` for every key, this copies every node
+        at most once, however many of the keys are below it. """
+        return self.transient().add_many(keys).persistent()
+    
+    def without_many(self, keys):
+        """ Return copy of self with the keys of the iterable keys removed.
+        See :meth:`add_many`. """
+        return self.transient().without_many(keys).persistent()
+    
+    def update(self, other):
+        """ Return copy of self with the keys of the iterable other added.
+        If other is a PersistentTreeSet, this is self | other. """
+        if isinstance(other, PersistentTreeSet):
+            return self | other
+        return self.add_many(other)
+    
+    def diff(self, other):
+        """ Yield (key, added) for every key that is contained in exactly
+        one of self and other. added is True if it is contained in other.
+        
+        Like :meth:`PersistentTreeMap.diff`, this skips subtrees that
+        self and other share. """
+        for key, value, othervalue in self.root.diff(other.root, 0):
+            yield key, othervalue is not MISSING
+    
+    def filter(self, pred):
+        """ Return PersistentTreeSet of the keys of self for which
+        pred(key) returns true. Subtrees that keep all their keys are
+        shared with self. """
+        return PersistentTreeSet(
+            self._snapshot().root.filter(lambda key, value: pred(key))
+        )
+    
     def __iter__(self):
-        for node in self.root:
-            yield node.key
+        return iter(self.root)
+    
+    def stats(self):
+        """ Return dict describing the shape and memory use of the tree.
+        See :func:`burrahobbit.introspect.stats`. """
+        return introspect.stats(self)
+    
+    def _snapshot(self):
+        """ Return a PersistentTreeSet of the current contents. """
+        return self
+    
+    def __reduce__(self):
+        # See PersistentTreeMap.__reduce__.
+        return _load, (self.__class__, flatten(self.root)[::2])
     
     @staticmethod
     def from_set(set_):
         """ Create PersistentTreeSet from existing set. """
-        mp = TransientTreeSet()
-        for key in set_:
-            mp = mp.add(key)
-        return mp.persistent()
+        return PersistentTreeSet(
+            build(0, [(hash(key), key, None) for key in set_])
+        )
     
     @staticmethod
     def construct(iterable=None):
         if isinstance(iterable, PersistentTreeSet):
-            return PersistentTreeSet(copy(iterable.root))
+            return iterable._snapshot()
         if iterable is None:
             return PersistentTreeSet()
         
@@ -162,31 +153,78 @@ class PersistentTreeSet(object):
         affect the original object's immutability.
         
         See :class:`TransientTreeSet`. """
-        return TransientTreeSet(copy(self.root))
+        return TransientTreeSet(self.root)
 
 
 class TransientTreeSet(PersistentTreeSet):
+    """ Nodes created or copied by a TransientTreeSet are owned by its
+    edit token and modified in place by later changes, all other nodes
+    are copied on their first change. """
+    __slots__ = ['edit']
+    # Transients change, so they cannot be used as dictionary keys.
+    __hash__ = None
+    
+    def __init__(self, root=NULLNODE):
+        PersistentTreeSet.__init__(self, root)
+        self.edit = object()
+    
+    def _ensure_editable(self):
+        if self.edit is None:
+            raise RuntimeError("Transient used after persistent() call.")
+        return self.edit
+    
     def add(self, key):
-        """ Update this TransientTreeMap to contain an association between
-        key and value.
-        
-        USE WITH CAUTION: This should only be used if no other reference
-        to the PersistentTreeMap may exist. """
-        self.root = self.root.assoc(hash(key), 0, SetNode(key))
+        """ Add key in place and return self. """
+        self.root = self.root._iassoc(
+            hash(key), 0, key, None, self._ensure_editable()
+        )
         return self
     
     def without(self, key):
-        """ Remove key.
-        
-        USE WITH CAUTION: This should only be used if no other reference
-        to the PersistentTreeMap may exist. """
-        self.root = self.root._iwithout(hash(key), 0, key)
+        """ Remove key in place and return self. """
+        self.root = self.root._iwithout(
+            hash(key), 0, key, self._ensure_editable()
+        )
         return self
     
+    def add_many(self, keys):
+        """ Add the keys of the iterable keys and return self. """
+        edit = self._ensure_editable()
+        for key in keys:
+            self.root = self.root._iassoc(hash(key), 0, key, None, edit)
+        return self
+    
+    def without_many(self, keys):
+        """ Remove the keys of the iterable keys and return self. """
+        edit = self._ensure_editable()
+        for key in keys:
+            self.root = self.root._iwithout(hash(key), 0, key, edit)
+        return self
+    
+    def update(self, other):
+        """ Add the keys of the iterable other and return self. """
+        if isinstance(other, PersistentTreeSet):
+            self._ensure_editable()
+            self.root = self.root | other._snapshot().root
+            return self
+        return self.add_many(other)
+    
+    def _snapshot(self):
+        """ Return a PersistentTreeSet of the current contents. The nodes
+        are no longer owned by self, so it may still be changed
+        afterwards. """
+        if self.edit is not None:
+            self.edit = object()
+        return PersistentTreeSet(self.root)
+    
+    def transient(self):
+        return self._snapshot().transient()
+    
     def persistent(self):
         """ Return a persistent version of self.
         
-        CAUTION: The :class:`TransientTreeMap` MAY NOT BE USED
+        CAUTION: The :class:`TransientTreeSet` MAY NOT BE USED
         after calling this method.
         """
+        self.edit = None
         return PersistentTreeSet(self.root)
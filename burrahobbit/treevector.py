@@ -0,0 +1,391 @@
+# Copyright (C) 2011 by Florian Mayer <florian.mayer@bitsrc.org>
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from itertools import izip
+
+from burrahobbit._tree import SENTINEL, SHIFT, BMAP, BRANCH, ListDispatch
+from burrahobbit.util import all, chain_from_iterable
+
+
+class VectorNode(ListDispatch):
+    """ ListDispatch of the BRANCH children of a node of a vector, or of
+    its items if it is a leaf. Unused trailing slots are SENTINEL. edit
+    is the token of the transient that owns the node, if any. """
+    __slots__ = ['edit']
+    def __init__(self, items=None, edit=None):
+        ListDispatch.__init__(self, BRANCH, items)
+        self.edit = edit
+
+
+EMPTYNODE = VectorNode()
+
+
+def _editable(node, edit):
+    """ Return node if it is owned by edit, otherwise a copy of it that
+    is. """
+    if node.edit is edit:
+        return node
+    return VectorNode(node.items[:], edit)
+
+
+def _new_path(edit, level, node):
+    """ Return node below as many new nodes as needed to reach level. """
+    while level:
+        parent = VectorNode(None, edit)
+        parent.items[0] = node
+        node = parent
+        level -= SHIFT
+    return node
+
+
+def _push_tail(edit, length, level, node, leaf):
+    """ Return node on level with leaf appended as the leaf that holds the
+    items from length - BRANCH on. """
+    node = _editable(node, edit)
+    sub = (length - 1) >> level & BMAP
+    if level == SHIFT:
+        node.items[sub] = leaf
+    else:
+        child = node.items[sub]
+        if child is SENTINEL:
+            child = _new_path(edit, level - SHIFT, leaf)
+        else:
+            child = _push_tail(edit, length, level - SHIFT, child, leaf)
+        node.items[sub] = child
+    return node
+
+
+def _pop_tail(edit, length, level, node):
+    """ Return node on level without its last leaf, or None if that was
+    the only one below it. """
+    sub = (length - 2) >> level & BMAP
+    if level > SHIFT:
+        child = _pop_tail(edit, length, level - SHIFT, node.items[sub])
+        if child is None and sub == 0:
+            return None
+        node = _editable(node, edit)
+        if child is None:
+            node.items[sub] = SENTINEL
+        else:
+            node.items[sub] = child
+        return node
+    if sub == 0:
+        return None
+    node = _editable(node, edit)
+    node.items[sub] = SENTINEL
+    return node
+
+
+def _assoc(edit, level, node, idx, value):
+    """ Return node on level with the item at idx replaced by value. """
+    node = _editable(node, edit)
+    if level == 0:
+        node.items[idx & BMAP] = value
+    else:
+        sub = idx >> level & BMAP
+        node.items[sub] = _assoc(
+            edit, level - SHIFT, node.items[sub], idx, value
+        )
+    return node
+
+
+def _load(cls, items):
+    """ Return vector of type cls containing items. Used to unpickle
+    vectors. """
+    vec = PersistentVector.from_itr(items)
+    return cls(vec.length, vec.shift, vec.root, vec.tail)
+
+
+class PersistentVector(object):
+    """ Sequence of items that are stored in the leaves of a tree with
+    BRANCH children per node, the i-th item at the path given by the
+    digits of i in base BRANCH. The last up to BRANCH items are kept in
+    the list tail instead, so appending only adds a leaf to the tree
+    once every BRANCH items.
+    
+    shift is the level of the root, the items below it are found by
+    shifting their indices right by shift, shift - SHIFT, ..., SHIFT. """
+    __slots__ = ['length', 'shift', 'root', 'tail']
+    def __init__(self, length=0, shift=SHIFT, root=EMPTYNODE, tail=None):
+        if tail is None:
+            tail = []
+        self.length = length
+        self.shift = shift
+        self.root = root
+        self.tail = tail
+    
+    def __len__(self):
+        return self.length
+    
+    def _tailoff(self):
+        """ Return the index of the first item in tail. """
+        if self.length < BRANCH:
+            return 0
+        return (self.length - 1) >> SHIFT << SHIFT
+    
+    def _leaf(self, idx):
+        """ Return list of the BRANCH items the one at idx is one of. """
+        if idx >= self._tailoff():
+            return self.tail
+        node = self.root
+        level = self.shift
+        while level:
+            node = node.items[idx >> level & BMAP]
+            level -= SHIFT
+        return node.items
+    
+    def _index(self, idx):
+        """ Return idx as non-negative index. Negative ones count from the
+        end, like for lists. Raise IndexError if it is out of range. """
+        if idx < 0:
+            idx += self.length
+        if not 0 <= idx < self.length:
+            raise IndexError('vector index out of range')
+        return idx
+    
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(self.length)
+            if step == 1:
+                return PersistentVector.from_itr(self._iter(start, stop))
+            return PersistentVector.from_itr(
+                self[pos] for pos in xrange(start, stop, step)
+            )
+        idx = self._index(idx)
+        return self._leaf(idx)[idx & BMAP]
+    
+    def _chunks(self, start, stop):
+        """ Yield the slices of the leaves holding the items from start to
+        stop. """
+        while start < stop:
+            base = start >> SHIFT << SHIFT
+            end = min(base + BRANCH, stop)
+            yield self._leaf(start)[start - base:end - base]
+            start = end
+    
+    def _iter(self, start, stop):
+        """ Yield the items from start to stop. """
+        return chain_from_iterable(self._chunks(start, stop))
+    
+    def __iter__(self):
+        return self._iter(0, self.length)
+    
+    def __eq__(self, other):
+        if other is self:
+            return True
+        if not isinstance(other, PersistentVector):
+            return False
+        return len(self) == len(other) and all(
+            item == otheritem for item, otheritem in izip(self, other)
+        )
+    
+    def __ne__(self, other):
+        return not self == other
+    
+    def __hash__(self):
+        return hash(tuple(self))
+    
+    def _iappend(self, value, edit):
+        """ Append value to self, whose tail must not be shared. """
+        if self.length - self._tailoff() < BRANCH:
+            self.tail.append(value)
+            self.length += 1
+            return
+        
+        # The tail is full, so it becomes a leaf of the tree. If the tree
+        # is full as well, it gets a new root.
+        leaf = VectorNode(self.tail, edit)
+        if self.length >> SHIFT > 1 << self.shift:
+            root = VectorNode(None, edit)
+            root.items[0] = self.root
+            root.items[1] = _new_path(edit, self.shift, leaf)
+            self.root = root
+            self.shift += SHIFT
+        else:
+            self.root = _push_tail(
+                edit, self.length, self.shift, self.root, leaf
+            )
+        self.tail = [value]
+        self.length += 1
+    
+    def _iassoc(self, idx, value, edit):
+        """ Replace the item at idx of self, whose tail must not be shared,
+        by value. idx may be len(self), which appends value. """
+        if idx == self.length:
+            self._iappend(value, edit)
+            return
+        idx = self._index(idx)
+        if idx >= self._tailoff():
+            self.tail[idx & BMAP] = value
+        else:
+            self.root = _assoc(edit, self.shift, self.root, idx, value)
+    
+    def _ipop(self, edit):
+        """ Remove the last item of self, whose tail must not be shared. """
+        if not self.length:
+            raise IndexError('pop from empty vector')
+        if self.length == 1:
+            self.length = 0
+            self.shift = SHIFT
+            self.root = EMPTYNODE
+            self.tail = []
+            return
+        if self.length - self._tailoff() > 1:
+            self.tail.pop()
+            self.length -= 1
+            return
+        
+        # The tail only holds the last item, so the last leaf of the tree
+        # becomes the new tail. If that leaves the root with one child
+        # only, the child becomes the new root.
+        tail = self._leaf(self.length - 2)[:]
+        root = _pop_tail(edit, self.length, self.shift, self.root)
+        if root is None:
+            root = EMPTYNODE
+        if self.shift > SHIFT and root.items[1] is SENTINEL:
+            root = root.items[0]
+            self.shift -= SHIFT
+        self.root = root
+        self.tail = tail
+        self.length -= 1
+    
+    def _copy(self):
+        """ Return copy of self that does not share its tail. """
+        return PersistentVector(
+            self.length, self.shift, self.root, self.tail[:]
+        )
+    
+    # The persistent operations are the in-place ones on a copy, with a
+    # token that was just created. As no node is owned by it, every node
+    # on the path is copied.
+    
+    def append(self, value):
+        """ Return copy of self with value appended. """
+        new = self._copy()
+        new._iappend(value, object())
+        return new
+    
+    def assoc(self, idx, value):
+        """ Return copy of self with the item at idx replaced by value.
+        idx may be len(self), which appends value. """
+        new = self._copy()
+        new._iassoc(idx, value, object())
+        return new
+    
+    def pop(self):
+        """ Return copy of self without its last item. """
+        new = self._copy()
+        new._ipop(object())
+        return new
+    
+    def extend(self, iterable):
+        """ Return copy of self with the items of iterable appended. """
+        return self.transient().extend(iterable).persistent()
+    
+    def _snapshot(self):
+        """ Return a PersistentVector of the current contents. """
+        return self
+    
+    def __reduce__(self):
+        return _load, (self.__class__, list(self))
+    
+    @staticmethod
+    def from_itr(itr):
+        """ Create PersistentVector from the items of the iterable itr. """
+        return TransientVector().extend(itr).persistent()
+    
+    @staticmethod
+    def construct(iterable=None):
+        if isinstance(iterable, PersistentVector):
+            return iterable._snapshot()
+        if iterable is None:
+            return PersistentVector()
+        
+        return PersistentVector.from_itr(iterable)
+    
+    def transient(self):
+        """ Return transient (mutable) copy of self. Changing the copy will not
+        affect the original object's immutability.
+        
+        See :class:`TransientVector`. """
+        return TransientVector(self.length, self.shift, self.root, self.tail)
+
+
+class TransientVector(PersistentVector):
+    """ Nodes created or copied by a TransientVector are owned by its
+    edit token and modified in place by later changes, all other nodes
+    are copied on their first change. Its tail is never shared. """
+    __slots__ = ['edit']
+    # Transients change, so they cannot be used as dictionary keys.
+    __hash__ = None
+    
+    def __init__(self, length=0, shift=SHIFT, root=EMPTYNODE, tail=None):
+        if tail is None:
+            tail = []
+        PersistentVector.__init__(self, length, shift, root, tail[:])
+        self.edit = object()
+    
+    def _ensure_editable(self):
+        if self.edit is None:
+            raise RuntimeError("Transient used after persistent() call.")
+        return self.edit
+    
+    def append(self, value):
+        """ Append value and return self. """
+        self._iappend(value, self._ensure_editable())
+        return self
+    
+    def assoc(self, idx, value):
+        """ Replace the item at idx by value and return self. idx may be
+        len(self), which appends value. """
+        self._iassoc(idx, value, self._ensure_editable())
+        return self
+    
+    def pop(self):
+        """ Remove the last item and return self. """
+        self._ipop(self._ensure_editable())
+        return self
+    
+    def extend(self, iterable):
+        """ Append the items of iterable and return self. """
+        edit = self._ensure_editable()
+        for value in iterable:
+            self._iappend(value, edit)
+        return self
+    
+    def _snapshot(self):
+        """ Return a PersistentVector of the current contents. The nodes
+        are no longer owned by self, so it may still be changed
+        afterwards. """
+        if self.edit is not None:
+            self.edit = object()
+        return self._copy()
+    
+    def transient(self):
+        return self._snapshot().transient()
+    
+    def persistent(self):
+        """ Return a persistent version of self.
+        
+        CAUTION: The :class:`TransientVector` MAY NOT BE USED
+        after calling this method.
+        """
+        self.edit = None
+        return PersistentVector(self.length, self.shift, self.root, self.tail)
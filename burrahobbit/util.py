@@ -18,6 +18,8 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+from itertools import chain
+
 def _all(iterable):
     for elem in iterable:
         if not elem:
@@ -28,3 +30,14 @@ try:
     all = all
 except NameError:
     all = _all
+
+
+def _chain_from_iterable(iterables):
+    for iterable in iterables:
+        for elem in iterable:
+            yield elem
+
+try:
+    chain_from_iterable = chain.from_iterable
+except AttributeError:
+    chain_from_iterable = _chain_from_iterable